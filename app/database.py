@@ -520,9 +520,116 @@ async def init_db():
         ("user_id", 1),
         ("status", 1)
     ])
-    
+    # Only one resumable count per user
+    await db.count_sessions.create_index(
+        "user_id",
+        unique=True,
+        partialFilterExpression={"status": "in_progress"},
+        name="user_id_active_count"
+    )
+
     await db.inventory.create_index("name", unique=True)
 
+    # Filter + sort indexes for the faceted inventory query (keyset on _id)
+    await db.inventory.create_index([("name", 1), ("_id", 1)])
+    await db.inventory.create_index([("current_stock", 1), ("_id", 1)])
+    for field in ("supplier", "category"):
+        await db.inventory.create_index([(field, 1), ("_id", 1)])
+    # Equality filters sorted by name
+    for field in ("supplier", "category", "stock_status"):
+        await db.inventory.create_index([(field, 1), ("name", 1), ("_id", 1)])
+
+    # Movement ledger scans by time and point-in-time checkpoints
+    await db.stock_movements.create_index([("timestamp", 1), ("_id", 1)])
+    await db.stock_checkpoints.create_index("as_of", unique=True)
+    # Per-item ledger streaming for the consistency check
+    await db.stock_movements.create_index([("item_id", 1), ("timestamp", 1), ("_id", 1)])
+    await db.ledger_checks.create_index("started_at")
+    # Movements written by order receiving, looked up per order
+    await db.stock_movements.create_index(
+        "order_id", partialFilterExpression={"order_id": {"$exists": True}}
+    )
+
+    # Backfill stock_status on items created before it was stored
+    from .services.inventory import refresh_stock_status
+    await refresh_stock_status(db, {"stock_status": {"$exists": False}})
+
+    # Backfill running totals on registers created before they were stored
+    from .services.cash_register import refresh_register_totals
+    await refresh_register_totals(db, {"total_income": {"$exists": False}})
+
+    # One vault ledger entry per closed register; migrate existing history once
+    await db.vault_ledger.create_index("register_id", unique=True)
+    vault = await db.vault.find_one({}, {"closed_balance": 1})
+    if not vault or "closed_balance" not in vault:
+        from .services.cash_register import rebuild_vault_balance
+        await rebuild_vault_balance(db)
+
+    # Closed register listing, keyset paginated on (date, _id) within a range
+    await db.cash_register.create_index([("status", 1), ("date", -1), ("_id", -1)])
+
+    # Orders listing, keyset paginated on (created_at, _id) under each filter
+    await db.orders.create_index([("status", 1), ("created_at", -1), ("_id", -1)])
+    await db.orders.create_index([("created_at", -1), ("_id", -1)])
+    await db.orders.create_index([("items.supplier", 1), ("created_at", -1), ("_id", -1)])
+    # Items on open orders, skipped by the suggestion engine
+    await db.orders.create_index([("status", 1), ("items.item_id", 1)])
+
+    # One pending suggestion line per item, listed by priority and supplier
+    from .services.order_suggestions import retire_legacy_suggestions
+    await retire_legacy_suggestions(db)
+    await db.order_suggestions.create_index(
+        [("item_id", 1), ("status", 1)],
+        unique=True,
+        partialFilterExpression={"status": "pending", "item_id": {"$exists": True}},
+        name="single_pending_suggestion"
+    )
+    await db.order_suggestions.create_index([("status", 1), ("priority", 1), ("supplier", 1), ("name", 1)])
+
+    # Arrivals recorded by order receiving, read per supplier and per order
+    await db.arrivals.create_index([("supplier", 1), ("arrival_date", -1)])
+    await db.arrivals.create_index("order_id")
+
+    # One purchase order per supplier and week
+    await db.purchase_orders.create_index([("week", 1), ("supplier", 1)], unique=True)
+    # Items on drafts, kept out of new suggestions
+    await db.purchase_orders.create_index([("status", 1), ("lines.item_id", 1)])
+    await db.suppliers.create_index("name", unique=True)
+    # One price per item and supplier, read per item by the weekly split
+    await db.supplier_prices.create_index([("item_id", 1), ("supplier", 1)], unique=True)
+
+    # Rollups of fully closed days; backfilled daily, kept current on close/edit
+    await db.cash_daily_rollups.create_index("date")
+    from .services.cash_reports import backfill_rollups
+    await backfill_rollups(db)
+
+    # At most one open register; opening is a single guarded insert
+    try:
+        await db.cash_register.create_index(
+            "status",
+            unique=True,
+            partialFilterExpression={"status": "open"},
+            name="single_open_register"
+        )
+    except Exception as e:
+        logger.error(f"Could not enforce a single open register, close the extra ones: {e}")
+
+    # Transactions live in cash_transactions, paged by (time, _id)
+    await db.cash_transactions.create_index([("cash_register_id", 1), ("time", 1), ("_id", 1)])
+    await db.cash_transactions.create_index(
+        [("cash_register_id", 1), ("seq", 1)],
+        unique=True,
+        partialFilterExpression={"seq": {"$exists": True}}
+    )
+    # Client idempotency keys, so retried and re-sent sales are stored once
+    await db.cash_transactions.create_index(
+        [("cash_register_id", 1), ("client_id", 1)],
+        unique=True,
+        partialFilterExpression={"client_id": {"$type": "string"}}
+    )
+    from .services.cash_register import migrate_embedded_transactions
+    await migrate_embedded_transactions(db)
+
     # Initialize cash register collections
     from scripts.init_cash_register import init_cash_register_collections
     await init_cash_register_collections()
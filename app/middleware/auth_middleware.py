@@ -57,6 +57,7 @@ async def verify_permissions(request: Request, call_next):
 
         # Set basic user info in request state
         request.state.user = {
+            "_id": str(user["_id"]),
             "username": user["username"],
             "is_admin": user["role"] == "admin",
             "role": user["role"]
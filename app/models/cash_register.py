@@ -25,6 +25,9 @@ class CashRegister(BaseModel):
     verified_by: Optional[str] = None
     status: str = "open"  # open, closed
     transactions: List[Transaction] = Field(default_factory=list)
+    total_income: float = Field(default=0.00)
+    total_expenses: float = Field(default=0.00)
+    transaction_count: int = Field(default=0)
     final_count: Optional[float] = None
     final_verification_time: Optional[datetime] = None
     final_verified_by: Optional[str] = None
@@ -31,6 +31,11 @@ class ArrivalControl(BaseModel):
     quantity: float
     arrival_date: datetime = datetime.now()
     received_by: str
+    item_id: Optional[str] = None
+    supplier: Optional[str] = None
+    order_id: Optional[str] = None
+    ordered: Optional[float] = None
+    lead_time_days: Optional[float] = None
 
 DEFAULT_SUPPLIERS = [
     "ACACIAS", "AMAZON", "CARLOS ROLLOS PACK", "COSTCO", "DEPOT",
@@ -0,0 +1,147 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = {"current_stock", "to_order", "min_stock", "max_stock"}
+
+
+class InventoryView:
+    """A named projection of the inventory collection.
+
+    Each view fetches only the fields one use case needs and fills missing
+    ones with that use case's defaults while materializing rows.
+    """
+    __slots__ = ("name", "fields", "projection", "defaults")
+
+    def __init__(self, name: str, fields: Tuple[str, ...], defaults: Dict[str, Any] = None):
+        self.name = name
+        self.fields = fields
+        self.projection = {field: 1 for field in fields}
+        defaults = defaults or {}
+        self.defaults = tuple(defaults.get(field) for field in fields)
+
+    def row(self, doc: Dict[str, Any]) -> "InventoryRow":
+        values = []
+        for field, default in zip(self.fields, self.defaults):
+            value = doc.get(field)
+            if value is None:
+                value = default
+            elif field in NUMERIC_FIELDS:
+                value = float(value)
+            values.append(value)
+        return InventoryRow(doc["_id"], self, tuple(values))
+
+
+class InventoryRow:
+    """Compact, tuple-backed inventory record tied to the view that loaded it"""
+    __slots__ = ("id", "view", "values")
+
+    def __init__(self, id, view: InventoryView, values: tuple):
+        self.id = id
+        self.view = view
+        self.values = values
+
+    def get(self, field: str, default: Any = None) -> Any:
+        try:
+            return self.values[self.view.fields.index(field)]
+        except ValueError:
+            return default
+
+    def to_template(self) -> Dict[str, Any]:
+        """Dict for Jinja templates, keeping datetimes as objects"""
+        item = dict(zip(self.view.fields, self.values))
+        item["_id"] = str(self.id)
+        return item
+
+    def to_json(self) -> Dict[str, Any]:
+        """JSON-ready dict with string ids and ISO dates"""
+        item = {"_id": str(self.id)}
+        for field, value in zip(self.view.fields, self.values):
+            item[field] = value.isoformat() if isinstance(value, datetime) else value
+        return item
+
+
+# Inventory page table
+PAGE_VIEW = InventoryView(
+    "page",
+    ("name", "current_stock", "unit", "supplier", "category", "min_stock",
+     "max_stock", "last_count", "last_updated", "last_updated_by"),
+    defaults={
+        "current_stock": 0.0,
+        "unit": "",
+        "supplier": "",
+        "category": "Sin Categoría",
+        "min_stock": 5.0,
+        "max_stock": 30.0
+    }
+)
+
+# GET /api/inventory, same fields and defaults as the InventoryItem model
+API_VIEW = InventoryView(
+    "api",
+    ("name", "current_stock", "unit", "to_order", "supplier", "category",
+     "min_stock", "max_stock", "last_updated", "location", "notes"),
+    defaults={
+        "current_stock": 0.0,
+        "unit": "",
+        "to_order": 0.0,
+        "supplier": "",
+        "category": "Sin Categoría",
+        "min_stock": 0.0,
+        "max_stock": 0.0,
+        "location": "",
+        "notes": ""
+    }
+)
+
+# Faceted query endpoint rows
+QUERY_VIEW = InventoryView(
+    "query",
+    ("name", "current_stock", "unit", "supplier", "category", "min_stock",
+     "max_stock", "stock_status", "last_count", "last_updated"),
+    defaults={
+        "current_stock": 0.0,
+        "unit": "",
+        "supplier": "",
+        "category": "Sin Categoría",
+        "min_stock": 0.0,
+        "max_stock": 0.0
+    }
+)
+
+# Autocomplete results
+SEARCH_VIEW = InventoryView(
+    "search",
+    ("name", "supplier", "category", "current_stock", "unit"),
+    defaults={"supplier": "", "category": "Sin Categoría", "current_stock": 0.0, "unit": ""}
+)
+
+
+async def list_items(
+    db,
+    view: InventoryView,
+    query: Optional[Dict[str, Any]] = None,
+    sort: str = "name",
+    limit: int = 0
+) -> List[InventoryRow]:
+    """Fetch items through a view's projection and materialize them as rows"""
+    cursor = db.inventory.find(query or {}, view.projection).sort(sort, 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [view.row(doc) async for doc in cursor]
+
+
+async def search_items(db, q: str, limit: int = 10) -> List[InventoryRow]:
+    """Autocomplete search on name, supplier and category"""
+    pattern = {"$regex": re.escape(q), "$options": "i"}
+    query = {
+        "$or": [
+            {"name": pattern},
+            {"supplier": pattern},
+            {"category": pattern}
+        ]
+    }
+    return await list_items(db, SEARCH_VIEW, query, limit=limit)
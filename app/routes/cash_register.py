@@ -7,10 +7,52 @@ from fastapi.templating import Jinja2Templates
 from ..models.cash_register import CashRegister, CashEntry, Transaction
 from ..database import get_db
 from ..utils.template_utils import process_template_data
+from ..utils.versioning import bump_version, conditional_get
+from ..services.cash_register import (
+    REGISTER_HEADER_PROJECTION,
+    TRANSACTION_PAGE_SIZE,
+    TRANSACTION_TYPES,
+    empty_totals,
+    fold_register_into_vault,
+    get_vault_total,
+    iter_transactions,
+    list_transactions,
+    next_register_number,
+    rebuild_vault_balance,
+    record_transaction,
+    record_transactions,
+    register_totals,
+    release_register_number,
+    replace_transactions,
+    sync_register_in_vault,
+    transactions_since
+)
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from ..services.cash_reports import day_start, refresh_rollup_day
+from ..services.inventory_query import InvalidCursor
+from ..services.cash_forecast import (
+    MAX_FORECAST_DAYS,
+    income_forecast,
+    invalidate_income_forecast,
+    record_closed_income
+)
+from ..services.cash_analytics import (
+    discrepancy_report,
+    invalidate_discrepancy_report,
+    record_closed_register
+)
+from ..services.cash_export import (
+    XLSX_MEDIA_TYPE,
+    export_cash_range,
+    render_register_xlsx,
+    run_in_pool
+)
+from starlette.background import BackgroundTask
 import logging
-import pandas as pd
 import io
-import xlsxwriter
+import math
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -44,19 +86,21 @@ async def cash_register_page(request: Request):
         # Get only open register, regardless of date
         current_register = await db.cash_register.find_one(
             {"status": "open"},
+            REGISTER_HEADER_PROJECTION,
             sort=[("initial_count_time", -1)]
         )
         
-        # Get transactions if register exists and is open
+        vault_total = await get_vault_total(db, open_register=current_register)
+
+        # Latest page of transactions if register exists and is open
         transactions = []
+        transactions_cursor = None
         if current_register:
-            transactions = current_register.get("transactions", [])
+            page = await list_transactions(db, current_register["_id"])
+            transactions_cursor = page["next_cursor"]
             # Serialize the register and transactions
             current_register = serialize_doc(current_register)
-            transactions = serialize_doc(transactions)
-        
-        # Get vault total
-        vault_total = await get_vault_total(db)
+            transactions = serialize_doc(page["items"])
         
         return templates.TemplateResponse(
             "cash_register.html",
@@ -64,6 +108,7 @@ async def cash_register_page(request: Request):
                 "request": request,
                 "current_register": current_register,
                 "transactions": transactions,
+                "transactions_cursor": transactions_cursor,
                 "vault_total": vault_total,
                 "is_admin": request.state.user.get("is_admin", False)
             }
@@ -87,6 +132,7 @@ async def create_cash_entry(request: Request, entry: CashEntry):
         entry_dict = entry.dict()
         entry_dict["created_by"] = token_data["username"]
         result = await db.cash_register.insert_one(entry_dict)
+        bump_version("cash_register")
         return {"id": str(result.inserted_id)}
     except Exception as e:
         logger.error(f"Create entry error: {str(e)}")
@@ -112,7 +158,7 @@ async def get_cash_entries(
                 "$gte": datetime.combine(start_date, datetime.min.time()),
                 "$lte": datetime.combine(end_date, datetime.max.time())
             }
-        entries = await db.cash_register.find(query).sort("date", -1).to_list(1000)
+        entries = await db.cash_register.find(query, REGISTER_HEADER_PROJECTION).sort("date", -1).to_list(1000)
         return entries
     except Exception as e:
         logger.error(f"API error: {str(e)}")
@@ -134,15 +180,34 @@ async def update_cash_entry(
         if not token_data or not token_data.get("is_admin"):
             raise HTTPException(status_code=403, detail="Not authorized")
 
-        update_result = await db.cash_register.update_one(
+        update = entry_update.dict(exclude_unset=True)
+        # Transactions live in cash_transactions, not on the register
+        transactions = update.pop("transactions", None)
+        previous = await db.cash_register.find_one_and_update(
             {"_id": ObjectId(entry_id)},
-            {"$set": entry_update.dict(exclude_unset=True)}
+            {"$set": update},
+            projection={"date": 1}
         )
+        bump_version("cash_register")
         
-        if update_result.modified_count == 0:
+        if not previous:
             raise HTTPException(status_code=404, detail="Entry not found")
-        
-        return await db.cash_register.find_one({"_id": ObjectId(entry_id)})
+
+        if transactions is not None:
+            await replace_transactions(db, ObjectId(entry_id), [
+                {**t, "time": datetime.fromisoformat(t["time"]) if isinstance(t["time"], str) else t["time"]}
+                for t in transactions
+            ])
+        await sync_register_in_vault(db, ObjectId(entry_id))
+
+        updated = await db.cash_register.find_one({"_id": ObjectId(entry_id)}, REGISTER_HEADER_PROJECTION)
+        # The date may have moved the register to another day
+        for day in {day_start(previous["date"]), day_start(updated["date"])}:
+            await refresh_rollup_day(db, day)
+        invalidate_discrepancy_report()
+        invalidate_income_forecast()
+        
+        return updated
     except Exception as e:
         logger.error(f"Update entry error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))  # Fixed missing parenthesis here
@@ -159,9 +224,18 @@ async def delete_cash_entry(request: Request, entry_id: str):
         if not token_data or not token_data.get("is_admin"):
             raise HTTPException(status_code=403, detail="Not authorized")
 
-        result = await db.cash_register.delete_one({"_id": ObjectId(entry_id)})
-        if result.deleted_count == 0:
+        deleted = await db.cash_register.find_one_and_delete(
+            {"_id": ObjectId(entry_id)},
+            projection={"date": 1}
+        )
+        bump_version("cash_register")
+        if not deleted:
             raise HTTPException(status_code=404, detail="Entry not found")
+        await db.cash_transactions.delete_many({"cash_register_id": ObjectId(entry_id)})
+        await sync_register_in_vault(db, ObjectId(entry_id))
+        await refresh_rollup_day(db, deleted["date"])
+        invalidate_discrepancy_report()
+        invalidate_income_forecast()
         
         return {"message": "Entry deleted successfully"}
     except Exception as e:
@@ -181,6 +255,7 @@ async def add_log_entry(db, register_id: ObjectId, action: str, details: str, us
         {"_id": register_id},
         {"$push": {"logs": log_entry}}
     )
+    bump_version("cash_register")
 
 @api_router.post("/", response_model=dict)
 async def create_cash_entry(request: Request):
@@ -189,52 +264,45 @@ async def create_cash_entry(request: Request):
         data = await request.json()
         db = await get_db()
         
-        # Check only for OPEN registers
-        existing_open_register = await db.cash_register.find_one({
-            "status": "open"  # Only check status, regardless of date
-        })
-        
-        if existing_open_register:
-            raise HTTPException(
-                status_code=400, 
-                detail="Existe un registro abierto. Debe cerrarlo antes de abrir uno nuevo."
-            )
-        
-        # Get today's registers for numbering
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        tomorrow = today + timedelta(days=1)
-        register_count = await db.cash_register.count_documents({
-            "date": {"$gte": today, "$lt": tomorrow}
-        })
+        # Sequential number for the day, handed out atomically
+        register_date = datetime.fromisoformat(data["date"])
+        register_number = await next_register_number(db, register_date)
+        opened_at = datetime.now()
         
         # Create new entry
         entry = {
-            "date": datetime.fromisoformat(data["date"]),
+            "date": register_date,
             "initial_amount": 200.00,
             "initial_amount_verified": data["initial_amount_verified"],
             "initial_amount_counted": data["initial_amount_counted"],
             "initial_count_time": datetime.fromisoformat(data["initial_count_time"]),
             "verified_by": user["username"],
             "status": "open",
-            "transactions": [],
+            **empty_totals(),
             "final_count": None,
             "final_verification_time": None,
             "final_verified_by": None,
             "notes": data.get("notes", ""),
             "responsible": data["responsible"],
-            "register_number": register_count + 1  # Sequential number for the day
+            "register_number": register_number,
+            "logs": [{
+                "timestamp": opened_at,
+                "action": "APERTURA",
+                "details": f"Caja #{register_number} iniciada con ${float(data['initial_amount_counted']):.2f}",
+                "user": user["username"]
+            }]
         }
         
-        result = await db.cash_register.insert_one(entry)
-        
-        # Add initial log entry
-        await add_log_entry(
-            db,
-            result.inserted_id,
-            "APERTURA",
-            f"Caja #{register_count + 1} iniciada con ${entry['initial_amount_counted']:.2f}",
-            user["username"]
-        )
+        # The partial unique index on open registers guards the insert
+        try:
+            result = await db.cash_register.insert_one(entry)
+        except DuplicateKeyError:
+            await release_register_number(db, register_date, register_number)
+            raise HTTPException(
+                status_code=400, 
+                detail="Existe un registro abierto. Debe cerrarlo antes de abrir uno nuevo."
+            )
+        bump_version("cash_register")
         
         return {"success": True, "id": str(result.inserted_id)}
         
@@ -244,6 +312,51 @@ async def create_cash_entry(request: Request):
         logger.error(f"Error creating cash entry: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))  # Fixed parenthesis
 
+# Largest queued batch accepted from a client in one request
+MAX_TRANSACTION_BATCH = 500
+
+def parse_transaction(data: dict, user: dict) -> dict:
+    """Validate a client transaction and build the row to store"""
+    if data.get("type") not in TRANSACTION_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid transaction type")
+    try:
+        amount = float(data.get("amount", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid amount")
+    if not math.isfinite(amount) or amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+
+    transaction = {
+        "type": data["type"],
+        "amount": amount,
+        "description": str(data.get("description") or ""),
+        "time": datetime.now(),
+        "recorded_by": user["username"]
+    }
+
+    # Idempotency key generated by the client, retries reuse it
+    client_id = data.get("client_id")
+    if client_id:
+        if not isinstance(client_id, str) or len(client_id) > 64:
+            raise HTTPException(status_code=400, detail="Invalid client_id")
+        transaction["client_id"] = client_id
+
+    # Sales queued offline keep the time they were rung up
+    if data.get("time"):
+        try:
+            recorded_at = datetime.fromisoformat(str(data["time"]).replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid time")
+        if recorded_at.tzinfo:
+            recorded_at = recorded_at.astimezone().replace(tzinfo=None)
+        transaction["time"] = min(recorded_at, transaction["time"])
+    return transaction
+
+async def register_missing_or_closed(db, entry_id: str):
+    if not await db.cash_register.count_documents({"_id": ObjectId(entry_id)}, limit=1):
+        raise HTTPException(status_code=404, detail="Register not found")
+    raise HTTPException(status_code=400, detail="Register is closed")
+
 @api_router.post("/{entry_id}/transactions")
 async def add_transaction(entry_id: str, request: Request):
     try:
@@ -251,66 +364,159 @@ async def add_transaction(entry_id: str, request: Request):
         data = await request.json()
         db = await get_db()
         
-        register = await db.cash_register.find_one({"_id": ObjectId(entry_id)})
-        if not register:
-            raise HTTPException(status_code=404, detail="Register not found")
-            
-        if register["status"] == "closed":
-            raise HTTPException(status_code=400, detail="Register is closed")
+        transaction = parse_transaction(data, user)
         
-        transaction = {
-            "type": data["type"],
-            "amount": float(data["amount"]),
-            "description": data["description"],
-            "time": datetime.now(),
-            "recorded_by": user["username"]
-        }
-        
-        result = await db.cash_register.update_one(
-            {"_id": ObjectId(entry_id)},
-            {
-                "$push": {"transactions": transaction},
-                "$set": {"last_updated": datetime.now()}
-            }
-        )
-        
-        if result.modified_count == 0:
-            raise HTTPException(status_code=400, detail="Failed to add transaction")
-            
-        # Get updated register data
-        updated_register = await db.cash_register.find_one({"_id": ObjectId(entry_id)})
-        
-        # Calculate new totals for this register
-        total_income = sum(t["amount"] for t in updated_register["transactions"] if t["type"] == "income")
-        total_expenses = sum(t["amount"] for t in updated_register["transactions"] if t["type"] == "expense")
-        new_total = total_income - total_expenses
+        # Totals first, guarded on the register being open, then the row
+        recorded = await record_transaction(db, ObjectId(entry_id), transaction)
+
+        if not recorded:
+            await register_missing_or_closed(db, entry_id)
+        updated_register, transaction = recorded
+        bump_version("cash_register")
+
+        totals = register_totals(updated_register)
+        new_total = totals["total_income"] - totals["total_expenses"]
         
         logger.debug(f"Transaction added - Type: {data['type']}, Amount: {data['amount']}, Register Total: {new_total}")
         
-        # Get updated vault total
-        vault_pipeline = [
-            {"$match": {"status": "closed"}},
-            {"$group": {
-                "_id": None,
-                "total_income": {"$sum": "$billing"},
-                "total_expenses": {"$sum": "$expenses"}
-            }}
-        ]
-        
-        vault_result = await db.cash_register.aggregate(vault_pipeline).to_list(None)
-        vault_total = vault_result[0]["total_income"] - vault_result[0]["total_expenses"] if vault_result else 0
+        vault_total = await get_vault_total(db, open_register=updated_register)
         
+        # Only the new row; clients append it and resync on a seq gap
         return {
             "success": True,
-            "transactions": updated_register["transactions"],
+            "seq": transaction.get("seq"),
+            "transaction": serialize_doc(transaction),
+            **totals,
             "register_total": new_total,
             "vault_total": vault_total
         }
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error adding transaction: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))  # Fixed syntax here
 
+@api_router.post("/{entry_id}/transactions/batch")
+async def add_transactions_batch(entry_id: str, request: Request):
+    """Ingest transactions queued by a client while it was offline.
+
+    Every transaction carries a client_id; ones already stored are
+    acknowledged as duplicates, so a queue can be re-sent safely. Invalid
+    transactions come back as rejected instead of failing the batch, so
+    one bad entry cannot hold the rest of the queue.
+    """
+    try:
+        user = request.state.user
+        data = await request.json()
+        items = data.get("transactions") or []
+        if len(items) > MAX_TRANSACTION_BATCH:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_TRANSACTION_BATCH} transactions per batch")
+        if any(not item.get("client_id") for item in items):
+            raise HTTPException(status_code=400, detail="Every queued transaction needs a client_id")
+
+        transactions, rejected = [], {}
+        for item in items:
+            try:
+                transactions.append(parse_transaction(item, user))
+            except HTTPException as he:
+                rejected[item["client_id"]] = he.detail
+        db = await get_db()
+
+        result = await record_transactions(db, ObjectId(entry_id), transactions)
+        if result is None:
+            await register_missing_or_closed(db, entry_id)
+        if result["created"]:
+            bump_version("cash_register")
+
+        rows = {doc["client_id"]: doc for doc in result["duplicates"]}
+        created = set()
+        for doc in result["created"]:
+            rows[doc["client_id"]] = doc
+            created.add(doc["client_id"])
+
+        register = result["register"]
+        totals = register_totals(register)
+        return {
+            "success": True,
+            "results": [
+                {
+                    "client_id": item["client_id"],
+                    "status": "created" if item["client_id"] in created else "duplicate",
+                    "seq": rows[item["client_id"]].get("seq"),
+                    "transaction": serialize_doc(rows[item["client_id"]])
+                }
+                for item in transactions
+            ] + [
+                {"client_id": client_id, "status": "rejected", "detail": detail}
+                for client_id, detail in rejected.items()
+            ],
+            "last_seq": register.get("last_seq", 0),
+            **totals,
+            "register_total": totals["total_income"] - totals["total_expenses"],
+            "vault_total": await get_vault_total(db, open_register=register)
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error adding transaction batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/{entry_id}/transactions")
+async def get_transactions(
+    entry_id: str,
+    request: Request,
+    limit: int = Query(TRANSACTION_PAGE_SIZE, ge=1, le=500),
+    before: Optional[str] = None
+):
+    """Page through a register's transactions, newest page first"""
+    try:
+        db = await get_db()
+        try:
+            page = await list_transactions(db, ObjectId(entry_id), limit=limit, before=before)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+        return {
+            "items": serialize_doc(page["items"]),
+            "next_cursor": page["next_cursor"]
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error getting transactions: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/{entry_id}/sync")
+async def sync_transactions(
+    entry_id: str,
+    request: Request,
+    after_seq: int = Query(0, ge=0),
+    limit: int = Query(TRANSACTION_PAGE_SIZE, ge=1, le=500)
+):
+    """Transactions a client missed after its last seen sequence number"""
+    try:
+        db = await get_db()
+        register = await db.cash_register.find_one({"_id": ObjectId(entry_id)}, REGISTER_HEADER_PROJECTION)
+        if not register:
+            raise HTTPException(status_code=404, detail="Register not found")
+
+        items = await transactions_since(db, register["_id"], after_seq, limit=limit)
+        totals = register_totals(register)
+        return {
+            "transactions": serialize_doc(items),
+            "last_seq": register.get("last_seq", 0),
+            "has_more": len(items) == limit,
+            **totals,
+            "register_total": totals["total_income"] - totals["total_expenses"],
+            "vault_total": await get_vault_total(db, open_register=register if register["status"] == "open" else None)
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error syncing transactions: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/{entry_id}/close")
 async def close_day(entry_id: str, request: Request):
     try:
@@ -320,7 +526,7 @@ async def close_day(entry_id: str, request: Request):
         db = await get_db()
         
         # Get current entry
-        entry = await db.cash_register.find_one({"_id": ObjectId(entry_id)})
+        entry = await db.cash_register.find_one({"_id": ObjectId(entry_id)}, REGISTER_HEADER_PROJECTION)
         if not entry:
             raise HTTPException(status_code=404, detail="Entry not found")
             
@@ -328,14 +534,13 @@ async def close_day(entry_id: str, request: Request):
             raise HTTPException(status_code=400, detail="Day already closed")
             
         # Calculate expected amount and difference
-        total_income = sum(t["amount"] for t in entry["transactions"] if t["type"] == "income")
-        total_expenses = sum(t["amount"] for t in entry["transactions"] if t["type"] == "expense")
-        expected_amount = entry["initial_amount_counted"] + total_income - total_expenses
+        totals = register_totals(entry)
+        expected_amount = entry["initial_amount_counted"] + totals["total_income"] - totals["total_expenses"]
         difference = float(data["final_count"]) - expected_amount  # Calculate difference here
         
-        # Update with final count
-        result = await db.cash_register.update_one(
-            {"_id": ObjectId(entry_id)},
+        # Update with final count, once even if the close is submitted twice
+        closed_register = await db.cash_register.find_one_and_update(
+            {"_id": ObjectId(entry_id), "status": {"$ne": "closed"}},
             {
                 "$set": {
                     "status": "closed",
@@ -346,8 +551,27 @@ async def close_day(entry_id: str, request: Request):
                     "difference": difference,  # Use calculated difference
                     "closing_notes": data.get("notes", "")
                 }
-            }
+            },
+            projection={
+                "date": 1,
+                "responsible": 1,
+                "total_income": 1,
+                "total_expenses": 1,
+                "transaction_count": 1,
+                "expected_amount": 1,
+                "difference": 1
+            },
+            return_document=ReturnDocument.AFTER
         )
+        if not closed_register:
+            raise HTTPException(status_code=400, detail="Day already closed")
+        bump_version("cash_register")
+
+        # Fold the day into the persisted vault balance and the daily rollups
+        await fold_register_into_vault(db, closed_register)
+        await refresh_rollup_day(db, closed_register["date"])
+        record_closed_register(closed_register)
+        record_closed_income(closed_register)
         
         # Add closing log entry with proper difference value
         await add_log_entry(
@@ -358,12 +582,40 @@ async def close_day(entry_id: str, request: Request):
             user["username"]
         )
         
-        return {"success": True}
+        return {"success": True, "vault_total": await get_vault_total(db)}
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error closing day: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/analytics/discrepancies")
+async def get_discrepancy_analytics(request: Request):
+    """Close differences per responsible and weekday, with outlier alerts"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+        db = await get_db()
+        return await discrepancy_report(db)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error building discrepancy analytics: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/forecast")
+async def get_income_forecast(days: int = Query(14, ge=1, le=MAX_FORECAST_DAYS)):
+    """Expected daily income for the next days with a ~95% band"""
+    try:
+        db = await get_db()
+        return await income_forecast(db, days)
+    except Exception as e:
+        logger.error(f"Error forecasting income: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/today", response_model=dict)
 async def get_today_status(request: Request):
     try:
@@ -373,7 +625,7 @@ async def get_today_status(request: Request):
         
         current_register = await db.cash_register.find_one({
             "date": {"$gte": today, "$lt": tomorrow}
-        })
+        }, REGISTER_HEADER_PROJECTION)
         
         if not current_register:
             return {"status": "no_register"}
@@ -392,6 +644,43 @@ async def get_today_status(request: Request):
         logger.error(f"Error getting today's status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Longest date range a single export may cover
+MAX_EXPORT_DAYS = 366
+
+@api_router.get("/export")
+async def export_range(
+    request: Request,
+    start: date = Query(...),
+    end: date = Query(...)
+):
+    """XLSX with one sheet per day between start and end (inclusive) plus a summary"""
+    try:
+        if end < start:
+            raise HTTPException(status_code=400, detail="end must not be before start")
+        if (end - start).days >= MAX_EXPORT_DAYS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_EXPORT_DAYS} days per export")
+
+        db = await get_db()
+        path = await export_cash_range(
+            db,
+            datetime.combine(start, datetime.min.time()),
+            datetime.combine(end + timedelta(days=1), datetime.min.time())
+        )
+
+        # Streamed from disk in chunks, removed once sent
+        return FileResponse(
+            path,
+            media_type=XLSX_MEDIA_TYPE,
+            filename=f"reporte_caja_{start:%Y%m%d}_{end:%Y%m%d}.xlsx",
+            background=BackgroundTask(os.remove, path)
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error exporting cash range: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/{entry_id}/export")
 async def export_register(entry_id: str, format: str = Query("xlsx", regex="^(csv|xlsx)$")):
     output = None
@@ -402,141 +691,24 @@ async def export_register(entry_id: str, format: str = Query("xlsx", regex="^(cs
         if not entry:
             raise HTTPException(status_code=404, detail="Entry not found")
 
-        transactions = entry.get("transactions", [])
-        total_income = sum(t["amount"] for t in transactions if t["type"] == "income")
-        total_expenses = sum(t["amount"] for t in transactions if t["type"] == "expense")
+        transactions = await iter_transactions(db, entry["_id"]).to_list(None)
+        totals = register_totals(entry)
+        total_income = totals["total_income"]
+        total_expenses = totals["total_expenses"]
         final_balance = entry['initial_amount_counted'] + total_income - total_expenses
 
         if format == "xlsx":
-            output = io.BytesIO()
-            workbook = xlsxwriter.Workbook(output)
-
-            # Add formats
-            title_format = workbook.add_format({
-                'bold': True,
-                'font_size': 14,
-                'align': 'center',
-                'border': 1
-            })
-            header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#D3D3D3',
-                'border': 1
-            })
-            money_format = workbook.add_format({
-                'num_format': '$#,##0.00',
-                'border': 1
-            })
-            cell_format = workbook.add_format({
-                'border': 1
-            })
-
-            # Summary worksheet
-            ws_summary = workbook.add_worksheet('Resumen')
-            
-            # Write title
-            ws_summary.merge_range('A1:B1', 'RESUMEN DE CAJA', title_format)
-            
-            # Write summary data starting from row 2
-            current_row = 2
-            ws_summary.write(current_row, 0, 'Fecha', header_format)
-            ws_summary.write(current_row, 1, entry['date'].strftime('%Y-%m-%d'), cell_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Hora Apertura', header_format)
-            ws_summary.write(current_row, 1, entry['initial_count_time'].strftime('%H:%M:%S'), cell_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Responsable', header_format)
-            ws_summary.write(current_row, 1, entry['responsible'], cell_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Monto Inicial', header_format)
-            ws_summary.write(current_row, 1, entry['initial_amount_counted'], money_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Total Ingresos', header_format)
-            ws_summary.write(current_row, 1, total_income, money_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Total Gastos', header_format)
-            ws_summary.write(current_row, 1, total_expenses, money_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Balance Final', header_format)
-            ws_summary.write(current_row, 1, final_balance, money_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Estado', header_format)
-            ws_summary.write(current_row, 1, 'CERRADO' if entry.get('status') == 'closed' else 'ABIERTO', cell_format)
-            
-            current_row += 1
-            ws_summary.write(current_row, 0, 'Notas', header_format)
-            ws_summary.write(current_row, 1, entry.get('notes', ''), cell_format)
-
-            # Set column widths
-            ws_summary.set_column('A:A', 15)
-            ws_summary.set_column('B:B', 25)
-
-            # Rest of your existing code for transactions worksheet
-            if transactions:
-                ws_trans = workbook.add_worksheet('Transacciones')
-                headers = ['Hora', 'Tipo', 'Descripción', 'Monto', 'Balance', 'Responsable']
-                
-                for col, header in enumerate(headers):
-                    ws_trans.write(0, col, header, header_format)
-
-                row = 1
-                running_balance = entry['initial_amount_counted']
-                for t in sorted(transactions, key=lambda x: x['time']):
-                    time = t['time'].strftime('%H:%M:%S')
-                    if t['type'] == 'income':
-                        running_balance += t['amount']
-                    else:
-                        running_balance -= t['amount']
-
-                    ws_trans.write(row, 0, time, cell_format)
-                    ws_trans.write(row, 1, 'INGRESO' if t['type'] == 'income' else 'GASTO', cell_format)
-                    ws_trans.write(row, 2, t['description'], cell_format)
-                    ws_trans.write(row, 3, t['amount'], money_format)
-                    ws_trans.write(row, 4, running_balance, money_format)
-                    ws_trans.write(row, 5, t['recorded_by'], cell_format)
-                    row += 1
-
-                ws_trans.set_column('A:A', 10)
-                ws_trans.set_column('B:B', 10)
-                ws_trans.set_column('C:C', 40)
-                ws_trans.set_column('D:E', 15)
-                ws_trans.set_column('F:F', 15)
-
-            # Add Logs worksheet
-            if entry.get("logs"):
-                ws_logs = workbook.add_worksheet('Registro')
-                headers = ['Fecha/Hora', 'Acción', 'Detalles', 'Usuario']
-                
-                for col, header in enumerate(headers):
-                    ws_logs.write(0, col, header, header_format)
-
-                for row, log in enumerate(entry["logs"], 1):
-                    ws_logs.write(row, 0, log["timestamp"].strftime("%Y-%m-%d %H:%M:%S"), cell_format)
-                    ws_logs.write(row, 1, log["action"], cell_format)
-                    ws_logs.write(row, 2, log["details"], cell_format)
-                    ws_logs.write(row, 3, log["user"], cell_format)
-
-                # Set column widths for logs
-                ws_logs.set_column('A:A', 20)  # Timestamp
-                ws_logs.set_column('B:B', 15)  # Action
-                ws_logs.set_column('C:C', 50)  # Details
-                ws_logs.set_column('D:D', 15)  # User
-
-            workbook.close()
-            output.seek(0)
+            # Rendered in the export pool, off the event loop
+            content = await run_in_pool(
+                render_register_xlsx,
+                entry, transactions, total_income, total_expenses, final_balance
+            )
 
             filename = f"reporte_caja_{entry['date'].strftime('%Y%m%d')}.xlsx"
             
             return Response(
-                content=output.getvalue(),
-                media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                content=content,
+                media_type=XLSX_MEDIA_TYPE,
                 headers={
                     'Content-Disposition': f'attachment; filename="{filename}"'
                 }
@@ -614,71 +786,45 @@ async def export_register(entry_id: str, format: str = Query("xlsx", regex="^(cs
 # Modify these routes only, keep everything else the same
 
 @api_router.get("/vault/total")
-async def get_vault_total():
+async def get_vault_total_endpoint(request: Request, response: Response):
     try:
+        not_modified = conditional_get(request, response, "cash_register")
+        if not_modified:
+            return not_modified
+
         db = await get_db()
-        # Get all transactions from closed registers
-        pipeline = [
-            {"$match": {"status": "closed"}},
-            {"$group": {
-                "_id": None,
-                "total_income": {
-                    "$sum": {
-                        "$sum": {
-                            "$map": {
-                                "input": "$transactions",
-                                "as": "t",
-                                "in": {
-                                    "$cond": [
-                                        {"$eq": ["$$t.type", "income"]},
-                                        "$$t.amount",
-                                        0
-                                    ]
-                                }
-                            }
-                        }
-                    }
-                },
-                "total_expenses": {
-                    "$sum": {
-                        "$sum": {
-                            "$map": {
-                                "input": "$transactions",
-                                "as": "t",
-                                "in": {
-                                    "$cond": [
-                                        {"$eq": ["$$t.type", "expense"]},
-                                        "$$t.amount",
-                                        0
-                                    ]
-                                }
-                            }
-                        }
-                    }
-                }
-            }}
-        ]
-        
-        result = await db.cash_register.aggregate(pipeline).to_list(None)
-        if result:
-            total = result[0]["total_income"] - result[0]["total_expenses"]
-            logger.debug(f"Vault total calculated - Income: {result[0]['total_income']}, Expenses: {result[0]['total_expenses']}, Total: {total}")
-        else:
-            total = 0
-            logger.debug("No closed registers found, vault total is 0")
-            
+        total = await get_vault_total(db)
+        logger.debug(f"Vault total: {total}")
         return {"total": total}
     except Exception as e:
         logger.error(f"Error getting vault total: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/vault/rebuild")
+async def rebuild_vault(request: Request):
+    """Recompute the persisted vault balance from all closed registers"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+        db = await get_db()
+        await rebuild_vault_balance(db)
+        bump_version("cash_register")
+        return {"success": True, "total": await get_vault_total(db)}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error rebuilding vault balance: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/vault/update")
 async def update_vault_total(amount: float):
     try:
         db = await get_db()
         # Get current vault total
         vault = await db.vault.find_one({})
-        current_total = vault["total_amount"] if vault else 0
+        current_total = vault.get("total_amount", 0) if vault else 0
         
         # Update vault with new total and add transaction record
         await db.vault.update_one(
@@ -699,132 +845,12 @@ async def update_vault_total(amount: float):
             },
             upsert=True
         )
+        bump_version("cash_register")
         
         return {"success": True, "total": amount}
     except Exception as e:
         logger.error(f"Error updating vault total: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/vault/total")
-async def get_vault_total_endpoint(request: Request):
-    try:
-        db = await get_db()
-        total = await get_vault_total(db)
-        return total
-    except Exception as e:
-        logger.error(f"Error getting vault total: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-        
 # Include the web router in the API router
 web_router.include_router(api_router)
-
-async def get_vault_total(db):
-    try:
-        # Get totals from closed registers
-        pipeline = [
-            {
-                "$facet": {
-                    "closed_registers": [
-                        {"$match": {"status": "closed"}},
-                        {"$group": {
-                            "_id": None,
-                            "total_income": {
-                                "$sum": {
-                                    "$sum": {
-                                        "$map": {
-                                            "input": "$transactions",
-                                            "as": "t",
-                                            "in": {
-                                                "$cond": [
-                                                    {"$eq": ["$$t.type", "income"]},
-                                                    "$$t.amount",
-                                                    0
-                                                ]
-                                            }
-                                        }
-                                    }
-                                }
-                            },
-                            "total_expenses": {
-                                "$sum": {
-                                    "$sum": {
-                                        "$map": {
-                                            "input": "$transactions",
-                                            "as": "t",
-                                            "in": {
-                                                "$cond": [
-                                                    {"$eq": ["$$t.type", "expense"]},
-                                                    "$$t.amount",
-                                                    0
-                                                ]
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        }}
-                    ],
-                    "open_register": [
-                        {"$match": {"status": "open"}},
-                        {"$unwind": "$transactions"},
-                        {"$group": {
-                            "_id": None,
-                            "open_income": {
-                                "$sum": {
-                                    "$cond": [
-                                        {"$eq": ["$transactions.type", "income"]},
-                                        "$transactions.amount",
-                                        0
-                                    ]
-                                }
-                            },
-                            "open_expenses": {
-                                "$sum": {
-                                    "$cond": [
-                                        {"$eq": ["$transactions.type", "expense"]},
-                                        "$transactions.amount",
-                                        0
-                                    ]
-                                }
-                            }
-                        }}
-                    ]
-                }
-            }
-        ]
-        
-        result = await db.cash_register.aggregate(pipeline).to_list(None)
-        
-        # Initialize totals
-        closed_income = 0
-        closed_expenses = 0
-        open_income = 0
-        open_expenses = 0
-        
-        if result:
-            # Get closed registers totals
-            if result[0]["closed_registers"]:
-                closed = result[0]["closed_registers"][0]
-                closed_income = closed.get("total_income", 0)
-                closed_expenses = closed.get("total_expenses", 0)
-            
-            # Get open register totals
-            if result[0]["open_register"]:
-                open_reg = result[0]["open_register"][0]
-                open_income = open_reg.get("open_income", 0)
-                open_expenses = open_reg.get("open_expenses", 0)
-        
-        # Calculate total including both closed and open registers
-        total = (closed_income + open_income) - (closed_expenses + open_expenses)
-        
-        logger.debug(f"Vault total calculated - Closed Income: {closed_income}, "
-                    f"Closed Expenses: {closed_expenses}, "
-                    f"Open Income: {open_income}, "
-                    f"Open Expenses: {open_expenses}, "
-                    f"Total: {total}")
-        
-        return total
-        
-    except Exception as e:
-        logger.error(f"Error getting vault total: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
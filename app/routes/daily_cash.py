@@ -1,8 +1,20 @@
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
+from fastapi.encoders import jsonable_encoder
+from bson import ObjectId
 from ..database import get_db
-from datetime import datetime
+from ..services.cash_reports import (
+    REGISTER_PAGE_SIZE,
+    closed_register_totals,
+    day_start,
+    list_closed_registers,
+    period_report,
+    period_start
+)
+from ..services.inventory_query import InvalidCursor
+from datetime import datetime, date, timedelta
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,39 +25,57 @@ api_router = APIRouter(prefix="/api/daily-cash", tags=["daily-cash"])
 
 templates = Jinja2Templates(directory="app/templates")
 
+# Default range shown per grouping when no start is given
+DEFAULT_RANGE = {
+    "day": timedelta(days=31),
+    "week": timedelta(weeks=12),
+    "month": timedelta(days=365)
+}
+
+def report_range(period: str, start: Optional[date], end: Optional[date]):
+    """[start, end) as datetimes, end inclusive of the given day"""
+    end_at = datetime.combine(end, datetime.min.time()) + timedelta(days=1) if end \
+        else day_start(datetime.now()) + timedelta(days=1)
+    start_at = datetime.combine(start, datetime.min.time()) if start \
+        else period_start(end_at - DEFAULT_RANGE[period], period)
+    return start_at, end_at
+
 # Web routes
 @web_router.get("/daily-cash")
-async def daily_cash_page(request: Request):
+async def daily_cash_page(
+    request: Request,
+    period: str = Query("day", regex="^(day|week|month)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
     if not request.session.get("user"):
         return RedirectResponse(url="/login")
     try:
         logger.debug("Fetching daily cash data")
         db = await get_db()
         
-        # Get daily cash entries with all fields
-        daily_cash = await db.cash_register.find(
-            {"status": "closed"}
-        ).sort("date", -1).to_list(None)
-        
-        logger.debug(f"Found {len(daily_cash)} entries")
+        # Closed days are read from the rollup store, only open ones are computed
+        start_at, end_at = report_range(period, start, end)
+        report = await period_report(db, start_at, end_at, period)
+        registers = await list_closed_registers(db, start_at, end_at)
+        totals = await closed_register_totals(db, start_at, end_at)
 
-        # Calculate totals
-        total_initial = sum(entry.get("initial_amount", 0) for entry in daily_cash)
-        total_billing = sum(entry.get("billing", 0) for entry in daily_cash)
-        total_expenses = sum(entry.get("expenses", 0) for entry in daily_cash)
-        total_balance = sum(entry.get("final_amount", 0) for entry in daily_cash)
-
-        logger.debug(f"Totals calculated: initial={total_initial}, billing={total_billing}, expenses={total_expenses}")
+        logger.debug(f"Report has {len(report['rows'])} rows for {period} from {start_at} to {end_at}")
 
         return templates.TemplateResponse(
             "daily_cash.html",
             {
                 "request": request,
-                "daily_cash": daily_cash,
-                "total_initial": total_initial,
-                "total_billing": total_billing,
-                "total_expenses": total_expenses,
-                "total_balance": total_balance,
+                "daily_cash": list(reversed(report["rows"])),
+                "period": period,
+                "start": start_at.date().isoformat(),
+                "end": (end_at - timedelta(days=1)).date().isoformat(),
+                "registers": registers["items"],
+                "registers_cursor": registers["next_cursor"],
+                "total_initial": totals["initial_amount"],
+                "total_billing": totals["total_income"],
+                "total_expenses": totals["total_expenses"],
+                "total_balance": totals["net"],
                 "error": None
             }
         )
@@ -56,6 +86,9 @@ async def daily_cash_page(request: Request):
             {
                 "request": request,
                 "daily_cash": [],
+                "period": period,
+                "registers": [],
+                "registers_cursor": None,
                 "total_initial": 0,
                 "total_billing": 0,
                 "total_expenses": 0,
@@ -66,15 +99,48 @@ async def daily_cash_page(request: Request):
 
 # API routes
 @api_router.get("/")
-async def get_daily_cash():
+async def get_daily_cash(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = Query(REGISTER_PAGE_SIZE, ge=1, le=500),
+    before: Optional[str] = None
+):
+    """Closed registers between start and end, newest first, with their totals"""
     try:
         db = await get_db()
-        daily_cash = await db.cash_register.find({"status": "closed"}).to_list(None)
-        return {"daily_cash": daily_cash}
+        start_at, end_at = report_range("day", start, end)
+        try:
+            page = await list_closed_registers(db, start_at, end_at, limit=limit, before=before)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+        # Totals only change with the range, not while paging through it
+        totals = None if before else await closed_register_totals(db, start_at, end_at)
+        return jsonable_encoder({
+            "items": page["items"],
+            "next_cursor": page["next_cursor"],
+            "totals": totals
+        }, custom_encoder={ObjectId: str})
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"API error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/report")
+async def get_cash_report(
+    period: str = Query("day", regex="^(day|week|month)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
+    """Income, expenses and differences per day, week or month"""
+    try:
+        db = await get_db()
+        start_at, end_at = report_range(period, start, end)
+        return await period_report(db, start_at, end_at, period)
+    except Exception as e:
+        logger.error(f"Report error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Combine routers at the module level
 web_router.include_router(api_router)
 router = web_router
\ No newline at end of file
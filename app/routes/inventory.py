@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Request, Form, HTTPException, Query, Depends
+from fastapi import APIRouter, Request, Response, Form, HTTPException, Query, Depends
 from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse  # Add JSONResponse here
 from fastapi.templating import Jinja2Templates
 from typing import List, Optional
 from pydantic import BaseModel, Field
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from bson import ObjectId
 from ..database import get_db
-from ..services.inventory import get_inventory_state
+from ..services.inventory import get_inventory_state, stock_status, STOCK_STATUSES
+from ..services.inventory_query import SORT_FIELDS, InvalidCursor, build_filters, query_inventory
+from ..repositories.inventory import API_VIEW, PAGE_VIEW, list_items, search_items
+from ..services.stock_history import build_checkpoints, created_after, stock_as_of
+from ..services.ledger_check import run_ledger_check, serialize_report
+from ..services.count_sessions import (
+    apply_count,
+    finalize_session,
+    get_or_start_session,
+    save_count_lines,
+    serialize_session
+)
+from ..utils.versioning import bump_version, conditional_get
 import logging
 
 # Setup logging
@@ -112,26 +124,9 @@ async def inventory_page(request: Request):
 
         db = await get_db()
         
-        # Find all inventory items with fresh data
-        cursor = db.inventory.find().sort("name", 1)
-        inventory_items = []
-        
-        async for doc in cursor:
-            # Process each document
-            item = {
-                "_id": str(doc["_id"]),
-                "name": doc["name"],
-                "current_stock": float(doc.get("current_stock", 0)),
-                "unit": doc.get("unit", ""),
-                "supplier": doc.get("supplier", ""),
-                "category": doc.get("category", "Sin Categoría"),
-                "min_stock": float(doc.get("min_stock", 5.0)),
-                "max_stock": float(doc.get("max_stock", 30.0)),
-                "last_count": doc.get("last_count"),
-                "last_updated": doc.get("last_updated"),
-                "last_updated_by": doc.get("last_updated_by")
-            }
-            inventory_items.append(item)
+        # Only the columns the table shows, converted to dicts for the template
+        rows = await list_items(db, PAGE_VIEW)
+        inventory_items = [row.to_template() for row in rows]
 
         return templates.TemplateResponse("inventory.html", {
             "request": request,
@@ -197,7 +192,11 @@ async def add_item(
             supplier=supplier
         )
         
-        await db.inventory.insert_one(item.model_dump())
+        await db.inventory.insert_one({
+            **item.model_dump(),
+            "stock_status": stock_status(item.current_stock, item.min_stock)
+        })
+        bump_version("inventory")
         return RedirectResponse(url="/inventory", status_code=303)
     except Exception as e:
         return templates.TemplateResponse(
@@ -357,11 +356,15 @@ async def stock_movements(request: Request):
         logger.error(f"Error in movements view: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/api/inventory", response_model=List[InventoryItem])
-async def get_inventory():
+@router.get("/api/inventory")
+async def get_inventory(request: Request, response: Response):
+    not_modified = conditional_get(request, response, "inventory")
+    if not_modified:
+        return not_modified
+
     db = await get_db()
-    items = await db.inventory.find().to_list(None)
-    return items
+    rows = await list_items(db, API_VIEW)
+    return [row.to_json() for row in rows]
 
 @router.post("/api/inventory", response_model=InventoryItem)
 async def create_inventory_item(request: Request, item: InventoryItem):
@@ -371,7 +374,9 @@ async def create_inventory_item(request: Request, item: InventoryItem):
         raise HTTPException(status_code=403, detail="Not authenticated")
         
     item_dict = item.model_dump()
+    item_dict["stock_status"] = stock_status(item.current_stock, item.min_stock)
     result = await db.inventory.insert_one(item_dict)
+    bump_version("inventory")
     created_item = await db.inventory.find_one({"_id": result.inserted_id})
     return created_item
 
@@ -384,8 +389,12 @@ async def update_inventory_item(item_id: str, item: InventoryItem, request: Requ
         
     result = await db.inventory.update_one(
         {"_id": ObjectId(item_id)},
-        {"$set": item.model_dump()}
+        {"$set": {
+            **item.model_dump(),
+            "stock_status": stock_status(item.current_stock, item.min_stock)
+        }}
     )
+    bump_version("inventory")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     updated_item = await db.inventory.find_one({"_id": ObjectId(item_id)})
@@ -399,6 +408,7 @@ async def delete_inventory_item(item_id: str, request: Request):
         raise HTTPException(status_code=403, detail="Not authorized")
         
     result = await db.inventory.delete_one({"_id": ObjectId(item_id)})
+    bump_version("inventory")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Item deleted successfully"}
@@ -412,6 +422,7 @@ async def reset_inventory_endpoint(request: Request):
         
     try:
         await db.inventory.drop()
+        bump_version("inventory")
         await db.inventory.create_index("name", unique=True)
         return {"message": "Inventory reset successful"}
     except Exception as e:
@@ -475,10 +486,12 @@ async def update_stock(item_id: str, request: Request):
             {"_id": ObjectId(item_id)},
             {"$set": {
                 "current_stock": new_stock,
+                "stock_status": stock_status(new_stock, float(item.get("min_stock", 0))),
                 "last_updated": datetime.utcnow(),
                 "last_updated_by": user["username"]
             }}
         )
+        bump_version("inventory")
 
         return JSONResponse({
             "success": True,
@@ -559,8 +572,12 @@ async def register_movement(
         # Update stock and save movement
         await db.inventory.update_one(
             {"_id": ObjectId(item_id)},
-            {"$set": {"current_stock": new_stock}}
+            {"$set": {
+                "current_stock": new_stock,
+                "stock_status": stock_status(new_stock, float(item.get("min_stock", 0)))
+            }}
         )
+        bump_version("inventory")
         await db.stock_movements.insert_one(movement)
 
         return {"success": True, "new_stock": new_stock}
@@ -607,9 +624,11 @@ async def add_item(request: Request):
             "created_at": datetime.utcnow(),
             "created_by": user["username"]
         }
+        new_item["stock_status"] = stock_status(new_item["current_stock"], new_item["min_stock"])
         
         # Insert the new item
         result = await db.inventory.insert_one(new_item)
+        bump_version("inventory")
         
         # Log the action
         logger.info(f"New item added: {new_item['name']} by {user['username']}")
@@ -643,36 +662,93 @@ async def add_item(request: Request):
 
 @router.post("/api/inventory/start-count")
 async def start_count(request: Request):
+    """Start a count session, or resume the one already in progress"""
     try:
         user = request.state.user
         if not user:
             raise HTTPException(status_code=403, detail="Not authenticated")
             
         db = await get_db()
+        session = await get_or_start_session(db, user)
+        resumed = bool(session.get("lines"))
         
-        # Check for existing active count
-        existing_count = await db.count_sessions.find_one({
-            "user_id": ObjectId(user["_id"]),
-            "status": "in_progress"
-        })
-        
-        if existing_count:
-            raise HTTPException(status_code=400, detail="Active count already exists")
-        
-        # Create new count session
-        count_session = {
-            "user_id": ObjectId(user["_id"]),
-            "started_at": datetime.utcnow(),
-            "status": "in_progress"
+        return {
+            "success": True,
+            "message": "Count session resumed" if resumed else "Count session started",
+            "resumed": resumed,
+            "session": serialize_session(session)
         }
         
-        await db.count_sessions.insert_one(count_session)
-        return {"success": True, "message": "Count session started"}
-        
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error starting count: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.patch("/api/inventory/count-sessions/{session_id}/lines")
+async def save_count_progress(session_id: str, request: Request):
+    """Autosave a batch of counted lines into an in-progress session"""
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        data = await request.json()
+        lines = data.get("lines", [])
+        if not lines:
+            raise HTTPException(status_code=400, detail="No lines provided")
+
+        db = await get_db()
+        session = await save_count_lines(db, session_id, user, lines)
+        if not session:
+            raise HTTPException(status_code=404, detail="No count in progress with this id")
+
+        return {
+            "success": True,
+            "saved": len(lines),
+            "revision": session["revision"],
+            "updated_at": session["updated_at"].isoformat()
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error saving count progress: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/inventory/count-sessions/{session_id}/finalize")
+async def finalize_count(session_id: str, request: Request):
+    """Apply every saved line of a count session to the inventory"""
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        data = await request.json()
+        db = await get_db()
+
+        # Flush any lines the client had not autosaved yet
+        if data.get("lines"):
+            saved = await save_count_lines(db, session_id, user, data["lines"])
+            if not saved:
+                raise HTTPException(status_code=404, detail="No count in progress with this id")
+
+        summary = await finalize_session(db, session_id, user, data.get("notes", ""))
+        if summary is None:
+            raise HTTPException(status_code=404, detail="No count in progress with this id")
+
+        return JSONResponse({
+            "success": True,
+            "message": "Weekly count recorded successfully",
+            **summary
+        })
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error finalizing count: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/api/inventory/weekly-count")
 async def submit_weekly_count(request: Request):
     """Handle weekly inventory count submission"""
@@ -682,7 +758,7 @@ async def submit_weekly_count(request: Request):
             raise HTTPException(status_code=403, detail="Not authenticated")
 
         data = await request.json()
-        logger.debug(f"Received weekly count data: {data}")
+        logger.debug(f"Received weekly count with {len(data.get('items', []))} items")
 
         items = data.get("items", [])
         notes = data.get("notes", "")
@@ -691,101 +767,189 @@ async def submit_weekly_count(request: Request):
             raise HTTPException(status_code=400, detail="No items provided")
 
         db = await get_db()
-        items_below_min = []
-        
-        # Create weekly count record
-        count_session = {
-            "user_id": ObjectId(user["_id"]),
-            "username": user["username"],
-            "count_date": datetime.utcnow(),
-            "items": items,
-            "notes": notes,
-            "status": "completed"
-        }
-        
-        result = await db.weekly_counts.insert_one(count_session)
-        logger.info(f"Created weekly count session: {result.inserted_id}")
-
-        # Update inventory and record movements
-        for item in items:
-            item_id = item["item_id"]
-            current_stock = item["current_stock"]
-            counted_stock = item["counted_stock"]
-            
-            # Record movement
-            movement = {
-                "item_id": ObjectId(item_id),
-                "user_id": ObjectId(user["_id"]),
-                "username": user["username"],
-                "quantity": counted_stock - current_stock,
-                "previous_stock": current_stock,
-                "new_stock": counted_stock,
-                "timestamp": datetime.utcnow(),
-                "notes": f"Conteo semanal: {notes}",
-                "movement_type": "count"
-            }
-            
-            await db.stock_movements.insert_one(movement)
-            
-            # Update stock
-            await db.inventory.update_one(
-                {"_id": ObjectId(item_id)},
-                {"$set": {
-                    "current_stock": counted_stock,
-                    "last_count": datetime.utcnow(),
-                    "last_counted_by": user["username"]
-                }}
-            )
-
-            # Check if item needs reordering
-            if counted_stock <= float(item.get("min_stock", 0)):
-                items_below_min.append(item_id)
-
-        # Create order suggestions document if items need reordering
-        if items_below_min:
-            await db.order_suggestions.insert_one({
-                "created_at": datetime.utcnow(),
-                "created_by": user["username"],
-                "source": "weekly_count",
-                "items": items_below_min,
-                "status": "pending"
-            })
+        summary = await apply_count(db, user, items, notes)
         
         return JSONResponse({
             "success": True,
             "message": "Weekly count recorded successfully",
-            "items_below_min": len(items_below_min),
-            "suggestions_created": bool(items_below_min)
+            "items_below_min": summary["items_below_min"],
+            "suggestions_created": summary["suggestions_created"]
         })
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error in weekly count: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/inventory/query")
+async def query_inventory_items(
+    request: Request,
+    response: Response,
+    q: Optional[str] = None,
+    supplier: Optional[str] = None,
+    category: Optional[str] = None,
+    stock_status: Optional[str] = Query(None, enum=STOCK_STATUSES),
+    sort: str = Query("name", enum=SORT_FIELDS),
+    direction: str = Query("asc", enum=["asc", "desc"]),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """Filtered, sorted and keyset-paginated inventory with facet counts"""
+    try:
+        not_modified = conditional_get(request, response, "inventory")
+        if not_modified:
+            return not_modified
+
+        db = await get_db()
+        try:
+            result = await query_inventory(
+                db,
+                build_filters(q, supplier, category, stock_status),
+                sort=sort,
+                direction=1 if direction == "asc" else -1,
+                limit=limit,
+                cursor=cursor
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+        result["items"] = [row.to_json() for row in result["items"]]
+        return result
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Inventory query error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/inventory/as-of")
+async def get_stock_as_of(
+    request: Request,
+    day: Optional[date] = Query(None, alias="date"),
+    at: Optional[datetime] = None,
+    item_id: Optional[str] = None
+):
+    """Stock levels at a past point in time (end of day when a date is given)"""
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+        if not day and not at:
+            raise HTTPException(status_code=400, detail="A date or datetime is required")
+        if item_id and not ObjectId.is_valid(item_id):
+            raise HTTPException(status_code=400, detail="Invalid item id")
+
+        moment = at or datetime.combine(day + timedelta(days=1), datetime.min.time())
+        db = await get_db()
+        state = await stock_as_of(db, moment)
+
+        stocks = state["stocks"]
+        if item_id:
+            # No checkpoint or movement yet: unknown rather than empty
+            stocks = {item_id: stocks.get(item_id)}
+
+        names = {}
+        async for doc in db.inventory.find(
+            {"_id": {"$in": [ObjectId(key) for key in stocks]}},
+            {"name": 1, "unit": 1, "created_at": 1}
+        ):
+            names[str(doc["_id"])] = doc
+
+        if item_id and item_id in names and created_after(names[item_id], moment):
+            # The item did not exist yet
+            stocks = {}
+
+        return {
+            "as_of": moment.isoformat(),
+            "checkpoint": state["checkpoint"].isoformat() if state["checkpoint"] else None,
+            "movements_replayed": state["movements_replayed"],
+            "items": [
+                {
+                    "item_id": key,
+                    "name": names.get(key, {}).get("name"),
+                    "unit": names.get(key, {}).get("unit", ""),
+                    "stock": level
+                }
+                for key, level in stocks.items()
+            ]
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error reconstructing stock: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/inventory/checkpoints")
+async def create_stock_checkpoints(request: Request):
+    """Catch up the periodic stock checkpoints to the current time"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+        db = await get_db()
+        created = await build_checkpoints(db)
+        return {"success": True, "created": created}
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error building checkpoints: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/inventory/ledger-check")
+async def check_ledger(request: Request, repair: bool = False):
+    """Compare current_stock with the movement ledger, optionally repairing drift"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+        db = await get_db()
+        report = await run_ledger_check(db, repair=repair)
+        return serialize_report(report)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error checking stock ledger: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/inventory/ledger-check")
+async def get_last_ledger_check(request: Request):
+    """Latest stored consistency report"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+        db = await get_db()
+        report = await db.ledger_checks.find_one(sort=[("started_at", -1)])
+        if not report:
+            raise HTTPException(status_code=404, detail="No ledger check has run yet")
+        return serialize_report(report)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error getting ledger check: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/api/inventory/search")
 async def search_inventory_items(request: Request, q: str):
     """Search inventory items for autocomplete"""
     try:
         db = await get_db()
-        query = {
-            "$or": [
-                {"name": {"$regex": q, "$options": "i"}},
-                {"supplier": {"$regex": q, "$options": "i"}},
-                {"category": {"$regex": q, "$options": "i"}}
-            ]
-        }
-        
-        items = await db.inventory.find(query).limit(10).to_list(None)
+        rows = await search_items(db, q, limit=10)
         
         # Format results for autocomplete
-        results = [{
-            "id": str(item["_id"]),
-            "name": item["name"],
-            "supplier": item["supplier"],
-            "category": item["category"],
-            "current_stock": item["current_stock"],
-            "unit": item["unit"]
-        } for item in items]
+        results = []
+        for row in rows:
+            result = row.to_json()
+            result["id"] = result.pop("_id")
+            results.append(result)
         
         return results
     except Exception as e:
@@ -794,13 +958,19 @@ async def search_inventory_items(request: Request, q: str):
         
 # Add this new route
 @router.get("/api/inventory/categories")
-async def get_categories(request: Request):
+async def get_categories(request: Request, response: Response):
     """Get all available categories"""
     try:
         user = request.state.user
         if not user:
             raise HTTPException(status_code=403, detail="Not authenticated")
 
+        # Revalidated on every use: a new category must show up right away,
+        # and an unchanged list costs a 304
+        not_modified = conditional_get(request, response, "inventory")
+        if not_modified:
+            return not_modified
+
         db = await get_db()
         
         # Combine default categories with any custom ones from the database
@@ -811,6 +981,8 @@ async def get_categories(request: Request):
             "categories": sorted(all_categories),
             "default_categories": sorted(DEFAULT_CATEGORIES)
         }
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error fetching categories: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -848,6 +1020,7 @@ async def update_category(item_id: str, request: Request):
                 "last_updated_by": user["username"]
             }}
         )
+        bump_version("inventory")
 
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Item not found or category unchanged")
@@ -925,11 +1098,13 @@ async def record_stock_movement(
             {
                 "$set": {
                     "current_stock": new_stock,
+                    "stock_status": stock_status(new_stock, float(item.get("min_stock", 0))),
                     "last_updated": datetime.utcnow(),
                     "last_updated_by": user["username"]
                 }
             }
         )
+        bump_version("inventory")
 
         # Prepare serialized response
         serialized_movement = {
@@ -1028,10 +1203,12 @@ async def set_stock(item_id: str, request: Request):
             {"_id": ObjectId(item_id)},
             {"$set": {
                 "current_stock": new_stock,
+                "stock_status": stock_status(new_stock, float(item.get("min_stock", 0))),
                 "last_updated": datetime.utcnow(),
                 "last_updated_by": user["username"]
             }}
         )
+        bump_version("inventory")
 
         return {
             "success": True,
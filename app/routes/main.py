@@ -60,32 +60,6 @@ async def schedule_page(request: Request):
         logger.error(f"Schedule error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@web_router.get("/daily-cash")
-async def daily_cash_page(request: Request):
-    logger.debug("Accessing daily cash page")
-    try:
-        db = await get_db()
-        daily_cash = await db.daily_cash.find().sort("date", -1).to_list(None)
-        
-        total_billing = sum(entry.get("billing", 0) for entry in daily_cash)
-        total_expenses = sum(entry.get("expenses", 0) for entry in daily_cash)
-        total_balance = total_billing - total_expenses
-        
-        return templates.TemplateResponse(
-            "daily_cash.html",
-            {
-                "request": request,
-                "daily_cash": daily_cash,
-                "total_billing": total_billing,
-                "total_expenses": total_expenses,
-                "total_balance": total_balance,
-                "is_admin": False  # Default to non-admin
-            }
-        )
-    except Exception as e:
-        logger.error(f"Daily cash error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 @api_router.get("/status")
 async def status():
     return {"status": "ok"}
@@ -1,108 +1,76 @@
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Request, Depends, HTTPException, Query
 from fastapi.templating import Jinja2Templates
-from typing import List
+from fastapi.encoders import jsonable_encoder
+from typing import List, Optional
 from ..models.order import Order, OrderItem
 from ..dependencies import get_current_user
 from ..database import db, get_db
 from bson import ObjectId
 import logging
-from datetime import datetime
-from fastapi.responses import JSONResponse
+from datetime import datetime, date, timedelta
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from ..services.orders import (
+    NO_SUPPLIER,
+    ORDER_PAGE_SIZE,
+    build_order_filters,
+    list_orders
+)
+from ..services.order_suggestions import (
+    order_suggested_lines,
+    pending_count,
+    pending_suggestions,
+    subscribe_pending_count,
+    unsubscribe_pending_count
+)
+from ..services.purchase_orders import (
+    PurchaseOrderNotDraft,
+    generate_weekly_orders,
+    plan_weekly_orders,
+    purchase_order_filename,
+    render_purchase_order_xlsx,
+    send_purchase_order,
+    week_start
+)
+from ..services.inventory_query import InvalidCursor
+from ..services.receiving import OrderNotReceivable, receive_order, serialize_receipt
+from ..services.supplier_stats import expected_fill_rate, load_supplier_stats, reorder_point
+from ..services.cash_export import XLSX_MEDIA_TYPE, run_in_pool
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import json
+import math
+import os
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 templates = Jinja2Templates(directory="app/templates")
 
-async def get_low_stock_items(db):
-    """Get items that are below minimum stock levels"""
-    try:
-        pipeline = [
-            {
-                "$match": {
-                    "current_stock": {"$exists": True},  # Ensure current_stock exists
-                    "$expr": {
-                        "$or": [
-                            {"$lte": ["$current_stock", "$min_stock"]},  # At or below minimum
-                            {"$eq": ["$current_stock", 0]}  # Out of stock
-                        ]
-                    }
-                }
-            },
-            {
-                "$addFields": {
-                    "suggested_order": {
-                        "$subtract": [
-                            {"$ifNull": ["$max_stock", 30]},  # Default max_stock to 30
-                            "$current_stock"
-                        ]
-                    }
-                }
-            },
-            {
-                "$addFields": {
-                    "priority": {
-                        "$switch": {
-                            "branches": [
-                                {"case": {"$eq": ["$current_stock", 0]}, "then": 1},  # Out of stock
-                                {
-                                    "case": {
-                                        "$lt": ["$current_stock", {"$ifNull": ["$min_stock", 5]}]
-                                    }, 
-                                    "then": 2
-                                }  # Below min
-                            ],
-                            "default": 3
-                        }
-                    }
-                }
-            },
-            {
-                "$sort": {
-                    "priority": 1,
-                    "supplier": 1,
-                    "name": 1
-                }
-            }
-        ]
+# Seconds between keepalive comments on an idle event stream
+SSE_KEEPALIVE = 25
 
-        items = await db.inventory.aggregate(pipeline).to_list(None)
-        
-        # Add debug logging
-        logger.debug(f"Found {len(items)} items below minimum stock")
-        for item in items:
-            logger.debug(
-                f"Low stock item: {item['name']} - "
-                f"Current: {item['current_stock']} - "
-                f"Min: {item.get('min_stock', 5)} - "
-                f"Max: {item.get('max_stock', 30)} - "
-                f"Suggested: {item['suggested_order']}"
-            )
-        
-        return items
-        
-    except Exception as e:
-        logger.error(f"Error in get_low_stock_items: {str(e)}", exc_info=True)
-        return []
+def order_range(start: Optional[date], end: Optional[date]):
+    """Date filters as datetimes, end inclusive of the given day"""
+    return (
+        datetime.combine(start, datetime.min.time()) if start else None,
+        datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None
+    )
 
 @router.get("/orders", name="orders.index")
-async def get_orders(request: Request):
+async def get_orders(
+    request: Request,
+    status: Optional[str] = None,
+    supplier: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None
+):
     try:
-        logger.debug("Getting orders page")
         db = await get_db()
         
-        orders = await db.orders.find().sort("created_at", -1).to_list(None)
-        logger.debug(f"Found {len(orders)} orders")
-        
-        suggested_items = await get_low_stock_items(db)
-        logger.debug(f"Found {len(suggested_items)} suggested items")
-        
-        # Safer debug logging
-        for item in suggested_items:
-            logger.debug(
-                f"Suggestion: {item.get('name', 'N/A')} - "
-                f"Current: {item.get('current_stock', 0)} - "
-                f"Min: {item.get('min_stock', 5)}"
-            )
+        # First page only; suggestions are fetched by the page afterwards
+        filters = build_order_filters(status, supplier, *order_range(start, end))
+        page = await list_orders(db, filters)
         
         return templates.TemplateResponse(
             "orders.html",
@@ -110,8 +78,14 @@ async def get_orders(request: Request):
                 "request": request,
                 "user": request.state.user,
                 "is_admin": getattr(request.state.user, "is_admin", False),
-                "orders": orders,
-                "suggested_items": suggested_items,
+                "orders": page["items"],
+                "orders_cursor": page["next_cursor"],
+                "filters": {
+                    "status": status or "",
+                    "supplier": supplier or "",
+                    "start": start.isoformat() if start else "",
+                    "end": end.isoformat() if end else ""
+                },
                 "active_page": "orders"
             }
         )
@@ -119,6 +93,41 @@ async def get_orders(request: Request):
         logger.error(f"Error getting orders: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/api/orders")
+async def get_orders_page(
+    status: Optional[str] = None,
+    supplier: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    limit: int = Query(ORDER_PAGE_SIZE, ge=1, le=200),
+    before: Optional[str] = None
+):
+    """Page through orders, newest first"""
+    try:
+        db = await get_db()
+        filters = build_order_filters(status, supplier, *order_range(start, end))
+        try:
+            page = await list_orders(db, filters, limit=limit, before=before)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+        return jsonable_encoder(page, custom_encoder={ObjectId: str})
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error listing orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/orders/suggestions")
+async def get_order_suggestions():
+    """Pending suggestion lines kept by the suggestion engine, loaded lazily by the page"""
+    try:
+        db = await get_db()
+        items = await pending_suggestions(db)
+        return jsonable_encoder({"items": items}, custom_encoder={ObjectId: str})
+    except Exception as e:
+        logger.error(f"Error getting order suggestions: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/orders")
 async def create_order(order: Order):
     order_dict = order.dict()
@@ -139,74 +148,377 @@ async def create_order_from_suggestion(request: Request):
         if not item_id:
             raise HTTPException(status_code=400, detail="Item ID is required")
             
+        try:
+            match = {"item_id": ObjectId(item_id)}
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid item id")
+
         db = await get_db()
-        
-        # Find the suggestion containing this item
-        suggestion = await db.order_suggestions.find_one({
-            "items.item_id": item_id,
-            "status": "pending"
-        })
-        
-        if not suggestion:
+        # Order, and mark the line processed, in one transaction
+        outcome = await order_suggested_lines(db, match, user["username"], single=True)
+        if not outcome:
             raise HTTPException(status_code=404, detail="Suggestion not found")
-            
-        # Find the specific item in the suggestion
-        suggested_item = next(
-            (item for item in suggestion["items"] if item["item_id"] == item_id),
-            None
-        )
-        
-        if not suggested_item:
-            raise HTTPException(status_code=404, detail="Item not found in suggestion")
-        
-        # Create order
-        order = {
-            "client": "INTERNAL",
-            "created_by": user["username"],
-            "created_at": datetime.utcnow(),
-            "status": "PENDING",
-            "type": "restock",
-            "description": f"Restock order for {suggested_item['name']}",
-            "items": [suggested_item],
-            "amount": 0,  # You might want to calculate this based on item cost
-            "source_suggestion": str(suggestion["_id"])
-        }
-        
-        # Insert order and update suggestion
-        result = await db.orders.insert_one(order)
+        order_id = outcome["order_ids"][0]
         
-        # Update suggestion to mark this item as processed
-        await db.order_suggestions.update_one(
-            {"_id": suggestion["_id"], "items.item_id": item_id},
-            {"$set": {
-                "items.$.status": "processed",
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        
-        logger.info(f"Created order {result.inserted_id} from suggestion for item {item_id}")
+        logger.info(f"Created order {order_id} from suggestion for item {item_id}")
         
         return JSONResponse({
             "success": True,
-            "order_id": str(result.inserted_id)
+            "order_id": str(order_id)
         })
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error creating order from suggestion: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/daily-cash")
-async def get_daily_cash(current_user = Depends(get_current_user)):
-    cash_entries = await db.daily_cash.find().to_list(1000)
-    return cash_entries
+@router.post("/api/orders/create-bulk")
+async def create_orders_bulk(request: Request):
+    """Create one restock order per supplier from the suggested items.
+
+    Takes ``item_ids`` (the selected suggestions) and/or ``supplier`` (all of
+    its suggestions). Orders go in with one insert_many and the matching
+    suggestion lines are marked processed with one bulk_write, both in one
+    transaction so a repeated submission cannot order the lines twice.
+    """
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        data = await request.json()
+        item_ids = data.get("item_ids") or []
+        supplier = data.get("supplier")
+        if not item_ids and not supplier:
+            raise HTTPException(status_code=400, detail="item_ids or supplier is required")
+
+        match = {}
+        if item_ids:
+            try:
+                match["item_id"] = {"$in": [ObjectId(item_id) for item_id in item_ids]}
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid item id")
+        if supplier:
+            match["supplier"] = None if supplier == NO_SUPPLIER else supplier
+
+        db = await get_db()
+        outcome = await order_suggested_lines(db, match, user["username"])
+        if not outcome:
+            raise HTTPException(status_code=404, detail="No suggested items to order")
+        orders = outcome["orders"]
+
+        logger.info(f"Created {len(orders)} supplier orders for {outcome['lines']} suggested items")
+
+        return {
+            "success": True,
+            "orders": [
+                {"order_id": str(order_id), "supplier": order["supplier"], "items": len(order["items"])}
+                for order_id, order in zip(outcome["order_ids"], orders)
+            ]
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error creating bulk orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/orders/{order_id}/receive")
+async def receive_delivery(order_id: str, request: Request):
+    """Receive a delivery against an order.
+
+    Takes ``lines`` as ``[{"item_id", "received"}]``; lines left out received
+    nothing. With ``close`` (the default) missing quantities are written off
+    and the order is closed, otherwise it stays PARTIAL for a later delivery.
+    """
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        data = await request.json()
+        try:
+            received = {
+                str(ObjectId(line["item_id"])): float(line.get("received") or 0)
+                for line in data.get("lines") or []
+            }
+            order_oid = ObjectId(order_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid order or line")
+        if any(quantity < 0 for quantity in received.values()):
+            raise HTTPException(status_code=400, detail="Received quantities cannot be negative")
+        close = data.get("close", True)
+        if not isinstance(close, bool):
+            raise HTTPException(status_code=400, detail="close must be true or false")
+
+        db = await get_db()
+        try:
+            outcome = await receive_order(
+                db, order_oid, received, user,
+                notes=data.get("notes") or "",
+                close=close
+            )
+        except OrderNotReceivable:
+            raise HTTPException(status_code=409, detail="Order not found or already closed")
+
+        return serialize_receipt(outcome)
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error receiving order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/orders/supplier-stats")
+async def get_supplier_stats(request: Request):
+    """Rolling lead time and fill rate per supplier, with recent arrivals"""
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Not authorized")
+
+        db = await get_db()
+        stats = await load_supplier_stats(db)
+        suppliers = [
+            {
+                **doc,
+                "lead_time_std": math.sqrt(doc.get("lead_time_var", 0.0)),
+                "expected_fill_rate": expected_fill_rate(doc),
+                # Reorder point as a fraction of min_stock
+                "reorder_factor": reorder_point(1.0, doc)
+            }
+            for _, doc in sorted(stats.items())
+        ]
+        arrivals = await db.arrivals.find().sort("arrival_date", -1).limit(50).to_list(50)
+        return jsonable_encoder(
+            {"suppliers": suppliers, "arrivals": arrivals},
+            custom_encoder={ObjectId: str}
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error getting supplier stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/purchase-orders/weekly")
+async def generate_purchase_orders(request: Request, week: Optional[date] = None):
+    """Run the weekly order: one purchase order per supplier, sheets zipped"""
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        db = await get_db()
+        day = datetime.combine(week, datetime.min.time()) if week else datetime.now()
+        try:
+            result = await generate_weekly_orders(db, week_start(day), user["username"])
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="The week's purchase orders changed meanwhile, try again")
+        if not result["orders"]:
+            os.remove(result["path"])
+            raise HTTPException(status_code=404, detail="No supplier needs an order this week")
+
+        # Streamed from disk, removed once sent
+        return FileResponse(
+            result["path"],
+            media_type="application/zip",
+            filename=f"pedidos_{week_start(day):%Y%m%d}.zip",
+            headers={
+                "X-Orders-Created": str(len(result["orders"])),
+                "X-Suppliers-Deferred": ",".join(d["supplier"] for d in result["deferred"])
+            },
+            background=BackgroundTask(os.remove, result["path"])
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error generating purchase orders: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/purchase-orders/split")
+async def preview_purchase_orders(week: Optional[date] = None):
+    """The weekly orders as they would be generated now, without saving them"""
+    try:
+        db = await get_db()
+        day = datetime.combine(week, datetime.min.time()) if week else datetime.now()
+        orders, deferred = await plan_weekly_orders(db, week_start(day))
+        return jsonable_encoder({
+            "orders": orders,
+            "deferred": deferred,
+            "total_amount": sum(order["total_amount"] for order in orders)
+        }, custom_encoder={ObjectId: str})
+    except Exception as e:
+        logger.error(f"Error planning purchase orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/supplier-prices")
+async def get_supplier_prices(item_id: Optional[str] = None, supplier: Optional[str] = None):
+    """Price list entries, optionally for one item or one supplier"""
+    try:
+        query = {}
+        if item_id:
+            query["item_id"] = ObjectId(item_id)
+        if supplier:
+            query["supplier"] = supplier
+
+        db = await get_db()
+        prices = await db.supplier_prices.find(query).sort([("item_id", 1), ("unit_price", 1)]).to_list(None)
+        return jsonable_encoder({"prices": prices}, custom_encoder={ObjectId: str})
+    except Exception as e:
+        logger.error(f"Error getting supplier prices: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/api/supplier-prices")
+async def update_supplier_prices(request: Request):
+    """Set item prices per supplier in one bulk write.
+
+    Takes ``prices`` as ``[{"item_id", "supplier", "unit_price"}]``; a null
+    unit_price removes the supplier from the item's price list.
+    """
+    try:
+        user = request.state.user
+        if not user or not user.get("is_admin"):
+            raise HTTPException(status_code=403, detail="Not authorized")
+
+        data = await request.json()
+        now = datetime.utcnow()
+        operations = []
+        try:
+            for entry in data.get("prices") or []:
+                key = {"item_id": ObjectId(entry["item_id"]), "supplier": entry["supplier"]}
+                if entry.get("unit_price") is None:
+                    operations.append(DeleteOne(key))
+                    continue
+                unit_price = float(entry["unit_price"])
+                if unit_price < 0:
+                    raise ValueError(unit_price)
+                operations.append(UpdateOne(key, {"$set": {
+                    "unit_price": unit_price,
+                    "updated_at": now,
+                    "updated_by": user["username"]
+                }}, upsert=True))
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid price entry")
+        if not operations:
+            raise HTTPException(status_code=400, detail="prices is required")
+
+        db = await get_db()
+        result = await db.supplier_prices.bulk_write(operations, ordered=False)
+        return {
+            "success": True,
+            "upserted": result.upserted_count,
+            "modified": result.modified_count,
+            "deleted": result.deleted_count
+        }
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error updating supplier prices: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/purchase-orders")
+async def get_purchase_orders(week: Optional[date] = None):
+    """Purchase orders of a week (the current one by default)"""
+    try:
+        db = await get_db()
+        day = datetime.combine(week, datetime.min.time()) if week else datetime.now()
+        orders = await db.purchase_orders.find({"week": week_start(day)}).sort("supplier", 1).to_list(None)
+        return jsonable_encoder({"orders": orders}, custom_encoder={ObjectId: str})
+    except Exception as e:
+        logger.error(f"Error listing purchase orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/purchase-orders/{order_id}/send")
+async def send_weekly_purchase_order(order_id: str, request: Request):
+    """Confirm a draft purchase order as sent to its supplier.
+
+    Opens the restock order its delivery is received against; later runs of
+    the week keep the order and do not order from the supplier again.
+    """
+    try:
+        user = request.state.user
+        if not user:
+            raise HTTPException(status_code=403, detail="Not authenticated")
+        if not ObjectId.is_valid(order_id):
+            raise HTTPException(status_code=400, detail="Invalid purchase order id")
+
+        db = await get_db()
+        try:
+            outcome = await send_purchase_order(db, ObjectId(order_id), user["username"])
+        except PurchaseOrderNotDraft:
+            raise HTTPException(status_code=409, detail="Purchase order not found or already sent")
+
+        return jsonable_encoder({
+            "success": True,
+            "purchase_order": outcome["purchase_order"],
+            "order_id": outcome["order_id"]
+        }, custom_encoder={ObjectId: str})
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error sending purchase order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/purchase-orders/{order_id}/xlsx")
+async def download_purchase_order(order_id: str):
+    """Printable sheet of one purchase order"""
+    try:
+        db = await get_db()
+        order = await db.purchase_orders.find_one({"_id": ObjectId(order_id)})
+        if not order:
+            raise HTTPException(status_code=404, detail="Purchase order not found")
+
+        content = await run_in_pool(render_purchase_order_xlsx, order)
+        return Response(
+            content=content,
+            media_type=XLSX_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={purchase_order_filename(order)}"}
+        )
+
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error rendering purchase order: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/api/orders/suggestions/count")
 async def get_suggestions_count():
     """Get count of pending order suggestions"""
     try:
         db = await get_db()
-        count = await db.order_suggestions.count_documents({"status": "pending"})
-        return {"count": count}
+        return {"count": await pending_count(db)}
     except Exception as e:
         logger.error(f"Error getting suggestions count: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/orders/suggestions/count/stream")
+async def stream_suggestions_count(request: Request):
+    """Server-sent events with the pending suggestion count on every change"""
+    db = await get_db()
+
+    async def events():
+        queue = subscribe_pending_count()
+        try:
+            count = await pending_count(db)
+            while not await request.is_disconnected():
+                if count is not None:
+                    yield f"data: {json.dumps({'count': count})}\n\n"
+                try:
+                    count = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    count = None
+                    yield ": keepalive\n\n"
+        finally:
+            unsubscribe_pending_count(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
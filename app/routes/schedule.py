@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Request, Response, Depends, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
 import logging
 from typing import List
 from ..models.schedule import Schedule, Employee, EMPLOYEE_COLORS, DEFAULT_SCHEDULES, default_employees
 from ..database import db, get_db
+from ..utils.versioning import bump_version, conditional_get
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +41,13 @@ async def schedule_page(request: Request):
 
 # Move API routes to api_router
 @api_router.get("/", response_model=List[Schedule])
-async def get_schedules():
+async def get_schedules(request: Request, response: Response):
+    not_modified = conditional_get(
+        request, response, "schedules", cache_control="private, max-age=60"
+    )
+    if not_modified:
+        return not_modified
+
     schedules = await db.schedules.find().to_list(1000)
     return [Schedule(**schedule) for schedule in schedules]
 
@@ -48,6 +55,7 @@ async def get_schedules():
 async def create_schedule(schedule: Schedule):
     schedule_dict = schedule.dict()
     result = await db.schedules.insert_one(schedule_dict)
+    bump_version("schedules")
     return {"id": str(result.inserted_id)}
 
 # Combine routers
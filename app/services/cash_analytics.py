@@ -0,0 +1,268 @@
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from bson import ObjectId
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Previous closes each register is compared against, per group
+WINDOW = 30
+
+# Closes a group needs before its registers can be flagged
+MIN_HISTORY = 5
+
+# Differences within this spread are noise; keeps z finite on a spotless history
+MIN_STD = 1.0
+
+Z_THRESHOLD = 3.0
+
+# Flagged registers returned in the report, newest first
+ALERT_LIMIT = 50
+
+WEEKDAYS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+DIMENSIONS = ("responsible", "weekday")
+
+HISTORY_PROJECTION = {"date": 1, "responsible": 1, "difference": 1, "expected_amount": 1}
+
+
+async def load_close_history(db) -> Dict[str, Any]:
+    """Load every closed register's difference as columnar arrays, in date order"""
+    register_ids: List[ObjectId] = []
+    dates: List[datetime] = []
+    responsible_codes, weekdays, differences, expected = [], [], [], []
+    responsibles: List[str] = []
+    codes = {}
+
+    cursor = db.cash_register.find(
+        {"status": "closed", "difference": {"$type": "number"}},
+        HISTORY_PROJECTION
+    ).sort([("date", 1), ("_id", 1)]).batch_size(5000)
+    async for register in cursor:
+        name = register.get("responsible") or ""
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(responsibles)
+            responsibles.append(name)
+        register_ids.append(register["_id"])
+        dates.append(register["date"])
+        responsible_codes.append(code)
+        weekdays.append(register["date"].weekday())
+        differences.append(float(register["difference"]))
+        expected.append(float(register.get("expected_amount") or 0))
+
+    return {
+        "register_ids": register_ids,
+        "dates": dates,
+        "responsibles": responsibles,
+        "responsible": np.array(responsible_codes, dtype=np.int64),
+        "weekday": np.array(weekdays, dtype=np.int64),
+        "difference": np.array(differences, dtype=np.float64),
+        "expected_amount": np.array(expected, dtype=np.float64)
+    }
+
+
+def rolling_zscores(values: np.ndarray, groups: np.ndarray, window: int = WINDOW,
+                    min_history: int = MIN_HISTORY) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Mean, std and z-score of each value against the previous ``window`` values of its group.
+
+    ``values`` must be in time order. The window excludes the value itself so
+    an outlier does not dampen its own score. Entries whose group has fewer
+    than ``min_history`` earlier values get NaN.
+    """
+    n = len(values)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    z = np.full(n, np.nan)
+    if n == 0:
+        return mean, std, z
+
+    # Group by key while keeping time order inside each group
+    order = np.argsort(groups, kind="stable")
+    x = values[order]
+    g = groups[order]
+
+    positions = np.arange(n)
+    group_start = np.maximum.accumulate(np.where(np.r_[True, g[1:] != g[:-1]], positions, 0))
+    low = np.maximum(group_start, positions - window)
+    count = positions - low
+
+    sums = np.r_[0.0, np.cumsum(x)]
+    squares = np.r_[0.0, np.cumsum(x * x)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m = (sums[positions] - sums[low]) / count
+        variance = np.maximum((squares[positions] - squares[low]) / count - m * m, 0.0)
+    s = np.sqrt(variance)
+
+    valid = count >= min_history
+    mean[order] = np.where(valid, m, np.nan)
+    std[order] = np.where(valid, s, np.nan)
+    z[order] = np.where(valid, (x - m) / np.maximum(s, MIN_STD), np.nan)
+    return mean, std, z
+
+
+def window_zscore(previous, value: float, min_history: int = MIN_HISTORY) -> Optional[float]:
+    """Single-value counterpart of rolling_zscores() over an explicit window"""
+    if len(previous) < min_history:
+        return None
+    window = np.fromiter(previous, dtype=np.float64)
+    return float((value - window.mean()) / max(window.std(), MIN_STD))
+
+
+def _empty_summary() -> Dict[str, Any]:
+    return {"registers": 0, "total_difference": 0.0, "shortage": 0.0, "flagged": 0}
+
+
+class DiscrepancyAnalytics:
+    """Close differences scored per responsible person and per weekday.
+
+    ``fit`` scores the whole history at once; ``add`` scores one newly closed
+    register against the kept windows, so the cached result stays current
+    without reloading the history.
+    """
+
+    def __init__(self, window: int = WINDOW, threshold: float = Z_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self.windows: Dict[Tuple[str, Any], deque] = {}
+        self.summary: Dict[str, Dict[Any, Dict[str, Any]]] = {d: {} for d in DIMENSIONS}
+        self.alerts: List[Dict[str, Any]] = []
+        self.registers = 0
+        self.built_at: Optional[datetime] = None
+
+    def _flagged(self, scores: Dict[str, Optional[float]]) -> bool:
+        return any(z is not None and abs(z) >= self.threshold for z in scores.values())
+
+    def _count(self, keys: Dict[str, Any], difference: float, flagged: bool):
+        for dimension, key in keys.items():
+            summary = self.summary[dimension].setdefault(key, _empty_summary())
+            summary["registers"] += 1
+            summary["total_difference"] += difference
+            summary["shortage"] += min(difference, 0.0)
+            summary["flagged"] += int(flagged)
+
+    def fit(self, history: Dict[str, Any]) -> "DiscrepancyAnalytics":
+        difference = history["difference"]
+        codes = {"responsible": history["responsible"], "weekday": history["weekday"]}
+        names = {
+            "responsible": history["responsibles"],
+            "weekday": list(range(len(WEEKDAYS)))
+        }
+
+        scores = {d: rolling_zscores(difference, codes[d], self.window)[2] for d in DIMENSIONS}
+        flagged = np.zeros(len(difference), dtype=bool)
+        for z in scores.values():
+            flagged |= np.abs(np.nan_to_num(z)) >= self.threshold
+
+        for dimension in DIMENSIONS:
+            group_codes = codes[dimension]
+            size = len(names[dimension])
+            registers = np.bincount(group_codes, minlength=size)
+            totals = np.bincount(group_codes, weights=difference, minlength=size)
+            shortages = np.bincount(group_codes, weights=np.minimum(difference, 0.0), minlength=size)
+            flags = np.bincount(group_codes, weights=flagged, minlength=size)
+            for code in np.flatnonzero(registers):
+                self.summary[dimension][names[dimension][code]] = {
+                    "registers": int(registers[code]),
+                    "total_difference": float(totals[code]),
+                    "shortage": float(shortages[code]),
+                    "flagged": int(flags[code])
+                }
+                # Keep the latest values per group for add()
+                latest = difference[group_codes == code][-self.window:]
+                self.windows[(dimension, names[dimension][code])] = deque(latest.tolist(), maxlen=self.window)
+
+        for i in np.flatnonzero(flagged)[-ALERT_LIMIT:]:
+            self.alerts.append({
+                "register_id": str(history["register_ids"][i]),
+                "date": history["dates"][i],
+                "responsible": history["responsibles"][history["responsible"][i]],
+                "weekday": WEEKDAYS[history["weekday"][i]],
+                "difference": float(difference[i]),
+                "expected_amount": float(history["expected_amount"][i]),
+                **{f"z_{d}": None if np.isnan(scores[d][i]) else float(scores[d][i]) for d in DIMENSIONS}
+            })
+
+        self.registers = len(difference)
+        self.built_at = datetime.now()
+        return self
+
+    def add(self, register: Dict[str, Any]):
+        """Score and account for one newly closed register"""
+        difference = float(register["difference"])
+        keys = {
+            "responsible": register.get("responsible") or "",
+            "weekday": register["date"].weekday()
+        }
+
+        scores = {}
+        for dimension, key in keys.items():
+            previous = self.windows.setdefault((dimension, key), deque(maxlen=self.window))
+            scores[dimension] = window_zscore(previous, difference)
+            previous.append(difference)
+
+        flagged = self._flagged(scores)
+        self._count(keys, difference, flagged)
+        self.registers += 1
+
+        if flagged:
+            self.alerts.append({
+                "register_id": str(register["_id"]),
+                "date": register["date"],
+                "responsible": keys["responsible"],
+                "weekday": WEEKDAYS[keys["weekday"]],
+                "difference": difference,
+                "expected_amount": float(register.get("expected_amount") or 0),
+                **{f"z_{d}": scores[d] for d in DIMENSIONS}
+            })
+            self.alerts = self.alerts[-ALERT_LIMIT:]
+
+    def report(self) -> Dict[str, Any]:
+        def rows(dimension, label):
+            return [
+                {label: key, **summary,
+                 "mean_difference": summary["total_difference"] / summary["registers"]}
+                for key, summary in self.summary[dimension].items()
+            ]
+
+        by_weekday = sorted(rows("weekday", "weekday"), key=lambda r: r["weekday"])
+        for row in by_weekday:
+            row["weekday"] = WEEKDAYS[row["weekday"]]
+
+        return {
+            "registers": self.registers,
+            "window": self.window,
+            "threshold": self.threshold,
+            "built_at": self.built_at,
+            "alerts": list(reversed(self.alerts)),
+            "by_responsible": sorted(rows("responsible", "responsible"), key=lambda r: r["shortage"]),
+            "by_weekday": by_weekday
+        }
+
+
+# Built on first request, then kept current by record_closed_register().
+# Lives in the application process like the ETag counters.
+_analytics: Optional[DiscrepancyAnalytics] = None
+
+
+async def discrepancy_report(db) -> Dict[str, Any]:
+    global _analytics
+    if _analytics is None:
+        history = await load_close_history(db)
+        _analytics = DiscrepancyAnalytics().fit(history)
+        logger.info(f"Scored close differences of {_analytics.registers} registers")
+    return _analytics.report()
+
+
+def record_closed_register(register: Dict[str, Any]):
+    """Fold a just-closed register into the cached analytics, if built"""
+    if _analytics is not None and isinstance(register.get("difference"), (int, float)):
+        _analytics.add(register)
+
+
+def invalidate_discrepancy_report():
+    """Drop the cached analytics after closed registers were edited or deleted"""
+    global _analytics
+    _analytics = None
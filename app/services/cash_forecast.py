@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set, Tuple
+import numpy as np
+import logging
+from .cash_reports import day_start, rollup_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Days of history the model is fitted on, so the trend follows recent sales
+HISTORY_DAYS = 365
+
+# Below this the weekday profile is not estimable
+MIN_HISTORY_DAYS = 14
+
+MAX_FORECAST_DAYS = 90
+
+# Seven weekday levels plus a linear trend in years
+FEATURES = 8
+
+# ~95% band under normal residuals
+BAND_Z = 1.96
+
+
+class IncomeForecaster:
+    """Daily income as a weekday profile plus a linear trend.
+
+    Fitted by least squares from accumulated normal equations, so a day's
+    income can be added or revised in O(1) and the model re-solved without
+    touching the history again. Days without any register count as zero
+    income (the shop was closed).
+    """
+
+    def __init__(self, origin: datetime):
+        self.origin = origin
+        self.incomes: Dict[datetime, float] = {}
+        self.unsettled: Set[datetime] = set()
+        self.last_day: Optional[datetime] = None
+        self.xtx = np.zeros((FEATURES, FEATURES))
+        self.xty = np.zeros(FEATURES)
+        self.yy = 0.0
+        self.coef = np.zeros(FEATURES)
+        self.sigma = 0.0
+
+    def features(self, day: datetime) -> np.ndarray:
+        x = np.zeros(FEATURES)
+        x[day.weekday()] = 1.0
+        x[7] = (day - self.origin).days / 365.0
+        return x
+
+    def _accumulate(self, day: datetime, income: float, sign: float):
+        x = self.features(day)
+        self.xtx += sign * np.outer(x, x)
+        self.xty += sign * income * x
+        self.yy += sign * income * income
+
+    def fit(self, incomes: Dict[datetime, float], until: datetime,
+            unsettled: Optional[Set[datetime]] = None) -> "IncomeForecaster":
+        """Fit on the days from origin up to (excluding) ``until``.
+
+        Days in ``unsettled`` (a register still open) are left out rather
+        than read as closed; they come in through add_income() on close.
+        """
+        self.unsettled = unsettled = set(unsettled or ())
+        days = [
+            day for day in (self.origin + timedelta(days=i) for i in range((until - self.origin).days))
+            if day not in unsettled
+        ]
+        self.incomes = {day: float(incomes.get(day, 0.0)) for day in days}
+        self.last_day = days[-1] if days else None
+        if days:
+            X = np.array([self.features(day) for day in days])
+            y = np.array([self.incomes[day] for day in days])
+            self.xtx = X.T @ X
+            self.xty = X.T @ y
+            self.yy = float(y @ y)
+        return self.solve()
+
+    def add_income(self, day: datetime, amount: float) -> "IncomeForecaster":
+        """Account for income closed on ``day`` (a new or an already known day)"""
+        day = day_start(day)
+        if day < self.origin:
+            return self
+
+        # Days skipped since the last observation had no sales
+        if self.last_day is not None:
+            gap = self.last_day + timedelta(days=1)
+            while gap < day:
+                if gap not in self.unsettled:
+                    self.incomes[gap] = 0.0
+                    self._accumulate(gap, 0.0, 1.0)
+                gap += timedelta(days=1)
+
+        previous = self.incomes.get(day)
+        if previous is not None:
+            self._accumulate(day, previous, -1.0)
+        income = (previous or 0.0) + amount
+        self.incomes[day] = income
+        self._accumulate(day, income, 1.0)
+        if self.last_day is None or day > self.last_day:
+            self.last_day = day
+        return self.solve()
+
+    def solve(self) -> "IncomeForecaster":
+        n = len(self.incomes)
+        if n < MIN_HISTORY_DAYS:
+            self.coef = np.zeros(FEATURES)
+            self.sigma = 0.0
+            return self
+
+        self.coef = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        sse = self.yy - 2.0 * self.coef @ self.xty + self.coef @ self.xtx @ self.coef
+        self.sigma = float(np.sqrt(max(sse, 0.0) / max(n - FEATURES, 1)))
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return len(self.incomes) >= MIN_HISTORY_DAYS
+
+    def predict(self, start: datetime, days: int) -> List[Dict[str, Any]]:
+        forecast = []
+        for i in range(days):
+            day = start + timedelta(days=i)
+            income = max(float(self.features(day) @ self.coef), 0.0)
+            forecast.append({
+                "date": day,
+                "income": income,
+                "low": max(income - BAND_Z * self.sigma, 0.0),
+                "high": income + BAND_Z * self.sigma
+            })
+        return forecast
+
+
+async def load_daily_income(db, start: datetime, end: datetime) -> Tuple[Dict[datetime, float], Set[datetime]]:
+    """Income per day of the registers in [start, end).
+
+    Aggregated straight from cash_register, so it does not depend on the
+    rollup store being complete. Returns the income of the days whose
+    registers are all closed and, separately, the days that still have an
+    open register; any other day had no register, i.e. the shop was closed.
+    """
+    rows = await db.cash_register.aggregate(
+        rollup_pipeline({"date": {"$gte": start, "$lt": end}})
+    ).to_list(None)
+    incomes, unsettled = {}, set()
+    for row in rows:
+        if row["open_registers"]:
+            unsettled.add(row["date"])
+        else:
+            incomes[row["date"]] = float(row.get("total_income") or 0)
+    return incomes, unsettled
+
+
+async def fit_forecaster(db, today: datetime) -> IncomeForecaster:
+    first = await db.cash_register.find_one(
+        {"status": "closed"}, {"date": 1}, sort=[("date", 1)]
+    )
+    origin = max(day_start(first["date"]), today - timedelta(days=HISTORY_DAYS)) if first else today
+    tomorrow = today + timedelta(days=1)
+    incomes, unsettled = await load_daily_income(db, origin, tomorrow)
+    # Today only counts once every register closed, otherwise history ends yesterday
+    until = tomorrow if today in incomes else today
+    return IncomeForecaster(origin).fit(incomes, until, unsettled)
+
+
+# Fitted once per day, then revised by record_closed_income() on every close.
+# Lives in the application process like the ETag counters.
+_forecaster: Optional[IncomeForecaster] = None
+_fitted_for: Optional[datetime] = None
+
+
+async def income_forecast(db, days: int = 14) -> Dict[str, Any]:
+    global _forecaster, _fitted_for
+    today = day_start(datetime.now())
+    if _forecaster is None or _fitted_for != today:
+        _forecaster = await fit_forecaster(db, today)
+        _fitted_for = today
+        logger.info(f"Fitted income forecast on {len(_forecaster.incomes)} days")
+
+    model = _forecaster
+    start = today if today not in model.incomes else today + timedelta(days=1)
+    return {
+        "history_days": len(model.incomes),
+        "ready": model.ready,
+        "weekday_profile": model.coef[:7].tolist(),
+        "trend_per_day": float(model.coef[7] / 365.0),
+        "sigma": model.sigma,
+        "forecast": model.predict(start, days) if model.ready else []
+    }
+
+
+def record_closed_income(register: Dict[str, Any]):
+    """Add a just-closed register's income to today's fitted model"""
+    global _forecaster
+    if _forecaster is None:
+        return
+    if day_start(register["date"]) in _forecaster.unsettled:
+        # The day's other registers were left out of the fit, refit it whole
+        _forecaster = None
+    else:
+        _forecaster.add_income(register["date"], float(register.get("total_income") or 0))
+
+
+def invalidate_income_forecast():
+    """Refit on next request after closed registers were edited or deleted"""
+    global _forecaster
+    _forecaster = None
@@ -0,0 +1,542 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import logging
+from .inventory_query import encode_cursor, decode_time_cursor
+from ..utils.versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+INCOME = "income"
+EXPENSE = "expense"
+TRANSACTION_TYPES = [INCOME, EXPENSE]
+
+# Running totals kept on every register document
+TOTAL_FIELDS = {INCOME: "total_income", EXPENSE: "total_expenses"}
+
+# Register reads without the (legacy embedded) history
+REGISTER_HEADER_PROJECTION = {"transactions": 0, "logs": 0}
+
+TRANSACTION_PAGE_SIZE = 100
+
+# Times a batch is deduplicated and retried after losing a client_id race
+MAX_RECORD_ATTEMPTS = 3
+
+
+def _sum_of(transaction_type: str) -> Dict[str, Any]:
+    return {"$sum": {"$map": {
+        "input": {"$filter": {
+            "input": {"$ifNull": ["$transactions", []]},
+            "as": "t",
+            "cond": {"$eq": ["$$t.type", transaction_type]}
+        }},
+        "as": "t",
+        "in": "$$t.amount"
+    }}}
+
+
+# Recomputes the running totals from the embedded transactions server-side
+TOTALS_FROM_TRANSACTIONS = {
+    "total_income": _sum_of(INCOME),
+    "total_expenses": _sum_of(EXPENSE),
+    "transaction_count": {"$size": {"$ifNull": ["$transactions", []]}}
+}
+
+
+def empty_totals() -> Dict[str, Any]:
+    return {"total_income": 0.0, "total_expenses": 0.0, "transaction_count": 0}
+
+
+def totals_increment(transaction_type: str, amount: float) -> Dict[str, Any]:
+    """$inc document that accounts for one more transaction"""
+    return {TOTAL_FIELDS[transaction_type]: amount, "transaction_count": 1}
+
+
+def register_totals(register: Dict[str, Any]) -> Dict[str, Any]:
+    """Income, expenses and count of a register.
+
+    Uses the stored running totals; registers written before they existed
+    fall back to summing their transactions.
+    """
+    if "total_income" in register:
+        return {
+            "total_income": register.get("total_income", 0.0),
+            "total_expenses": register.get("total_expenses", 0.0),
+            "transaction_count": register.get("transaction_count", 0)
+        }
+
+    transactions = register.get("transactions") or []
+    return {
+        "total_income": sum(t["amount"] for t in transactions if t["type"] == INCOME),
+        "total_expenses": sum(t["amount"] for t in transactions if t["type"] == EXPENSE),
+        "transaction_count": len(transactions)
+    }
+
+
+async def refresh_register_totals(db, query: Dict[str, Any] = None) -> int:
+    """Recompute the running totals of matching registers in one update"""
+    result = await db.cash_register.update_many(
+        query or {},
+        [{"$set": TOTALS_FROM_TRANSACTIONS}]
+    )
+    logger.info(f"Refreshed totals of {result.modified_count} cash registers")
+    if result.modified_count:
+        bump_version("cash_register")
+    return result.modified_count
+
+
+def day_counter_key(day: datetime) -> str:
+    return f"cash_register:{day.strftime('%Y-%m-%d')}"
+
+
+async def registers_numbered(db, day: datetime) -> int:
+    """Highest number already used by the day's registers (or their count,
+    for registers created before numbers were stored)"""
+    start = datetime(day.year, day.month, day.day)
+    query = {"date": {"$gte": start, "$lt": start + timedelta(days=1)}}
+    count = await db.cash_register.count_documents(query)
+    if not count:
+        return 0
+    highest = await db.cash_register.find_one(
+        {**query, "register_number": {"$type": "number"}},
+        {"register_number": 1},
+        sort=[("register_number", -1)]
+    )
+    return max(count, int(highest["register_number"]) if highest else 0)
+
+
+async def next_register_number(db, day: datetime) -> int:
+    """Atomically hand out the next register number for a day.
+
+    The day's counter is created on first use, seeded with ``$max`` from the
+    registers that already exist for that day, so numbering continues from
+    them instead of restarting at 1.
+    """
+    key = day_counter_key(day)
+    counter = await db.counters.find_one_and_update(
+        {"_id": key}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        try:
+            await db.counters.update_one(
+                {"_id": key}, {"$max": {"seq": await registers_numbered(db, day)}}, upsert=True
+            )
+        except DuplicateKeyError:
+            # Another request created the counter first
+            pass
+        counter = await db.counters.find_one_and_update(
+            {"_id": key}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+        )
+    return counter["seq"]
+
+
+async def release_register_number(db, day: datetime, number: int):
+    """Give a number back if the register it was taken for was not created"""
+    await db.counters.update_one(
+        {"_id": day_counter_key(day), "seq": number},
+        {"$inc": {"seq": -1}}
+    )
+
+
+def register_balance(register: Dict[str, Any]) -> float:
+    """Cash expected in the drawer given the register's running totals"""
+    totals = register_totals(register)
+    return register.get("initial_amount_counted", 0.0) + totals["total_income"] - totals["total_expenses"]
+
+
+def signed_amount(transaction: Dict[str, Any]) -> float:
+    return transaction["amount"] if transaction["type"] == INCOME else -transaction["amount"]
+
+
+def batch_increment(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """$inc document that accounts for several transactions at once"""
+    increment = empty_totals()
+    for transaction in transactions:
+        increment[TOTAL_FIELDS[transaction["type"]]] += transaction["amount"]
+        increment["transaction_count"] += 1
+    return increment
+
+
+def dedupe_by_client_id(transactions: List[Dict[str, Any]], seen: set) -> List[Dict[str, Any]]:
+    """Drop transactions whose idempotency key was already seen, keeping order"""
+    unique = []
+    for transaction in transactions:
+        key = transaction.get("client_id")
+        if key:
+            if key in seen:
+                continue
+            seen.add(key)
+        unique.append(transaction)
+    return unique
+
+
+async def record_transactions(db, register_id: ObjectId,
+                              transactions: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Account for a batch of transactions on an open register and store them.
+
+    Transactions carrying a ``client_id`` already stored for the register
+    (a retried request or a re-sent offline queue) are returned as
+    duplicates instead of being counted again. The remaining ones are
+    accounted with a single ``$inc``, guarded on the register being open,
+    which also hands out their ``seq`` numbers, and inserted in one
+    ``insert_many``, both in one transaction. When a concurrent retry stored
+    one of the rows first, the unique client_id index aborts the whole
+    transaction and the batch is deduplicated again and retried.
+
+    Returns ``None`` when the register is missing, or closed while the batch
+    still has new transactions, otherwise the updated register header with
+    the created and duplicate rows.
+    """
+    for _ in range(MAX_RECORD_ATTEMPTS):
+        existing = await stored_by_client_id(db, register_id, transactions)
+        new = dedupe_by_client_id(transactions, set(existing))
+
+        if not new:
+            # Nothing left to account: duplicates are acknowledged even once
+            # the register has closed, so a client can drain its queue
+            register = await db.cash_register.find_one({"_id": register_id}, REGISTER_HEADER_PROJECTION)
+            if not register:
+                return None
+            return {"register": register, "created": [], "duplicates": list(existing.values())}
+
+        outcome: Dict[str, Any] = {}
+
+        async def apply(session):
+            outcome.clear()
+            register = await db.cash_register.find_one_and_update(
+                {"_id": register_id, "status": {"$ne": "closed"}},
+                {"$inc": {**batch_increment(new), "last_seq": len(new)},
+                 "$set": {"last_updated": datetime.now()}},
+                projection=REGISTER_HEADER_PROJECTION,
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+            if not register:
+                return
+
+            # Number and balance the batch in order, ending at the updated header
+            seq = register["last_seq"] - len(new)
+            balance = register_balance(register) - sum(signed_amount(t) for t in new)
+            docs = []
+            for transaction in new:
+                seq += 1
+                balance += signed_amount(transaction)
+                docs.append({
+                    **transaction,
+                    "cash_register_id": register_id,
+                    "seq": seq,
+                    "balance_after": balance
+                })
+            await db.cash_transactions.insert_many(docs, ordered=False, session=session)
+            outcome.update({"register": register, "created": docs})
+
+        try:
+            async with await db.client.start_session() as session:
+                await session.with_transaction(apply)
+        except BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            continue
+
+        if not outcome:
+            return None
+        return {**outcome, "duplicates": list(existing.values())}
+
+    raise RuntimeError(f"Could not record transactions on register {register_id}")
+
+
+async def stored_by_client_id(db, register_id: ObjectId,
+                              transactions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Rows of the register already stored under the batch's client_ids"""
+    keys = [t["client_id"] for t in transactions if t.get("client_id")]
+    existing = {}
+    if keys:
+        async for doc in db.cash_transactions.find(
+            {"cash_register_id": register_id, "client_id": {"$in": keys}}
+        ):
+            existing[doc["client_id"]] = doc
+    return existing
+
+
+async def record_transaction(db, register_id: ObjectId,
+                             transaction: Dict[str, Any]) -> Optional[tuple]:
+    """Single-transaction form of record_transactions.
+
+    Returns the register header and the stored row (the existing one if
+    the client_id was already recorded), or ``None`` when the register is
+    closed or missing.
+    """
+    result = await record_transactions(db, register_id, [transaction])
+    if result is None:
+        return None
+    rows = result["created"] or result["duplicates"]
+    return result["register"], rows[0]
+
+
+async def list_transactions(db, register_id: ObjectId, limit: int = TRANSACTION_PAGE_SIZE,
+                            before: Optional[str] = None) -> Dict[str, Any]:
+    """One page of a register's transactions, newest page first.
+
+    Items come back in time order; ``next_cursor`` points at the page of
+    older transactions, if any. Raises InvalidCursor for a bad ``before``.
+    """
+    query = {"cash_register_id": register_id}
+    if before:
+        time, last_id = decode_time_cursor(before)
+        query["$or"] = [
+            {"time": {"$lt": time}},
+            {"time": time, "_id": {"$lt": last_id}}
+        ]
+
+    docs = await db.cash_transactions.find(query).sort(
+        [("time", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        oldest = docs[limit - 1]
+        next_cursor = encode_cursor(oldest["time"].isoformat(), oldest["_id"])
+    items = docs[:limit]
+    items.reverse()
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def transactions_since(db, register_id: ObjectId, after_seq: int,
+                             limit: int = TRANSACTION_PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Transactions with a sequence number above ``after_seq``, in order"""
+    return await db.cash_transactions.find(
+        {"cash_register_id": register_id, "seq": {"$gt": after_seq}}
+    ).sort("seq", 1).limit(limit).to_list(limit)
+
+
+def iter_transactions(db, register_id: ObjectId):
+    """Cursor over all of a register's transactions in time order"""
+    return db.cash_transactions.find({"cash_register_id": register_id}).sort(
+        [("time", 1), ("_id", 1)]
+    )
+
+
+async def recompute_register_totals(db, register_id: ObjectId) -> Dict[str, Any]:
+    """Reset a register's running totals from its stored transactions"""
+    totals = empty_totals()
+    async for group in db.cash_transactions.aggregate([
+        {"$match": {"cash_register_id": register_id}},
+        {"$group": {"_id": "$type", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    ]):
+        if group["_id"] in TOTAL_FIELDS:
+            totals[TOTAL_FIELDS[group["_id"]]] = group["amount"]
+        totals["transaction_count"] += group["count"]
+
+    await db.cash_register.update_one({"_id": register_id}, {"$set": totals})
+    return totals
+
+
+async def replace_transactions(db, register_id: ObjectId, transactions: List[Dict[str, Any]]):
+    """Swap a register's stored transactions for a new list (admin edits)"""
+    register = await db.cash_register.find_one({"_id": register_id}, {"initial_amount_counted": 1})
+    balance = register.get("initial_amount_counted", 0.0) if register else 0.0
+
+    docs = []
+    for seq, transaction in enumerate(sorted(transactions, key=lambda t: t["time"]), 1):
+        balance += transaction["amount"] if transaction["type"] == INCOME else -transaction["amount"]
+        docs.append({
+            **{key: value for key, value in transaction.items() if key not in ("_id", "seq")},
+            "cash_register_id": register_id,
+            "seq": seq,
+            "balance_after": balance
+        })
+
+    await db.cash_transactions.delete_many({"cash_register_id": register_id})
+    if docs:
+        await db.cash_transactions.insert_many(docs, ordered=False)
+    await db.cash_register.update_one({"_id": register_id}, {"$set": {"last_seq": len(docs)}})
+    return await recompute_register_totals(db, register_id)
+
+
+async def migrate_embedded_transactions(db) -> int:
+    """Move transactions still embedded in register documents into cash_transactions.
+
+    Safe to re-run: a register's migrated rows are replaced before the
+    array is removed, so an interrupted migration does not duplicate them.
+    Returns how many registers were migrated.
+    """
+    migrated = 0
+    cursor = db.cash_register.find(
+        {"transactions.0": {"$exists": True}},
+        {"transactions": 1, "initial_amount_counted": 1}
+    )
+    async for register in cursor:
+        balance = register.get("initial_amount_counted", 0.0)
+        docs = []
+        for seq, transaction in enumerate(sorted(register["transactions"], key=lambda t: t["time"]), 1):
+            balance += transaction["amount"] if transaction["type"] == INCOME else -transaction["amount"]
+            docs.append({
+                **transaction,
+                "cash_register_id": register["_id"],
+                "seq": seq,
+                "balance_after": balance,
+                "migrated": True
+            })
+
+        await db.cash_transactions.delete_many({"cash_register_id": register["_id"], "migrated": True})
+        await db.cash_transactions.insert_many(docs, ordered=False)
+        await db.cash_register.update_one(
+            {"_id": register["_id"]},
+            [
+                {"$set": {**TOTALS_FROM_TRANSACTIONS, "last_seq": len(docs)}},
+                {"$unset": "transactions"}
+            ]
+        )
+        migrated += 1
+
+    if migrated:
+        logger.info(f"Moved embedded transactions of {migrated} cash registers to cash_transactions")
+    return migrated
+
+
+def register_net(register: Dict[str, Any]) -> Dict[str, Any]:
+    totals = register_totals(register)
+    return {
+        "total_income": totals["total_income"],
+        "total_expenses": totals["total_expenses"],
+        "net": totals["total_income"] - totals["total_expenses"]
+    }
+
+
+async def fold_register_into_vault(db, register: Dict[str, Any]) -> bool:
+    """Add a closed register's net to the persisted vault balance once.
+
+    The vault_ledger entry is unique per register, so folding the same
+    register twice is a no-op. Returns whether the balance changed.
+    """
+    entry = {
+        "register_id": register["_id"],
+        "date": register.get("date"),
+        **register_net(register),
+        "folded_at": datetime.now()
+    }
+    try:
+        await db.vault_ledger.insert_one(entry)
+    except DuplicateKeyError:
+        return False
+
+    await db.vault.update_one(
+        {},
+        {
+            "$inc": {
+                "closed_balance": entry["net"],
+                "closed_income": entry["total_income"],
+                "closed_expenses": entry["total_expenses"],
+                "registers_folded": 1
+            },
+            "$set": {"last_updated": datetime.now()}
+        },
+        upsert=True
+    )
+    return True
+
+
+async def unfold_register_from_vault(db, register_id: ObjectId) -> bool:
+    """Take a register's contribution back out of the vault balance"""
+    entry = await db.vault_ledger.find_one_and_delete({"register_id": register_id})
+    if not entry:
+        return False
+
+    await db.vault.update_one(
+        {},
+        {
+            "$inc": {
+                "closed_balance": -entry["net"],
+                "closed_income": -entry["total_income"],
+                "closed_expenses": -entry["total_expenses"],
+                "registers_folded": -1
+            },
+            "$set": {"last_updated": datetime.now()}
+        },
+        upsert=True
+    )
+    return True
+
+
+async def sync_register_in_vault(db, register_id: ObjectId):
+    """Re-fold a register after it was edited or deleted"""
+    await unfold_register_from_vault(db, register_id)
+    register = await db.cash_register.find_one(
+        {"_id": register_id, "status": "closed"},
+        {"date": 1, "total_income": 1, "total_expenses": 1, "transaction_count": 1}
+    )
+    if register:
+        await fold_register_into_vault(db, register)
+
+
+async def rebuild_vault_balance(db) -> float:
+    """Rebuild the vault ledger and balance from every closed register.
+
+    Used once to migrate existing history and to repair the balance if a
+    fold was interrupted between the ledger insert and the balance update.
+    """
+    await db.cash_register.aggregate([
+        {"$match": {"status": "closed"}},
+        {"$project": {
+            "_id": 0,
+            "register_id": "$_id",
+            "date": 1,
+            "total_income": {"$ifNull": ["$total_income", 0]},
+            "total_expenses": {"$ifNull": ["$total_expenses", 0]},
+            "net": {"$subtract": [
+                {"$ifNull": ["$total_income", 0]},
+                {"$ifNull": ["$total_expenses", 0]}
+            ]},
+            "folded_at": "$$NOW"
+        }},
+        {"$out": "vault_ledger"}
+    ]).to_list(None)
+
+    result = await db.vault_ledger.aggregate([
+        {"$group": {
+            "_id": None,
+            "closed_balance": {"$sum": "$net"},
+            "closed_income": {"$sum": "$total_income"},
+            "closed_expenses": {"$sum": "$total_expenses"},
+            "registers_folded": {"$sum": 1}
+        }}
+    ]).to_list(1)
+
+    balance = result[0] if result else {
+        "closed_balance": 0.0,
+        "closed_income": 0.0,
+        "closed_expenses": 0.0,
+        "registers_folded": 0
+    }
+    balance.pop("_id", None)
+    await db.vault.update_one(
+        {},
+        {"$set": {**balance, "last_updated": datetime.now()}},
+        upsert=True
+    )
+    logger.info(f"Rebuilt vault balance from {balance['registers_folded']} closed registers")
+    return balance["closed_balance"]
+
+
+async def get_vault_total(db, open_register: Optional[Dict[str, Any]] = None) -> float:
+    """Vault balance: folded closed registers plus the open register's totals.
+
+    Two point reads regardless of how much history exists. Pass the open
+    register when the caller already has it.
+    """
+    vault = await db.vault.find_one({}, {"closed_balance": 1})
+    if vault and "closed_balance" in vault:
+        closed_balance = vault["closed_balance"]
+    else:
+        closed_balance = await rebuild_vault_balance(db)
+
+    if open_register is None:
+        open_register = await db.cash_register.find_one(
+            {"status": "open"},
+            {"total_income": 1, "total_expenses": 1, "transaction_count": 1}
+        )
+
+    open_net = register_net(open_register)["net"] if open_register else 0.0
+    return closed_balance + open_net
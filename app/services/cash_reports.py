@@ -0,0 +1,283 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set
+from pymongo.errors import BulkWriteError
+import logging
+from .inventory_query import encode_cursor, decode_time_cursor
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("day", "week", "month")
+
+DAY_FORMAT = "%Y-%m-%d"
+
+REGISTER_PAGE_SIZE = 50
+
+# Columns of the closed register listing
+REGISTER_ROW_PROJECTION = {
+    "date": 1,
+    "register_number": 1,
+    "responsible": 1,
+    "initial_amount_counted": 1,
+    "total_income": 1,
+    "total_expenses": 1,
+    "final_count": 1,
+    "difference": 1
+}
+
+# Summed per day by the rollup and again per week/month by summarize()
+ROLLUP_FIELDS = (
+    "registers",
+    "initial_amount",
+    "total_income",
+    "total_expenses",
+    "net",
+    "final_count",
+    "difference",
+    "transaction_count"
+)
+
+
+def _sum_field(field: str) -> Dict[str, Any]:
+    return {"$sum": {"$ifNull": [f"${field}", 0]}}
+
+
+def rollup_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One document per day of the matching registers, _id is the day"""
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateToString": {"format": DAY_FORMAT, "date": "$date"}},
+            "registers": {"$sum": 1},
+            "open_registers": {"$sum": {"$cond": [{"$eq": ["$status", "open"]}, 1, 0]}},
+            "initial_amount": _sum_field("initial_amount_counted"),
+            "total_income": _sum_field("total_income"),
+            "total_expenses": _sum_field("total_expenses"),
+            "final_count": _sum_field("final_count"),
+            "difference": _sum_field("difference"),
+            "transaction_count": _sum_field("transaction_count")
+        }},
+        {"$set": {
+            "date": {"$dateFromString": {"dateString": "$_id", "format": DAY_FORMAT}},
+            "net": {"$subtract": ["$total_income", "$total_expenses"]}
+        }}
+    ]
+
+
+def day_start(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def build_daily_rollups(db, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None):
+    """Persist the rollups of fully closed days in [start, end) into cash_daily_rollups.
+
+    Only days before today whose registers are all closed are stored; their
+    result can no longer change unless a closed register is edited, which
+    goes through refresh_rollup_day().
+    """
+    today = day_start(datetime.now())
+    end = min(end, today) if end else today
+    match = {"date": {"$lt": end}}
+    if start:
+        match["date"]["$gte"] = start
+
+    await db.cash_register.aggregate(rollup_pipeline(match) + [
+        {"$match": {"open_registers": 0}},
+        {"$set": {"built_at": "$$NOW"}},
+        {"$merge": {
+            "into": "cash_daily_rollups",
+            "on": "_id",
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]).to_list(None)
+
+
+def rollups_to_store(rows: List[Dict[str, Any]], stored: Set[str], today: datetime) -> List[Dict[str, Any]]:
+    """Aggregated days that should be stored but are not yet.
+
+    A day qualifies once it is over and all of its registers are closed;
+    registers closed on their own day (the usual flow) are only picked up
+    here, on the first backfill after midnight.
+    """
+    return [
+        row for row in rows
+        if row["date"] < today and not row["open_registers"] and row["_id"] not in stored
+    ]
+
+
+# Days before this one have been backfilled by this process
+_backfilled_through: Optional[datetime] = None
+
+
+async def backfill_rollups(db) -> int:
+    """Store the rollups of closed days that are missing from cash_daily_rollups.
+
+    Runs at startup over the whole history and then on the first read of
+    each new day over the days since the previous run. Days that close later
+    than that (a register left open overnight) are stored by
+    refresh_rollup_day() when the register closes.
+    """
+    global _backfilled_through
+    today = day_start(datetime.now())
+    if _backfilled_through == today:
+        return 0
+
+    match = {"date": {"$lt": today}}
+    if _backfilled_through:
+        match["date"]["$gte"] = _backfilled_through
+    rows = await db.cash_register.aggregate(rollup_pipeline(match)).to_list(None)
+    stored = set(await db.cash_daily_rollups.distinct("_id", match))
+    missing = rollups_to_store(rows, stored, today)
+
+    if missing:
+        now = datetime.utcnow()
+        for row in missing:
+            row["built_at"] = now
+        try:
+            await db.cash_daily_rollups.insert_many(missing, ordered=False)
+        except BulkWriteError as e:
+            # A close stored the same day first; that rollup is as current
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+        logger.info(f"Backfilled {len(missing)} daily cash rollups")
+
+    _backfilled_through = today
+    return len(missing)
+
+
+async def refresh_rollup_day(db, day: datetime):
+    """Rebuild the stored rollup of one day after its registers changed"""
+    start = day_start(day)
+    end = start + timedelta(days=1)
+    if await db.cash_register.count_documents({"date": {"$gte": start, "$lt": end}}, limit=1):
+        await build_daily_rollups(db, start, end)
+    else:
+        await db.cash_daily_rollups.delete_one({"_id": start.strftime(DAY_FORMAT)})
+
+
+async def daily_rollups(db, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Per-day rollups for [start, end), oldest first.
+
+    Closed days come from cash_daily_rollups; today and any earlier day that
+    still has an open register are aggregated live from cash_register.
+    """
+    await backfill_rollups(db)
+    today = day_start(datetime.now())
+    stored = await db.cash_daily_rollups.find(
+        {"date": {"$gte": start, "$lt": end}}
+    ).to_list(None)
+
+    open_days = {
+        day_start(register["date"])
+        for register in await db.cash_register.find(
+            {"status": "open", "date": {"$gte": start, "$lt": min(end, today)}},
+            {"date": 1}
+        ).to_list(None)
+    }
+    clauses = [{"date": {"$gte": day, "$lt": day + timedelta(days=1)}} for day in open_days]
+    if end > today:
+        clauses.append({"date": {"$gte": max(start, today), "$lt": end}})
+
+    live = []
+    if clauses:
+        live = await db.cash_register.aggregate(
+            rollup_pipeline({"$or": clauses})
+        ).to_list(None)
+
+    live_days = {row["_id"] for row in live}
+    rows = [row for row in stored if row["_id"] not in live_days] + live
+    return sorted(rows, key=lambda row: row["_id"])
+
+
+def period_start(day: datetime, period: str) -> datetime:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def summarize(rows: List[Dict[str, Any]], period: str = "day") -> List[Dict[str, Any]]:
+    """Fold daily rollups into day, week (from Monday) or month buckets"""
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    for row in rows:
+        key = period_start(row["date"], period)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"period_start": key, "days": 0, **{f: 0 for f in ROLLUP_FIELDS}}
+        bucket["days"] += 1
+        for field in ROLLUP_FIELDS:
+            bucket[field] += row.get(field) or 0
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def rollup_totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    totals = {f: 0 for f in ROLLUP_FIELDS}
+    for row in rows:
+        for field in ROLLUP_FIELDS:
+            totals[field] += row.get(field) or 0
+    return totals
+
+
+async def period_report(db, start: datetime, end: datetime, period: str = "day") -> Dict[str, Any]:
+    """Cash summary of [start, end) grouped by day, week or month"""
+    rows = await daily_rollups(db, start, end)
+    return {
+        "period": period,
+        "start": start,
+        "end": end,
+        "rows": summarize(rows, period),
+        "totals": rollup_totals(rows)
+    }
+
+
+def closed_registers_query(start: datetime, end: datetime) -> Dict[str, Any]:
+    return {"status": "closed", "date": {"$gte": start, "$lt": end}}
+
+
+async def list_closed_registers(db, start: datetime, end: datetime,
+                                limit: int = REGISTER_PAGE_SIZE,
+                                before: Optional[str] = None) -> Dict[str, Any]:
+    """One page of the closed registers in [start, end), newest first.
+
+    Keyset paginated on (date, _id); ``next_cursor`` points at the page of
+    older registers, if any. Raises InvalidCursor for a bad ``before``.
+    """
+    query = closed_registers_query(start, end)
+    if before:
+        last_date, last_id = decode_time_cursor(before)
+        query["$or"] = [
+            {"date": {"$lt": last_date}},
+            {"date": last_date, "_id": {"$lt": last_id}}
+        ]
+
+    docs = await db.cash_register.find(query, REGISTER_ROW_PROJECTION).sort(
+        [("date", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        oldest = docs[limit - 1]
+        next_cursor = encode_cursor(oldest["date"].isoformat(), oldest["_id"])
+    return {"items": docs[:limit], "next_cursor": next_cursor}
+
+
+async def closed_register_totals(db, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Totals of the closed registers in [start, end) in one aggregation"""
+    result = await db.cash_register.aggregate([
+        {"$match": closed_registers_query(start, end)},
+        {"$group": {
+            "_id": None,
+            "registers": {"$sum": 1},
+            "initial_amount": _sum_field("initial_amount_counted"),
+            "total_income": _sum_field("total_income"),
+            "total_expenses": _sum_field("total_expenses"),
+            "final_count": _sum_field("final_count"),
+            "difference": _sum_field("difference"),
+            "transaction_count": _sum_field("transaction_count")
+        }},
+        {"$set": {"net": {"$subtract": ["$total_income", "$total_expenses"]}}},
+        {"$unset": "_id"}
+    ]).to_list(1)
+    return result[0] if result else {f: 0 for f in ROLLUP_FIELDS}
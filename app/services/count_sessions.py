@@ -0,0 +1,260 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from ..utils.versioning import bump_version
+from .inventory import stock_status
+from .order_suggestions import sync_item_suggestions
+import logging
+
+logger = logging.getLogger(__name__)
+
+COUNT_IN_PROGRESS = "in_progress"
+COUNT_COMPLETED = "completed"
+
+
+def serialize_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a count session document to a JSON-friendly dict"""
+    lines = session.get("lines", {})
+    return {
+        "_id": str(session["_id"]),
+        "status": session["status"],
+        "started_at": session["started_at"].isoformat(),
+        "updated_at": session["updated_at"].isoformat() if session.get("updated_at") else None,
+        "revision": session.get("revision", 0),
+        "lines": {
+            item_id: {
+                "current_stock": line["current_stock"],
+                "counted_stock": line["counted_stock"],
+                "counted_by": line.get("counted_by"),
+            }
+            for item_id, line in lines.items()
+        },
+    }
+
+
+async def get_or_start_session(db, user: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the user's in-progress count session, creating it if needed.
+
+    The session is keyed on the user, not the device, so a count started on
+    one tablet can be resumed from any other.
+    """
+    now = datetime.utcnow()
+    return await db.count_sessions.find_one_and_update(
+        {"user_id": ObjectId(user["_id"]), "status": COUNT_IN_PROGRESS},
+        {
+            "$setOnInsert": {
+                "user_id": ObjectId(user["_id"]),
+                "username": user["username"],
+                "started_at": now,
+                "status": COUNT_IN_PROGRESS,
+                "lines": {},
+                "revision": 0,
+            }
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def save_count_lines(
+    db,
+    session_id: str,
+    user: Dict[str, Any],
+    lines: List[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """Merge a batch of counted lines into an in-progress session.
+
+    Every line is written with its own ``$set`` path, so a line counted twice
+    simply overwrites the previous value and the whole batch costs a single
+    update no matter how many items it carries.
+    """
+    now = datetime.utcnow()
+    updates = {}
+    for line in lines:
+        item_id = str(ObjectId(line["item_id"]))
+        updates[f"lines.{item_id}"] = {
+            "current_stock": float(line.get("current_stock", 0)),
+            "counted_stock": float(line.get("counted_stock", 0)),
+            "counted_by": user["username"],
+            "counted_at": now,
+        }
+    updates["updated_at"] = now
+
+    return await db.count_sessions.find_one_and_update(
+        {
+            "_id": ObjectId(session_id),
+            "user_id": ObjectId(user["_id"]),
+            "status": COUNT_IN_PROGRESS,
+        },
+        {"$set": updates, "$inc": {"revision": 1}},
+        projection={"lines": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def write_count(
+    db,
+    user: Dict[str, Any],
+    items: List[Dict[str, Any]],
+    notes: str = "",
+    session=None
+) -> Dict[str, Any]:
+    """Record a weekly count and write it to the inventory in bulk.
+
+    Stock levels are read once for all counted items, then the movements are
+    written with a single ``insert_many`` and the stock updates with a single
+    ``bulk_write``, all in ``session`` when one is given. Returns the summary
+    with the ids of the items that were written.
+    """
+    now = datetime.utcnow()
+    item_ids = [ObjectId(item["item_id"]) for item in items]
+    cursor = db.inventory.find(
+        {"_id": {"$in": item_ids}},
+        {"current_stock": 1, "min_stock": 1},
+        session=session
+    )
+    stored = {doc["_id"]: doc async for doc in cursor}
+
+    result = await db.weekly_counts.insert_one({
+        "user_id": ObjectId(user["_id"]),
+        "username": user["username"],
+        "count_date": now,
+        "items": items,
+        "notes": notes,
+        "status": COUNT_COMPLETED
+    }, session=session)
+    logger.info(f"Created weekly count session: {result.inserted_id}")
+
+    movements = []
+    stock_updates = []
+    items_below_min = []
+    for item_id, item in zip(item_ids, items):
+        doc = stored.get(item_id)
+        if not doc:
+            logger.warning(f"Skipping counted item {item_id}: not in inventory")
+            continue
+
+        previous_stock = float(doc.get("current_stock", 0))
+        counted_stock = float(item["counted_stock"])
+        movements.append({
+            "item_id": item_id,
+            "user_id": ObjectId(user["_id"]),
+            "username": user["username"],
+            "quantity": counted_stock - previous_stock,
+            "previous_stock": previous_stock,
+            "new_stock": counted_stock,
+            "timestamp": now,
+            "notes": f"Conteo semanal: {notes}",
+            "movement_type": "count",
+            "count_id": result.inserted_id
+        })
+        min_stock = float(doc.get("min_stock", 0))
+        stock_updates.append(UpdateOne(
+            {"_id": item_id},
+            {"$set": {
+                "current_stock": counted_stock,
+                "stock_status": stock_status(counted_stock, min_stock),
+                "last_count": now,
+                "last_counted_by": user["username"]
+            }}
+        ))
+
+        if counted_stock <= min_stock:
+            items_below_min.append(str(item_id))
+
+    if movements:
+        await db.stock_movements.insert_many(movements, ordered=False, session=session)
+        await db.inventory.bulk_write(stock_updates, ordered=False, session=session)
+
+    return {
+        "count_id": str(result.inserted_id),
+        "items_counted": len(movements),
+        "items_below_min": len(items_below_min),
+        "item_ids": [movement["item_id"] for movement in movements]
+    }
+
+
+async def count_written(db, summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Follow-up of a committed count: cache versions and restock lines"""
+    item_ids = summary.pop("item_ids")
+    summary["suggestions_created"] = 0
+    if item_ids:
+        bump_version("inventory")
+        # One pending suggestion line per counted item that now needs a restock
+        summary["suggestions_created"] = await sync_item_suggestions(
+            db, item_ids, source="weekly_count"
+        )
+    return summary
+
+
+async def apply_count(
+    db,
+    user: Dict[str, Any],
+    items: List[Dict[str, Any]],
+    notes: str = ""
+) -> Dict[str, Any]:
+    """Record a weekly count, apply it to the inventory and sync suggestions"""
+    return await count_written(db, await write_count(db, user, items, notes))
+
+
+async def finalize_session(
+    db,
+    session_id: str,
+    user: Dict[str, Any],
+    notes: str = ""
+) -> Optional[Dict[str, Any]]:
+    """Apply the saved lines of an in-progress session and close it.
+
+    Items without a saved line were left unchanged and are not written.
+    Closing the session and writing its count share a transaction, so a
+    second submit from another device finds nothing in progress, and a
+    failure (or a crash) part way leaves the session in progress with
+    nothing applied. Returns ``None`` when there is no in-progress session
+    with that id.
+    """
+    outcome: Dict[str, Any] = {}
+
+    async def apply(txn):
+        outcome.clear()
+        now = datetime.utcnow()
+        session = await db.count_sessions.find_one_and_update(
+            {
+                "_id": ObjectId(session_id),
+                "user_id": ObjectId(user["_id"]),
+                "status": COUNT_IN_PROGRESS,
+            },
+            {"$set": {"status": COUNT_COMPLETED, "completed_at": now, "updated_at": now, "notes": notes}},
+            return_document=ReturnDocument.AFTER,
+            session=txn,
+        )
+        if not session:
+            return
+
+        items = [
+            {
+                "item_id": item_id,
+                "current_stock": line["current_stock"],
+                "counted_stock": line["counted_stock"],
+            }
+            for item_id, line in session.get("lines", {}).items()
+        ]
+        summary = await write_count(db, user, items, notes, session=txn) if items else {
+            "count_id": None,
+            "items_counted": 0,
+            "items_below_min": 0,
+            "item_ids": []
+        }
+        await db.count_sessions.update_one(
+            {"_id": session["_id"]},
+            {"$set": {"weekly_count_id": ObjectId(summary["count_id"]) if summary["count_id"] else None}},
+            session=txn
+        )
+        outcome.update(summary)
+
+    async with await db.client.start_session() as txn:
+        await txn.with_transaction(apply)
+
+    if not outcome:
+        return None
+    return await count_written(db, outcome)
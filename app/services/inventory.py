@@ -1,20 +1,66 @@
 from datetime import datetime
 from typing import Dict, Any
+from bson import ObjectId
 from ..database import get_db
+from ..utils.versioning import bump_version
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Stored on every inventory item so it can be filtered, indexed and faceted
+STOCK_OUT = "out"
+STOCK_LOW = "low"
+STOCK_OK = "ok"
+STOCK_STATUSES = [STOCK_OUT, STOCK_LOW, STOCK_OK]
+
+# Same rule as stock_status(), for pipeline updates computed server-side
+STOCK_STATUS_EXPR = {
+    "$switch": {
+        "branches": [
+            {"case": {"$lte": [{"$ifNull": ["$current_stock", 0]}, 0]}, "then": STOCK_OUT},
+            {
+                "case": {"$lte": [
+                    {"$ifNull": ["$current_stock", 0]},
+                    {"$ifNull": ["$min_stock", 0]}
+                ]},
+                "then": STOCK_LOW
+            }
+        ],
+        "default": STOCK_OK
+    }
+}
+
+def stock_status(current_stock: float, min_stock: float) -> str:
+    """Classify a stock level the same way the inventory page does"""
+    if current_stock <= 0:
+        return STOCK_OUT
+    if current_stock <= min_stock:
+        return STOCK_LOW
+    return STOCK_OK
+
+async def refresh_stock_status(db, query: Dict[str, Any] = None):
+    """Recompute the stored stock_status of matching items in one update"""
+    result = await db.inventory.update_many(
+        query or {},
+        [{"$set": {"stock_status": STOCK_STATUS_EXPR}}]
+    )
+    logger.info(f"Refreshed stock status of {result.modified_count} items")
+    if result.modified_count:
+        bump_version("inventory")
+    return result.modified_count
+
 async def get_inventory_state(user: Dict[str, Any]) -> Dict[str, bool]:
     """Determine the current inventory state for a user"""
     try:
         db = await get_db()
         
-        # Check for active count session
-        active_count = await db.count_sessions.find_one({
-            "user_id": user.get("_id"),
-            "status": "in_progress"
-        })
+        # Check for active count session; sessions store the user id as an ObjectId
+        active_count = None
+        if user.get("_id"):
+            active_count = await db.count_sessions.find_one({
+                "user_id": ObjectId(user["_id"]),
+                "status": "in_progress"
+            })
 
         # For testing: Always allow count for non-admin users
         is_admin = bool(user.get("is_admin", False))
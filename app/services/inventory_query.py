@@ -0,0 +1,159 @@
+from datetime import datetime
+from typing import Dict, Any, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+import asyncio
+import base64
+import binascii
+import json
+import re
+import logging
+from ..repositories.inventory import QUERY_VIEW
+
+logger = logging.getLogger(__name__)
+
+# Sort keys accepted by the query endpoint; each is backed by an index
+SORT_FIELDS = ["name", "supplier", "category", "current_stock"]
+
+FACET_FIELDS = ["supplier", "category", "stock_status"]
+
+
+def encode_cursor(value: Any, item_id: ObjectId) -> str:
+    """Pack the sort value and _id of the last row into an opaque token"""
+    raw = json.dumps([value, str(item_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+class InvalidCursor(ValueError):
+    """A pagination token that was not produced by encode_cursor"""
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, ObjectId(item_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, InvalidId) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def decode_time_cursor(cursor: str) -> tuple:
+    """decode_cursor for cursors on an ISO datetime and _id"""
+    value, item_id = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(value), item_id
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def build_filters(
+    q: Optional[str] = None,
+    supplier: Optional[str] = None,
+    category: Optional[str] = None,
+    stock_status: Optional[str] = None
+) -> Dict[str, Any]:
+    """Translate the query-string filters into a Mongo match document"""
+    query = {}
+    if supplier:
+        query["supplier"] = supplier
+    if category:
+        query["category"] = category
+    if stock_status:
+        query["stock_status"] = stock_status
+    if q:
+        pattern = {"$regex": re.escape(q), "$options": "i"}
+        query["$or"] = [{"name": pattern}, {"supplier": pattern}]
+    return query
+
+
+def keyset_filter(sort: str, direction: int, cursor: str) -> Dict[str, Any]:
+    """Match only the rows that come after the cursor in (sort, _id) order"""
+    value, last_id = decode_cursor(cursor)
+    op = "$gt" if direction == 1 else "$lt"
+
+    if value is None:
+        # Missing values sort first ascending and last descending
+        if direction == 1:
+            return {"$or": [
+                {sort: {"$ne": None}},
+                {sort: None, "_id": {op: last_id}}
+            ]}
+        return {sort: None, "_id": {op: last_id}}
+
+    branches = [
+        {sort: {op: value}},
+        {sort: value, "_id": {op: last_id}}
+    ]
+    if direction == -1:
+        # Descending, the missing values still come after every value
+        branches.append({sort: None})
+    return {"$or": branches}
+
+
+def page_filter(filters: Dict[str, Any], sort: str, direction: int,
+                cursor: Optional[str] = None) -> Dict[str, Any]:
+    """The filters narrowed to the rows after the cursor"""
+    if not cursor:
+        return filters
+    keyset = keyset_filter(sort, direction, cursor)
+    return {"$and": [filters, keyset]} if filters else keyset
+
+
+async def query_inventory(
+    db,
+    filters: Dict[str, Any],
+    sort: str = "name",
+    direction: int = 1,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Return one page of rows plus facet counts.
+
+    The page is a plain keyset query, so the (sort, _id) indexes serve the
+    cursor, the sort and the limit together and only ``limit + 1`` rows are
+    read. The total and facet counts run as a separate aggregation over the
+    whole filtered set, concurrently with the page.
+
+    Raises InvalidCursor for a cursor that cannot be decoded.
+    """
+    match = page_filter(filters, sort, direction, cursor)
+
+    facets = {
+        field: [
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}
+        ]
+        for field in FACET_FIELDS
+    }
+    counts_pipeline = [
+        {"$match": filters},
+        {"$facet": {"total": [{"$count": "count"}], **facets}}
+    ]
+
+    docs, counts = await asyncio.gather(
+        db.inventory.find(match, QUERY_VIEW.projection)
+        .sort([(sort, direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list(limit + 1),
+        db.inventory.aggregate(counts_pipeline).to_list(1)
+    )
+    result = counts[0]
+
+    next_cursor = None
+    if len(docs) > limit:
+        # Cursor keeps the raw stored value, not the view's default
+        last = docs[limit - 1]
+        next_cursor = encode_cursor(last.get(sort), last["_id"])
+    items = [QUERY_VIEW.row(doc) for doc in docs[:limit]]
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "facets": {
+            field: [
+                {"value": bucket["_id"], "count": bucket["count"]}
+                for bucket in result[field]
+            ]
+            for field in FACET_FIELDS
+        }
+    }
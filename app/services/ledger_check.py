@@ -0,0 +1,239 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterable, Set
+from pymongo import UpdateOne
+import asyncio
+import logging
+from .inventory import stock_status
+from .stock_history import ABSOLUTE_MOVEMENTS, build_checkpoints, nearest_checkpoint
+from ..utils.versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Items checked per unit of work; bounds memory to BATCH_SIZE * workers
+BATCH_SIZE = 500
+WORKERS = 4
+
+# Float noise below this is not reported as drift
+DRIFT_TOLERANCE = 1e-6
+
+# Drifted items kept in the stored report, the counts cover all of them
+REPORT_SAMPLE = 200
+
+# Local time of the nightly report-only run
+NIGHTLY_HOUR = 3
+
+
+def apply_movement(expected: Dict[Any, float], base: Dict[str, float],
+                   movement: Dict[str, Any], unseeded: Optional[Set[Any]] = None):
+    """Advance one item's expected level by a single movement.
+
+    Each item starts from its ``base`` level (keyed by str id), or, when it
+    has none, from the ``previous_stock`` of its first movement: the stock
+    it was created with before anything went through the ledger. Items
+    whose opening level cannot be known are added to ``unseeded`` until a
+    count or manual set, which replaces the running level with its recorded
+    ``new_stock``, grounds them again.
+    """
+    item_id = movement["item_id"]
+    level = expected.get(item_id)
+    if level is None:
+        level = base.get(str(item_id))
+        if level is None:
+            opening = movement.get("previous_stock")
+            level = float(opening or 0)
+            if opening is None and unseeded is not None:
+                unseeded.add(item_id)
+    if movement.get("movement_type") in ABSOLUTE_MOVEMENTS:
+        level = float(movement.get("new_stock") or 0)
+        if unseeded:
+            unseeded.discard(item_id)
+    else:
+        level += float(movement.get("quantity") or 0)
+    expected[item_id] = level
+
+
+def fold_movements(movements: Iterable[Dict[str, Any]], base: Dict[str, float],
+                   unseeded: Optional[Set[Any]] = None) -> Dict[Any, float]:
+    """Expected stock per item from movements in time order"""
+    expected = {}
+    for movement in movements:
+        apply_movement(expected, base, movement, unseeded)
+    return expected
+
+
+async def check_batch(db, items: List[Dict[str, Any]], base: Dict[str, float],
+                      since: Optional[datetime], repair: bool) -> Dict[str, Any]:
+    """Compare one contiguous _id range of items against the ledger"""
+    first_id, last_id = items[0]["_id"], items[-1]["_id"]
+    query = {"item_id": {"$gte": first_id, "$lte": last_id}}
+    if since:
+        query["timestamp"] = {"$gt": since}
+
+    cursor = db.stock_movements.find(
+        query,
+        {"item_id": 1, "quantity": 1, "previous_stock": 1, "new_stock": 1, "movement_type": 1, "_id": 0}
+    ).sort([("item_id", 1), ("timestamp", 1), ("_id", 1)]).batch_size(5000)
+
+    # Folded while streaming, only one level per item is held
+    expected, unseeded = {}, set()
+    async for movement in cursor:
+        apply_movement(expected, base, movement, unseeded)
+
+    drifted, operations, unledgered = [], [], 0
+    for item in items:
+        key = str(item["_id"])
+        if item["_id"] in unseeded:
+            # Opening stock unknown, the ledger cannot vouch for (or repair) it
+            unledgered += 1
+            continue
+        if item["_id"] in expected:
+            level = expected[item["_id"]]
+        elif key in base:
+            level = base[key]
+        else:
+            # Never moved through the ledger, nothing to compare against
+            unledgered += 1
+            continue
+
+        current = float(item.get("current_stock") or 0)
+        if abs(current - level) <= DRIFT_TOLERANCE:
+            continue
+
+        drifted.append({
+            "item_id": key,
+            "name": item.get("name"),
+            "current_stock": current,
+            "expected_stock": level,
+            "drift": current - level
+        })
+        if repair:
+            # Only overwrite if nobody changed the stock since it was read
+            operations.append(UpdateOne(
+                {"_id": item["_id"], "current_stock": item.get("current_stock")},
+                {"$set": {
+                    "current_stock": level,
+                    "stock_status": stock_status(level, float(item.get("min_stock") or 0)),
+                    "last_updated": datetime.utcnow(),
+                    "last_updated_by": "ledger-check"
+                }}
+            ))
+
+    repaired = 0
+    if operations:
+        result = await db.inventory.bulk_write(operations, ordered=False)
+        repaired = result.modified_count
+
+    return {
+        "checked": len(items),
+        "unledgered": unledgered,
+        "drifted": drifted,
+        "repaired": repaired
+    }
+
+
+async def run_ledger_check(db, repair: bool = False, workers: int = WORKERS,
+                           batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """Check every item's current_stock against the movement ledger.
+
+    Expected levels start from the latest stock checkpoint so only the
+    movements recorded after it are streamed. Items are read in _id order
+    and handed out in batches to ``workers`` concurrent tasks; each task
+    streams the movements of its own _id range, so memory stays bounded by
+    the batch size no matter how long the ledger is. With ``repair`` the
+    drifted items are reset to the ledger level. The report is stored in
+    ``ledger_checks``.
+    """
+    started_at = datetime.utcnow()
+    checkpoint = await nearest_checkpoint(db, started_at)
+    base = checkpoint["stocks"] if checkpoint else {}
+    since = checkpoint["as_of"] if checkpoint else None
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    totals = {"checked": 0, "unledgered": 0, "drifted": 0, "repaired": 0}
+    sample: List[Dict[str, Any]] = []
+
+    async def worker():
+        while True:
+            items = await queue.get()
+            try:
+                if items is None:
+                    return
+                result = await check_batch(db, items, base, since, repair)
+                totals["checked"] += result["checked"]
+                totals["unledgered"] += result["unledgered"]
+                totals["drifted"] += len(result["drifted"])
+                totals["repaired"] += result["repaired"]
+                sample.extend(result["drifted"][:REPORT_SAMPLE - len(sample)])
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        batch = []
+        cursor = db.inventory.find(
+            {}, {"name": 1, "current_stock": 1, "min_stock": 1}
+        ).sort("_id", 1).batch_size(batch_size)
+        async for item in cursor:
+            batch.append(item)
+            if len(batch) == batch_size:
+                await queue.put(batch)
+                batch = []
+        if batch:
+            await queue.put(batch)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if totals["repaired"]:
+        bump_version("inventory")
+
+    report = {
+        "started_at": started_at,
+        "finished_at": datetime.utcnow(),
+        "checkpoint": since,
+        "repair": repair,
+        **totals,
+        "sample": sorted(sample, key=lambda d: -abs(d["drift"]))
+    }
+    result = await db.ledger_checks.insert_one(report)
+    report["_id"] = result.inserted_id
+
+    log = logger.warning if totals["drifted"] else logger.info
+    log(
+        f"Ledger check: {totals['checked']} items, {totals['drifted']} drifted, "
+        f"{totals['repaired']} repaired in {report['finished_at'] - started_at}"
+    )
+    return report
+
+
+def serialize_report(report: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **report,
+        "_id": str(report["_id"]),
+        "started_at": report["started_at"].isoformat(),
+        "finished_at": report["finished_at"].isoformat(),
+        "checkpoint": report["checkpoint"].isoformat() if report["checkpoint"] else None
+    }
+
+
+async def nightly_ledger_check(db):
+    """Every night at NIGHTLY_HOUR catch up the stock checkpoints, then run a
+    report-only check from the newest one"""
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=NIGHTLY_HOUR, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
+        try:
+            await build_checkpoints(db)
+        except Exception as e:
+            logger.error(f"Nightly checkpoint build failed: {str(e)}")
+        try:
+            await run_ledger_check(db)
+        except Exception as e:
+            logger.error(f"Nightly ledger check failed: {str(e)}")
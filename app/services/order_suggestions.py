@@ -0,0 +1,319 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Set
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+from .inventory import STOCK_OUT, STOCK_LOW
+from .orders import NO_SUPPLIER, OPEN_ORDER_STATUSES, PO_DRAFT, supplier_orders
+from .supplier_stats import ORDER_CYCLE_DAYS, load_supplier_stats, reorder_point, restock_quantity
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_PENDING = "pending"
+SUGGESTION_PROCESSED = "processed"
+SUGGESTION_RESOLVED = "resolved"
+
+# Items that need a restock, read through the stored stock_status index
+NEEDS_RESTOCK = {"stock_status": {"$in": [STOCK_OUT, STOCK_LOW]}}
+
+DEFAULT_MIN_STOCK = 5
+DEFAULT_MAX_STOCK = 30
+
+PRIORITY_OUT = 1
+PRIORITY_LOW = 2
+
+# Seconds between background refreshes
+REFRESH_INTERVAL = 600
+
+ITEM_PROJECTION = {
+    "name": 1,
+    "supplier": 1,
+    "unit": 1,
+    "presentation": 1,
+    "current_stock": 1,
+    "min_stock": 1,
+    "max_stock": 1,
+    "stock_status": 1
+}
+
+# Order in which the orders page lists suggestions
+SUGGESTION_SORT = [("priority", 1), ("supplier", 1), ("name", 1)]
+
+
+# Pending line count behind the navbar badge. Kept in step by every path that
+# creates, processes or resolves lines and reset by each engine refresh; lives
+# in the application process like the ETag counters.
+_pending_count: Optional[int] = None
+_listeners: Set[asyncio.Queue] = set()
+
+
+def _publish():
+    for queue in _listeners:
+        # Listeners only care about the latest value
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(_pending_count)
+
+
+def set_pending_count(count: int):
+    global _pending_count
+    if count != _pending_count:
+        _pending_count = count
+        _publish()
+
+
+def adjust_pending_count(delta: int):
+    """Account for lines created (positive) or processed/resolved (negative)"""
+    if _pending_count is not None and delta:
+        set_pending_count(max(_pending_count + delta, 0))
+
+
+async def pending_count(db) -> int:
+    """Pending line count, only read from the database before the first refresh"""
+    if _pending_count is None:
+        set_pending_count(await db.order_suggestions.count_documents({"status": SUGGESTION_PENDING}))
+    return _pending_count
+
+
+def subscribe_pending_count() -> asyncio.Queue:
+    """Queue receiving the pending count every time it changes"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    _listeners.add(queue)
+    return queue
+
+
+def unsubscribe_pending_count(queue: asyncio.Queue):
+    _listeners.discard(queue)
+
+
+def item_stats(item: Dict[str, Any], stats: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return stats.get(item.get("supplier") or NO_SUPPLIER)
+
+
+def restock_query(stats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Items that may need a restock: the low ones plus, for suppliers whose
+    lead time pushes the reorder point above min_stock, all of their items"""
+    slower = [
+        supplier for supplier, doc in stats.items()
+        if reorder_point(ORDER_CYCLE_DAYS, doc) > ORDER_CYCLE_DAYS
+    ]
+    if not slower:
+        return NEEDS_RESTOCK
+    return {"$or": [NEEDS_RESTOCK, {"supplier": {"$in": [
+        None if supplier == NO_SUPPLIER else supplier for supplier in slower
+    ]}}]}
+
+
+def needs_restock(item: Dict[str, Any], stats: Dict[str, Dict[str, Any]]) -> bool:
+    """At or below the supplier-adjusted reorder point (min_stock by default)"""
+    if item.get("stock_status") == STOCK_OUT:
+        return True
+    min_stock = item.get("min_stock", DEFAULT_MIN_STOCK)
+    return float(item.get("current_stock") or 0) <= reorder_point(min_stock, item_stats(item, stats))
+
+
+def suggestion_line(item: Dict[str, Any], stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Pending suggestion fields for an item that needs a restock.
+
+    ``stats`` are the rolling lead time and fill rate of the item's supplier,
+    which move its reorder point and quantity; without them the line orders
+    up to max_stock.
+    """
+    current_stock = float(item.get("current_stock") or 0)
+    min_stock = item.get("min_stock", DEFAULT_MIN_STOCK)
+    max_stock = item.get("max_stock")
+    max_stock = DEFAULT_MAX_STOCK if max_stock is None else max_stock
+    return {
+        "name": item.get("name"),
+        "supplier": item.get("supplier"),
+        "unit": item.get("unit"),
+        "presentation": item.get("presentation"),
+        "current_stock": current_stock,
+        "min_stock": min_stock,
+        "reorder_point": reorder_point(min_stock, stats),
+        "quantity": restock_quantity(current_stock, min_stock, max_stock, stats),
+        "priority": PRIORITY_OUT if item.get("stock_status") == STOCK_OUT else PRIORITY_LOW
+    }
+
+
+def upsert_operation(item: Dict[str, Any], stats: Dict[str, Dict[str, Any]],
+                     now: datetime, source: str) -> UpdateOne:
+    return UpdateOne(
+        {"item_id": item["_id"], "status": SUGGESTION_PENDING},
+        {
+            "$set": {**suggestion_line(item, item_stats(item, stats)), "updated_at": now},
+            "$setOnInsert": {"created_at": now, "source": source}
+        },
+        upsert=True
+    )
+
+
+async def items_on_order(db, item_ids: Optional[List[ObjectId]] = None) -> Set[str]:
+    """Ids (as strings) of the items on an order that has not fully arrived,
+    or on a draft purchase order that is still to be sent.
+
+    Their stock stays low until the delivery is received, so they must not
+    be suggested again in the meantime.
+    """
+    query = {"status": {"$in": OPEN_ORDER_STATUSES}}
+    drafts = {"status": PO_DRAFT}
+    if item_ids is not None:
+        query["items.item_id"] = {"$in": [str(item_id) for item_id in item_ids]}
+        drafts["lines.item_id"] = {"$in": [ObjectId(item_id) for item_id in item_ids]}
+    on_order = set(await db.orders.distinct("items.item_id", query))
+    on_order.update(str(item_id) for item_id in await db.purchase_orders.distinct("lines.item_id", drafts))
+    return on_order
+
+
+async def _apply(db, operations: List[UpdateOne]) -> int:
+    if not operations:
+        return 0
+    try:
+        result = await db.order_suggestions.bulk_write(operations, ordered=False)
+        return result.upserted_count
+    except BulkWriteError as e:
+        # A concurrent refresh inserted the same line first; that line wins
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        return e.details.get("nUpserted", 0)
+
+
+async def refresh_suggestions(db, source: str = "engine") -> Dict[str, int]:
+    """Bring the pending suggestions in line with the current stock.
+
+    Every item that needs a restock and is not already on an open order
+    gets exactly one pending line (enforced by a unique index on item_id for
+    pending lines) carrying its supplier, quantity and priority; lines of
+    items that recovered are resolved.
+    """
+    now = datetime.utcnow()
+    stats = await load_supplier_stats(db)
+    on_order = await items_on_order(db)
+    operations, item_ids = [], []
+    async for item in db.inventory.find(restock_query(stats), ITEM_PROJECTION):
+        if needs_restock(item, stats) and str(item["_id"]) not in on_order:
+            operations.append(upsert_operation(item, stats, now, source))
+            item_ids.append(item["_id"])
+
+    created = await _apply(db, operations)
+    resolved = await db.order_suggestions.update_many(
+        {"status": SUGGESTION_PENDING, "item_id": {"$nin": item_ids}},
+        {"$set": {"status": SUGGESTION_RESOLVED, "updated_at": now}}
+    )
+    # Exactly one pending line per item that needs a restock now
+    set_pending_count(len(item_ids))
+    return {"pending": len(item_ids), "created": created, "resolved": resolved.modified_count}
+
+
+async def sync_item_suggestions(db, item_ids: List[ObjectId], source: str = "engine") -> int:
+    """Refresh the suggestion lines of items whose stock just changed"""
+    now = datetime.utcnow()
+    stats = await load_supplier_stats(db)
+    on_order = await items_on_order(db, item_ids)
+    operations, restock = [], []
+    async for item in db.inventory.find(
+        {"_id": {"$in": item_ids}, **restock_query(stats)}, ITEM_PROJECTION
+    ):
+        if needs_restock(item, stats) and str(item["_id"]) not in on_order:
+            operations.append(upsert_operation(item, stats, now, source))
+            restock.append(item["_id"])
+
+    created = await _apply(db, operations)
+    resolved = await db.order_suggestions.update_many(
+        {
+            "status": SUGGESTION_PENDING,
+            "item_id": {"$in": [i for i in item_ids if i not in restock]}
+        },
+        {"$set": {"status": SUGGESTION_RESOLVED, "updated_at": now}}
+    )
+    adjust_pending_count(created - resolved.modified_count)
+    return created
+
+
+async def pending_suggestions(db, query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    return await db.order_suggestions.find(
+        {**(query or {}), "status": SUGGESTION_PENDING}
+    ).sort(SUGGESTION_SORT).to_list(None)
+
+
+async def order_suggested_lines(db, query: Dict[str, Any], username: str,
+                                single: bool = False) -> Optional[Dict[str, Any]]:
+    """Turn the matching pending lines into one restock order per supplier.
+
+    Reading the lines, inserting the orders and marking the lines processed
+    share a transaction, so the same lines submitted twice (a double click,
+    two devices) are ordered once: the later transaction conflicts on the
+    lines, is retried and finds nothing pending. ``single`` describes the
+    order after its one line. Returns ``None`` when no line was pending.
+    """
+    outcome: Dict[str, Any] = {}
+
+    async def apply(session):
+        outcome.clear()
+        now = datetime.utcnow()
+        suggestions = await db.order_suggestions.find(
+            {**query, "status": SUGGESTION_PENDING}, session=session
+        ).sort(SUGGESTION_SORT).to_list(None)
+        if not suggestions:
+            return
+
+        orders = supplier_orders(suggestions, username, now)
+        if single:
+            orders[0]["description"] = f"Restock order for {suggestions[0]['name']}"
+            orders[0]["source_suggestion"] = str(suggestions[0]["_id"])
+        result = await db.orders.insert_many(orders, session=session)
+
+        order_ids = {
+            order["supplier"]: order_id
+            for order_id, order in zip(result.inserted_ids, orders)
+        }
+        processed = await db.order_suggestions.bulk_write([
+            UpdateOne(
+                {"_id": suggestion["_id"], "status": SUGGESTION_PENDING},
+                {"$set": {
+                    "status": SUGGESTION_PROCESSED,
+                    "order_id": order_ids[suggestion.get("supplier") or NO_SUPPLIER],
+                    "updated_at": now
+                }}
+            )
+            for suggestion in suggestions
+        ], ordered=False, session=session)
+        outcome.update({
+            "orders": orders,
+            "order_ids": result.inserted_ids,
+            "lines": len(suggestions),
+            "processed": processed.modified_count
+        })
+
+    async with await db.client.start_session() as session:
+        await session.with_transaction(apply)
+
+    if not outcome:
+        return None
+    adjust_pending_count(-outcome["processed"])
+    return outcome
+
+
+async def retire_legacy_suggestions(db) -> int:
+    """Close the old per-count documents that listed bare item ids"""
+    result = await db.order_suggestions.update_many(
+        {"items": {"$exists": True}, "status": SUGGESTION_PENDING},
+        {"$set": {"status": "superseded"}}
+    )
+    adjust_pending_count(-result.modified_count)
+    if result.modified_count:
+        logger.info(f"Superseded {result.modified_count} legacy order suggestions")
+    return result.modified_count
+
+
+async def suggestion_engine(db, interval: int = REFRESH_INTERVAL):
+    """Refresh the pending suggestions every ``interval`` seconds"""
+    while True:
+        try:
+            result = await refresh_suggestions(db)
+            logger.debug(f"Order suggestions refreshed: {result}")
+        except Exception as e:
+            logger.error(f"Order suggestion refresh failed: {str(e)}")
+        await asyncio.sleep(interval)
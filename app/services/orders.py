@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+import logging
+from .inventory_query import encode_cursor, decode_time_cursor
+
+logger = logging.getLogger(__name__)
+
+ORDER_PAGE_SIZE = 50
+
+NO_SUPPLIER = "SIN PROVEEDOR"
+
+ORDER_PENDING = "PENDING"
+ORDER_ORDERED = "ORDERED"
+ORDER_PARTIAL = "PARTIAL"
+ORDER_RECEIVED = "RECEIVED"
+ORDER_RECEIVED_SHORT = "RECEIVED_SHORT"
+
+# Orders whose goods have not (all) arrived yet
+OPEN_ORDER_STATUSES = [ORDER_PENDING, ORDER_ORDERED, ORDER_PARTIAL]
+
+# Weekly purchase orders: drafts are replaced by each run until sent, and
+# sending one opens the restock order its delivery is received against
+PO_DRAFT = "draft"
+PO_SENT = "sent"
+
+# Fields of a suggestion line copied onto an order line
+ORDER_LINE_FIELDS = ("name", "current_stock", "min_stock", "supplier", "unit")
+
+# Columns of the orders listing; line details are loaded with the order
+ORDER_ROW_PROJECTION = {
+    "client": 1,
+    "description": 1,
+    "amount": 1,
+    "status": 1,
+    "type": 1,
+    "supplier": 1,
+    "created_at": 1,
+    "created_by": 1,
+    "items.name": 1,
+    "items.supplier": 1,
+    "items.suggested_order": 1,
+    "items.unit": 1
+}
+
+
+def build_order_filters(
+    status: Optional[str] = None,
+    supplier: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Translate the query-string filters into a Mongo match document"""
+    query = {}
+    if status:
+        query["status"] = status
+    if supplier:
+        query["items.supplier"] = supplier
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    return query
+
+
+async def list_orders(db, filters: Dict[str, Any], limit: int = ORDER_PAGE_SIZE,
+                      before: Optional[str] = None) -> Dict[str, Any]:
+    """One page of orders, newest first.
+
+    Keyset paginated on (created_at, _id) so each page is an index range
+    scan; ``next_cursor`` points at the page of older orders, if any.
+    Raises InvalidCursor for a ``before`` that cannot be decoded.
+    """
+    query = dict(filters)
+    if before:
+        created_at, last_id = decode_time_cursor(before)
+        query["$and"] = [{"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}}
+        ]}]
+
+    docs = await db.orders.find(query, ORDER_ROW_PROJECTION).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        oldest = docs[limit - 1]
+        next_cursor = encode_cursor(oldest["created_at"].isoformat(), oldest["_id"])
+    return {"items": docs[:limit], "next_cursor": next_cursor}
+
+
+def ordered_quantity(line: Dict[str, Any]) -> float:
+    return float(line.get("quantity", line.get("suggested_order")) or 0)
+
+
+def order_line(suggestion: Dict[str, Any]) -> Dict[str, Any]:
+    """Order line for a pending suggestion"""
+    line = {
+        "item_id": str(suggestion["item_id"]),
+        **{f: suggestion.get(f) for f in ORDER_LINE_FIELDS},
+        "suggested_order": suggestion.get("quantity", 0)
+    }
+    line["supplier"] = line["supplier"] or NO_SUPPLIER
+    return line
+
+
+def supplier_orders(suggestions: List[Dict[str, Any]], username: str,
+                    created_at: datetime) -> List[Dict[str, Any]]:
+    """One restock order per supplier covering all of its suggestion lines"""
+    lines_by_supplier: Dict[str, List[Dict[str, Any]]] = {}
+    for suggestion in suggestions:
+        line = order_line(suggestion)
+        lines_by_supplier.setdefault(line["supplier"], []).append(line)
+
+    return [
+        {
+            "client": "INTERNAL",
+            "supplier": supplier,
+            "created_by": username,
+            "created_at": created_at,
+            "status": ORDER_PENDING,
+            "type": "restock",
+            "description": f"Restock order for {supplier} ({len(lines)} items)",
+            "items": lines,
+            "amount": 0
+        }
+        for supplier, lines in sorted(lines_by_supplier.items())
+    ]
@@ -0,0 +1,409 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import io
+import logging
+import tempfile
+import zipfile
+from .cash_export import run_in_pool
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from .order_suggestions import (
+    PRIORITY_OUT,
+    SUGGESTION_PENDING,
+    SUGGESTION_PROCESSED,
+    SUGGESTION_SORT,
+    adjust_pending_count
+)
+from .orders import NO_SUPPLIER, ORDER_ORDERED, PO_DRAFT, PO_SENT
+from .supplier_split import split_restock
+
+logger = logging.getLogger(__name__)
+
+
+class PurchaseOrderNotDraft(Exception):
+    """The purchase order does not exist or was already sent"""
+
+# Used for suppliers without an entry in the suppliers collection
+SUPPLIER_DEFAULTS = {
+    "order_weekday": 0,  # Monday
+    "delivery_weekdays": None,  # Any day
+    "min_lines": 1,
+    "min_units": 0,
+    "min_order_amount": 0,
+    "delivery_fee": 0
+}
+
+WEEKDAYS = ["LUNES", "MARTES", "MIÉRCOLES", "JUEVES", "VIERNES", "SÁBADO", "DOMINGO"]
+
+# Same columns as the PEDIDO weekly sheets
+SHEET_COLUMNS = ["INSUMOS", "STOCK ACTUAL", "PEDIR", "PRESENTACION", "PROVEEDOR"]
+
+
+def week_start(day: datetime) -> datetime:
+    """Monday 00:00 of the week containing ``day``"""
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=day.weekday())
+
+
+def safe_name(supplier: str) -> str:
+    """Supplier name usable as a file and worksheet name"""
+    return "".join(c if c.isalnum() else "_" for c in supplier)
+
+
+def supplier_config(suppliers: Dict[str, Dict[str, Any]], supplier: str) -> Dict[str, Any]:
+    return {**SUPPLIER_DEFAULTS, **suppliers.get(supplier, {})}
+
+
+def purchase_order_line(suggestion: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "item_id": suggestion["item_id"],
+        "suggestion_id": suggestion.get("_id"),
+        "name": suggestion.get("name"),
+        "current_stock": suggestion.get("current_stock", 0),
+        "unit": suggestion.get("unit"),
+        "presentation": suggestion.get("presentation"),
+        "quantity": suggestion.get("quantity", 0),
+        "unit_price": suggestion.get("unit_price"),
+        "amount": suggestion.get("amount", 0)
+    }
+
+
+def assign_suppliers(
+    suggestions: List[Dict[str, Any]],
+    offers: Dict[str, Dict[str, float]],
+    suppliers: Dict[str, Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """Move each restock line to the supplier the split solver picked.
+
+    Lines of items without a price list keep their own supplier.
+    """
+    lines = [
+        {
+            "item_id": str(suggestion["item_id"]),
+            "quantity": suggestion["quantity"],
+            "supplier": suggestion.get("supplier") or NO_SUPPLIER,
+            "urgent": suggestion.get("priority") == PRIORITY_OUT
+        }
+        for suggestion in suggestions
+    ]
+    names = {line["supplier"] for line in lines} | {
+        supplier for prices in offers.values() for supplier in prices
+    }
+    split = split_restock(lines, offers, {name: supplier_config(suppliers, name) for name in names})
+    return [
+        {**suggestion, "supplier": line["supplier"], "unit_price": line["unit_price"], "amount": line["amount"]}
+        for suggestion, line in zip(suggestions, split["lines"])
+    ]
+
+
+def plan_purchase_orders(
+    suggestions: List[Dict[str, Any]],
+    suppliers: Dict[str, Dict[str, Any]],
+    week: datetime
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Group restock lines into one purchase order per supplier for ``week``.
+
+    Each order is dated on the supplier's order weekday. Suppliers whose
+    lines fall below their minimum line count, units or amount are deferred
+    to a later week and returned separately.
+    """
+    lines_by_supplier: Dict[str, List[Dict[str, Any]]] = {}
+    for suggestion in suggestions:
+        if suggestion.get("quantity", 0) <= 0:
+            continue
+        supplier = suggestion.get("supplier") or NO_SUPPLIER
+        lines_by_supplier.setdefault(supplier, []).append(purchase_order_line(suggestion))
+
+    orders, deferred = [], []
+    for supplier, lines in sorted(lines_by_supplier.items()):
+        config = supplier_config(suppliers, supplier)
+        total_units = sum(line["quantity"] for line in lines)
+        total_amount = sum(line["amount"] or 0 for line in lines)
+        if (len(lines) < config["min_lines"] or total_units < config["min_units"]
+                or total_amount < config["min_order_amount"]):
+            deferred.append({
+                "supplier": supplier,
+                "lines": len(lines),
+                "total_units": total_units,
+                "total_amount": total_amount,
+                "min_lines": config["min_lines"],
+                "min_units": config["min_units"],
+                "min_order_amount": config["min_order_amount"]
+            })
+            continue
+
+        orders.append({
+            "week": week,
+            "supplier": supplier,
+            "order_date": week + timedelta(days=config["order_weekday"]),
+            "lines": sorted(lines, key=lambda line: line["name"] or ""),
+            "total_units": total_units,
+            "total_amount": total_amount,
+            "status": PO_DRAFT
+        })
+    return orders, deferred
+
+
+def restock_order(purchase_order: Dict[str, Any], username: str, now: datetime) -> Dict[str, Any]:
+    """Restock order (in ``orders``) that a sent purchase order's delivery is
+    received against"""
+    supplier = purchase_order["supplier"]
+    return {
+        "client": "INTERNAL",
+        "supplier": supplier,
+        "created_by": username,
+        "created_at": now,
+        "status": ORDER_ORDERED,
+        "type": "restock",
+        "description": f"Weekly order for {supplier} ({len(purchase_order['lines'])} items)",
+        "items": [
+            {
+                "item_id": str(line["item_id"]),
+                "name": line.get("name"),
+                "current_stock": line.get("current_stock"),
+                "supplier": supplier,
+                "unit": line.get("unit"),
+                "quantity": line["quantity"],
+                "unit_price": line.get("unit_price")
+            }
+            for line in purchase_order["lines"]
+        ],
+        "amount": purchase_order.get("total_amount", 0),
+        "purchase_order_id": purchase_order["_id"]
+    }
+
+
+def render_purchase_order_xlsx(order: Dict[str, Any]) -> bytes:
+    """Printable PEDIDO sheet for one supplier"""
+    import xlsxwriter
+
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output)
+    title_format = workbook.add_format({'bold': True, 'font_size': 14})
+    header_format = workbook.add_format({
+        'bold': True,
+        'italic': True,
+        'bg_color': '#A6A6A6',
+        'align': 'center',
+        'border': 1
+    })
+    cell_format = workbook.add_format({'border': 1})
+    order_format = workbook.add_format({'border': 1, 'bg_color': '#C0E6F5', 'align': 'center'})
+
+    sheet = workbook.add_worksheet(safe_name(order["supplier"])[:31])
+    order_date = order["order_date"]
+    sheet.write(0, 0, f"PEDIDO {order['supplier']}", title_format)
+    sheet.write(1, 0, f"{WEEKDAYS[order_date.weekday()]} {order_date:%d/%m/%Y}")
+
+    for col, header in enumerate(SHEET_COLUMNS):
+        sheet.write(3, col, header, header_format)
+    for row, line in enumerate(order["lines"], 4):
+        stock = f"{line['current_stock'] or 0:g} {line.get('unit') or ''}".strip()
+        sheet.write(row, 0, line["name"], cell_format)
+        sheet.write(row, 1, stock, cell_format)
+        sheet.write(row, 2, line["quantity"], order_format)
+        sheet.write(row, 3, line.get("presentation") or "", cell_format)
+        sheet.write(row, 4, order["supplier"], cell_format)
+
+    sheet.set_column('A:A', 40)
+    sheet.set_column('B:B', 18)
+    sheet.set_column('C:C', 10)
+    sheet.set_column('D:E', 24)
+
+    # One page wide, ready to print
+    sheet.set_landscape()
+    sheet.set_paper(9)  # A4
+    sheet.fit_to_pages(1, 0)
+    sheet.repeat_rows(3)
+
+    workbook.close()
+    return output.getvalue()
+
+
+def purchase_order_filename(order: Dict[str, Any]) -> str:
+    return f"pedido_{order['week']:%Y%m%d}_{safe_name(order['supplier'])}.xlsx"
+
+
+def write_zip(files: List[Tuple[str, bytes]]) -> str:
+    handle = tempfile.NamedTemporaryFile(prefix="pedidos_", suffix=".zip", delete=False)
+    with handle, zipfile.ZipFile(handle, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            archive.writestr(name, content)
+    return handle.name
+
+
+async def load_price_lists(db, item_ids: List[ObjectId], exclude: Optional[List[str]] = None,
+                           session=None) -> Dict[str, Dict[str, float]]:
+    """Unit price per supplier of each item, keyed by item id string"""
+    offers: Dict[str, Dict[str, float]] = {}
+    query = {"item_id": {"$in": item_ids}}
+    if exclude:
+        query["supplier"] = {"$nin": exclude}
+    async for price in db.supplier_prices.find(
+        query, {"item_id": 1, "supplier": 1, "unit_price": 1}, session=session
+    ):
+        offers.setdefault(str(price["item_id"]), {})[price["supplier"]] = float(price["unit_price"])
+    return offers
+
+
+async def open_suggestions(db, drafts: List[ObjectId], session=None) -> List[Dict[str, Any]]:
+    """Pending suggestion lines plus the ones taken by the week's drafts,
+    which a new run plans again"""
+    return await db.order_suggestions.find({"$or": [
+        {"status": SUGGESTION_PENDING},
+        {"status": SUGGESTION_PROCESSED, "purchase_order_id": {"$in": drafts}}
+    ]}, session=session).sort(SUGGESTION_SORT).to_list(None)
+
+
+async def week_drafts(db, week: datetime, session=None) -> List[ObjectId]:
+    return await db.purchase_orders.distinct("_id", {"week": week, "status": PO_DRAFT}, session=session)
+
+
+async def plan_weekly_orders(db, week: datetime, drafts: Optional[List[ObjectId]] = None, session=None):
+    """This week's purchase orders, lines split across suppliers by price"""
+    if drafts is None:
+        drafts = await week_drafts(db, week, session)
+    # Suppliers whose order already left this week are not ordered again
+    sent = await db.purchase_orders.distinct(
+        "supplier", {"week": week, "status": {"$ne": PO_DRAFT}}, session=session
+    )
+    suggestions = [
+        suggestion for suggestion in await open_suggestions(db, drafts, session)
+        if (suggestion.get("supplier") or NO_SUPPLIER) not in sent and suggestion.get("quantity", 0) > 0
+    ]
+    suppliers = {
+        supplier["name"]: supplier
+        async for supplier in db.suppliers.find({}, {"_id": 0}, session=session)
+    }
+    offers = await load_price_lists(db, [suggestion["item_id"] for suggestion in suggestions], sent, session)
+    return plan_purchase_orders(assign_suppliers(suggestions, offers, suppliers), suppliers, week)
+
+
+async def generate_weekly_orders(db, week: datetime, username: str) -> Dict[str, Any]:
+    """Build and store this week's purchase orders and render their sheets.
+
+    Draft orders of the same week are replaced, so the run can be repeated
+    after adjusting stock; orders already sent are kept. The suggestion lines
+    an order takes are marked processed with its id, and lines of replaced
+    drafts that no order takes any more go back to pending. Planning and
+    all the writes share a transaction, so a draft sent meanwhile either
+    makes the run retry (and skip its supplier) or finds the draft replaced.
+    Raises DuplicateKeyError when an order of the week was stored by
+    someone else first. Returns the orders, the deferred suppliers and the
+    path of a zip with one printable sheet per supplier.
+    """
+    outcome: Dict[str, Any] = {}
+
+    async def apply(session):
+        outcome.clear()
+        now = datetime.utcnow()
+        drafts = await week_drafts(db, week, session)
+        orders, deferred = await plan_weekly_orders(db, week, drafts, session)
+
+        await db.purchase_orders.delete_many({"_id": {"$in": drafts}, "status": PO_DRAFT}, session=session)
+        for order in orders:
+            order["created_at"] = now
+            order["created_by"] = username
+        if orders:
+            # insert_many sets each order's _id in place
+            await db.purchase_orders.insert_many(orders, session=session)
+        delta = await consume_suggestions(db, orders, drafts, now, session)
+        outcome.update({"orders": orders, "deferred": deferred, "pending_delta": delta})
+
+    try:
+        async with await db.client.start_session() as session:
+            await session.with_transaction(apply)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+        raise DuplicateKeyError(f"A purchase order of week {week:%Y-%m-%d} already exists") from e
+
+    adjust_pending_count(outcome.pop("pending_delta"))
+    orders, deferred = outcome["orders"], outcome["deferred"]
+    logger.info(f"Generated {len(orders)} purchase orders for week {week:%Y-%m-%d}, {len(deferred)} deferred")
+    return {"orders": orders, "deferred": deferred, "path": await render_orders_zip(orders)}
+
+
+async def render_orders_zip(orders: List[Dict[str, Any]]) -> str:
+    """Render each order's sheet concurrently in the worker pool and zip them"""
+    sheets = await asyncio.gather(*(run_in_pool(render_purchase_order_xlsx, order) for order in orders))
+    return await run_in_pool(write_zip, [
+        (purchase_order_filename(order), content) for order, content in zip(orders, sheets)
+    ])
+
+
+async def consume_suggestions(db, orders: List[Dict[str, Any]], drafts: List[ObjectId],
+                              now: datetime, session=None) -> int:
+    """Point the suggestion lines at the orders that took them.
+
+    Returns the change in pending lines, applied by the caller once the
+    writes are committed.
+    """
+    taken = {
+        line["suggestion_id"]: order["_id"]
+        for order in orders for line in order["lines"] if line.get("suggestion_id")
+    }
+    newly_processed = 0
+    if taken:
+        newly_processed = await db.order_suggestions.count_documents(
+            {"_id": {"$in": list(taken)}, "status": SUGGESTION_PENDING}, session=session
+        )
+        await db.order_suggestions.bulk_write([
+            UpdateOne(
+                {"_id": suggestion_id, "status": {"$in": [SUGGESTION_PENDING, SUGGESTION_PROCESSED]}},
+                {"$set": {
+                    "status": SUGGESTION_PROCESSED,
+                    "purchase_order_id": order_id,
+                    "updated_at": now
+                }}
+            )
+            for suggestion_id, order_id in taken.items()
+        ], ordered=False, session=session)
+
+    released = 0
+    if drafts:
+        result = await db.order_suggestions.update_many(
+            {"status": SUGGESTION_PROCESSED, "purchase_order_id": {"$in": drafts}},
+            {"$set": {"status": SUGGESTION_PENDING, "updated_at": now}, "$unset": {"purchase_order_id": ""}},
+            session=session
+        )
+        released = result.modified_count
+    return released - newly_processed
+
+
+async def send_purchase_order(db, order_id: ObjectId, username: str) -> Dict[str, Any]:
+    """Mark a draft purchase order sent and open its restock order.
+
+    Both writes share a transaction. From then on the order is kept by later
+    runs of the week, its supplier is not ordered again that week and the
+    delivery is received against the restock order.
+    """
+    now = datetime.utcnow()
+    outcome: Dict[str, Any] = {}
+
+    async def apply(session):
+        purchase_order = await db.purchase_orders.find_one_and_update(
+            {"_id": order_id, "status": PO_DRAFT},
+            {"$set": {"status": PO_SENT, "sent_at": now, "sent_by": username}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not purchase_order:
+            raise PurchaseOrderNotDraft(str(order_id))
+
+        order = restock_order(purchase_order, username, now)
+        result = await db.orders.insert_one(order, session=session)
+        await db.purchase_orders.update_one(
+            {"_id": order_id}, {"$set": {"order_id": result.inserted_id}}, session=session
+        )
+        purchase_order["order_id"] = result.inserted_id
+        outcome.clear()
+        outcome.update({"purchase_order": purchase_order, "order_id": result.inserted_id})
+
+    async with await db.client.start_session() as session:
+        await session.with_transaction(apply)
+
+    logger.info(f"Sent purchase order {order_id} to {outcome['purchase_order']['supplier']}")
+    return outcome
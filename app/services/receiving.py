@@ -0,0 +1,217 @@
+from datetime import datetime
+from typing import Dict, Any
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+import logging
+from .inventory import STOCK_STATUS_EXPR
+from .order_suggestions import sync_item_suggestions
+from .orders import (
+    OPEN_ORDER_STATUSES,
+    ORDER_PARTIAL,
+    ORDER_RECEIVED,
+    ORDER_RECEIVED_SHORT,
+    ordered_quantity
+)
+from .supplier_stats import (
+    arrival_records,
+    record_supplier_stats,
+    supplier_observations,
+    update_supplier_stats
+)
+from ..utils.versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+# Orders that can still take deliveries
+RECEIVABLE = OPEN_ORDER_STATUSES
+
+
+class OrderNotReceivable(Exception):
+    """The order does not exist or was already closed out"""
+
+
+def plan_receipt(order: Dict[str, Any], received: Dict[str, float], close: bool = True) -> Dict[str, Any]:
+    """Apply one delivery to an order's lines.
+
+    ``received`` maps item ids to the quantity that arrived now; lines not
+    listed received nothing. When an item is on several lines the quantity
+    fills them in order, the last one taking any excess, so it is counted
+    once. Returns the updated lines, the stock increments per item and the
+    new order status: RECEIVED when every line is complete, otherwise
+    RECEIVED_SHORT when ``close`` (the rest will not come) or PARTIAL (more
+    deliveries expected).
+    """
+    items = order.get("items") or []
+    remaining = {item_id: max(float(quantity or 0), 0.0) for item_id, quantity in received.items()}
+    last_line = {line.get("item_id"): i for i, line in enumerate(items)}
+
+    lines, increments = [], {}
+    complete = True
+    for i, line in enumerate(items):
+        line = dict(line)
+        item_id = line.get("item_id")
+        quantity = remaining.get(item_id, 0.0) if item_id else 0.0
+        if quantity and i != last_line[item_id]:
+            outstanding = max(ordered_quantity(line) - float(line.get("received") or 0), 0.0)
+            quantity = min(quantity, outstanding)
+        if quantity:
+            remaining[item_id] -= quantity
+            increments[item_id] = increments.get(item_id, 0.0) + quantity
+        line["received"] = float(line.get("received") or 0) + quantity
+        line["short"] = max(ordered_quantity(line) - line["received"], 0.0)
+        complete = complete and line["short"] == 0
+        lines.append(line)
+
+    if complete:
+        status = ORDER_RECEIVED
+    else:
+        status = ORDER_RECEIVED_SHORT if close else ORDER_PARTIAL
+    return {"lines": lines, "increments": increments, "status": status}
+
+
+async def receive_order(db, order_id: ObjectId, received: Dict[str, float],
+                        user: Dict[str, Any], notes: str = "", close: bool = True) -> Dict[str, Any]:
+    """Record a delivery: stock, movements and order status in one transaction.
+
+    All stock increments go out in one bulk_write and all movements in one
+    insert_many, inside a transaction together with the order update, the
+    arrival rows and the suppliers' rolling statistics, so a delivery is
+    either fully applied or not at all.
+    """
+    now = datetime.utcnow()
+    outcome: Dict[str, Any] = {}
+
+    async def apply(session):
+        order = await db.orders.find_one(
+            {"_id": order_id, "status": {"$in": RECEIVABLE}}, session=session
+        )
+        if not order:
+            raise OrderNotReceivable(str(order_id))
+
+        plan = plan_receipt(order, received, close)
+        item_ids = [ObjectId(item_id) for item_id in plan["increments"]]
+        stored = {
+            doc["_id"]: doc
+            async for doc in db.inventory.find(
+                {"_id": {"$in": item_ids}}, {"name": 1, "current_stock": 1}, session=session
+            )
+        }
+
+        stock_updates, movements = [], []
+        for item_id in item_ids:
+            doc = stored.get(item_id)
+            if not doc:
+                logger.warning(f"Skipping received item {item_id}: not in inventory")
+                continue
+            quantity = plan["increments"][str(item_id)]
+            previous_stock = float(doc.get("current_stock") or 0)
+            stock_updates.append(UpdateOne(
+                {"_id": item_id},
+                [
+                    {"$set": {"current_stock": {"$add": [{"$ifNull": ["$current_stock", 0]}, quantity]}}},
+                    {"$set": {
+                        "stock_status": STOCK_STATUS_EXPR,
+                        "last_updated": now,
+                        "last_updated_by": user["username"]
+                    }}
+                ]
+            ))
+            movements.append({
+                "item_id": item_id,
+                "item_name": doc.get("name"),
+                "user_id": ObjectId(user["_id"]),
+                "username": user["username"],
+                "quantity": quantity,
+                "previous_stock": previous_stock,
+                "new_stock": previous_stock + quantity,
+                "timestamp": now,
+                "notes": f"Recepción de pedido {order_id}" + (f": {notes}" if notes else ""),
+                "movement_type": "add",
+                "order_id": order_id
+            })
+
+        if stock_updates:
+            await db.inventory.bulk_write(stock_updates, ordered=False, session=session)
+            await db.stock_movements.insert_many(movements, ordered=False, session=session)
+
+        arrivals = arrival_records(order, plan["lines"], plan["increments"], now, user["username"])
+        if arrivals:
+            await db.arrivals.insert_many(arrivals, ordered=False, session=session)
+
+        observations = supplier_observations(
+            order, plan["lines"], plan["increments"], now, plan["status"] != ORDER_PARTIAL
+        )
+        stats = []
+        if observations:
+            stored_stats = {
+                doc["_id"]: doc
+                async for doc in db.supplier_stats.find(
+                    {"_id": {"$in": list(observations)}}, session=session
+                )
+            }
+            for supplier, observation in observations.items():
+                doc = update_supplier_stats(stored_stats.get(supplier), **observation)
+                stats.append({**doc, "_id": supplier, "updated_at": now})
+            await db.supplier_stats.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in stats],
+                ordered=False, session=session
+            )
+
+        receipt = {
+            "received_at": now,
+            "received_by": user["username"],
+            "lines": [{"item_id": k, "received": v} for k, v in plan["increments"].items()],
+            "notes": notes
+        }
+        update = {
+            "$set": {"items": plan["lines"], "status": plan["status"], "updated_at": now},
+            "$push": {"receipts": receipt}
+        }
+        if plan["status"] != ORDER_PARTIAL:
+            update["$set"]["closed_at"] = now
+        await db.orders.update_one(
+            {"_id": order_id, "status": order["status"]}, update, session=session
+        )
+
+        outcome.clear()
+        outcome.update({
+            "order": order,
+            "plan": plan,
+            "receipt": receipt,
+            "movements": len(movements),
+            "arrivals": len(arrivals),
+            "supplier_stats": stats,
+            "item_ids": list(stored)
+        })
+
+    async with await db.client.start_session() as session:
+        # Retried as a whole on transient errors such as write conflicts
+        await session.with_transaction(apply)
+
+    bump_version("inventory")
+    record_supplier_stats(outcome["supplier_stats"])
+    if outcome["item_ids"]:
+        await sync_item_suggestions(db, outcome["item_ids"], source="receiving")
+    logger.info(
+        f"Received order {order_id}: {outcome['movements']} items, status {outcome['plan']['status']}"
+    )
+    return outcome
+
+
+def serialize_receipt(outcome: Dict[str, Any]) -> Dict[str, Any]:
+    plan = outcome["plan"]
+    return {
+        "success": True,
+        "status": plan["status"],
+        "movements": outcome["movements"],
+        "lines": [
+            {
+                "item_id": line.get("item_id"),
+                "name": line.get("name"),
+                "ordered": ordered_quantity(line),
+                "received": line["received"],
+                "short": line["short"]
+            }
+            for line in plan["lines"]
+        ]
+    }
@@ -0,0 +1,214 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+from bson import ObjectId
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Movements that overwrite the stock instead of adding to it
+ABSOLUTE_MOVEMENTS = ["count", "set"]
+
+CHECKPOINT_INTERVAL = timedelta(days=7)
+
+MOVEMENT_PROJECTION = {
+    "item_id": 1,
+    "quantity": 1,
+    "previous_stock": 1,
+    "new_stock": 1,
+    "movement_type": 1,
+    "_id": 0
+}
+
+
+async def load_movements(db, start: Optional[datetime], end: datetime) -> Dict[str, np.ndarray]:
+    """Load the movements in (start, end] as columnar arrays.
+
+    ``opening`` holds, per item, the ``previous_stock`` of its first movement
+    in the range (NaN when not recorded): the level it had before it.
+    """
+    query = {"timestamp": {"$lte": end}}
+    if start:
+        query["timestamp"]["$gt"] = start
+
+    item_ids: List[ObjectId] = []
+    codes = {}
+    item_codes, deltas, absolute, new_stock, opening = [], [], [], [], []
+
+    cursor = db.stock_movements.find(query, MOVEMENT_PROJECTION).sort(
+        [("timestamp", 1), ("_id", 1)]
+    ).batch_size(5000)
+    async for movement in cursor:
+        item_id = movement["item_id"]
+        code = codes.get(item_id)
+        if code is None:
+            code = codes[item_id] = len(item_ids)
+            item_ids.append(item_id)
+            previous = movement.get("previous_stock")
+            opening.append(np.nan if previous is None else float(previous))
+        item_codes.append(code)
+        deltas.append(float(movement.get("quantity") or 0))
+        absolute.append(movement.get("movement_type") in ABSOLUTE_MOVEMENTS)
+        new_stock.append(float(movement.get("new_stock") or 0))
+
+    return {
+        "item_ids": item_ids,
+        "codes": np.array(item_codes, dtype=np.int64),
+        "deltas": np.array(deltas, dtype=np.float64),
+        "absolute": np.array(absolute, dtype=bool),
+        "new_stock": np.array(new_stock, dtype=np.float64),
+        "opening": np.array(opening, dtype=np.float64)
+    }
+
+
+def replay(base: np.ndarray, codes: np.ndarray, deltas: np.ndarray,
+           absolute: np.ndarray, new_stock: np.ndarray) -> np.ndarray:
+    """Apply movements on top of per-item base stock levels.
+
+    ``codes`` index into ``base`` and the movements must already be in time
+    order. Deltas are summed with one cumulative sum over all items; an
+    absolute movement (count or manual set) resets its item to ``new_stock``
+    and only the deltas after the last reset count.
+    """
+    result = base.copy()
+    if len(codes) == 0:
+        return result
+
+    # Group by item while keeping time order inside each group
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    deltas = deltas[order]
+    absolute = absolute[order]
+    new_stock = new_stock[order]
+
+    running = np.cumsum(deltas)
+    ends = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True])
+    starts = np.r_[0, ends[:-1] + 1]
+
+    positions = np.arange(len(codes))
+    last_reset = np.maximum.accumulate(np.where(absolute, positions, -1))[ends]
+    has_reset = last_reset >= starts
+
+    before_start = np.where(starts > 0, running[starts - 1], 0.0)
+    from_base = base[codes[ends]] + running[ends] - before_start
+    from_reset = new_stock[last_reset] + running[ends] - running[last_reset]
+
+    result[codes[ends]] = np.where(has_reset, from_reset, from_base)
+    return result
+
+
+def opening_levels(item_ids: List[ObjectId], stocks: Dict[str, float],
+                   opening: np.ndarray) -> np.ndarray:
+    """Base level per item: the checkpoint's, else the level before its first
+    movement, else NaN (unknown until a count or manual set grounds it)"""
+    base = np.full(len(item_ids), np.nan, dtype=np.float64)
+    for code, item_id in enumerate(item_ids):
+        level = stocks.get(str(item_id))
+        if level is None and code < len(opening):
+            level = opening[code]
+        if level is not None:
+            base[code] = level
+    return base
+
+
+def created_after(item: Dict[str, Any], at: datetime) -> bool:
+    """Whether an inventory item did not exist yet at ``at``"""
+    created = item.get("created_at") or item["_id"].generation_time.replace(tzinfo=None)
+    if at.tzinfo:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created > at
+
+
+async def nearest_checkpoint(db, at: datetime) -> Optional[Dict[str, Any]]:
+    return await db.stock_checkpoints.find_one(
+        {"as_of": {"$lte": at}},
+        sort=[("as_of", -1)]
+    )
+
+
+async def stock_as_of(db, at: datetime) -> Dict[str, Any]:
+    """Reconstruct the stock of every item at a point in time.
+
+    Starts from the latest checkpoint at or before ``at`` and replays only
+    the movements recorded after it. Items missing from the checkpoint start
+    from the stock recorded before their first movement (the stock they were
+    created with); when that was not recorded either, their level is
+    ``None`` until a count or manual set.
+    """
+    checkpoint = await nearest_checkpoint(db, at)
+    start = checkpoint["as_of"] if checkpoint else None
+    movements = await load_movements(db, start, at)
+
+    item_ids = movements["item_ids"]
+    known = {item_id: code for code, item_id in enumerate(item_ids)}
+    stocks = dict(checkpoint["stocks"]) if checkpoint else {}
+
+    # Items only present in the checkpoint keep their stored level
+    for key in stocks:
+        item_id = ObjectId(key)
+        if item_id not in known:
+            known[item_id] = len(item_ids)
+            item_ids.append(item_id)
+
+    base = opening_levels(item_ids, stocks, movements["opening"])
+    levels = replay(
+        base,
+        movements["codes"],
+        movements["deltas"],
+        movements["absolute"],
+        movements["new_stock"]
+    )
+
+    return {
+        "as_of": at,
+        "checkpoint": start,
+        "movements_replayed": int(len(movements["codes"])),
+        "stocks": {
+            str(item_id): None if np.isnan(level) else float(level)
+            for item_id, level in zip(item_ids, levels)
+        }
+    }
+
+
+async def build_checkpoints(db, until: Optional[datetime] = None,
+                            interval: timedelta = CHECKPOINT_INTERVAL) -> int:
+    """Add checkpoints every ``interval`` from the last one up to ``until``.
+
+    Each checkpoint is built from the previous one, so catching up only
+    replays the movements of the missing intervals. Returns how many
+    checkpoints were created.
+    """
+    until = until or datetime.utcnow()
+    last = await db.stock_checkpoints.find_one(sort=[("as_of", -1)])
+
+    if last:
+        next_at = last["as_of"] + interval
+    else:
+        first = await db.stock_movements.find_one(
+            {}, {"timestamp": 1}, sort=[("timestamp", 1)]
+        )
+        if not first:
+            return 0
+        day = first["timestamp"].replace(hour=0, minute=0, second=0, microsecond=0)
+        next_at = day + interval
+
+    created = 0
+    while next_at <= until:
+        state = await stock_as_of(db, next_at)
+        # Unknown levels are left out so later movements can still seed them
+        stocks = {key: level for key, level in state["stocks"].items() if level is not None}
+        await db.stock_checkpoints.update_one(
+            {"as_of": next_at},
+            {"$set": {
+                "stocks": stocks,
+                "movements_replayed": state["movements_replayed"],
+                "created_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+        created += 1
+        next_at += interval
+
+    if created:
+        logger.info(f"Built {created} stock checkpoints up to {next_at - interval}")
+    return created
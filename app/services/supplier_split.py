@@ -0,0 +1,201 @@
+from typing import Dict, Any, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Out-of-stock lines only go to suppliers delivering within this many days
+URGENT_DELIVERY_DAYS = 2
+
+# Cost of each unit of minimum-order shortfall; any plan meeting the
+# minimums beats one that does not
+SHORTFALL_PENALTY = 1e6
+
+# Local search stops after this many passes without reaching a local optimum
+MAX_PASSES = 20
+
+EPSILON = 1e-9
+
+
+def delivery_days(config: Dict[str, Any]) -> int:
+    """Days from the supplier's order weekday to its first delivery (1-7)"""
+    weekdays = config.get("delivery_weekdays") or range(7)
+    return min((day - config["order_weekday"] - 1) % 7 + 1 for day in weekdays)
+
+
+def shortfall(config: Dict[str, Any], amount: float, lines: int, units: float) -> float:
+    """How far an order falls below the supplier's minimums, each as a fraction"""
+    if not lines:
+        return 0.0
+    missing = 0.0
+    if amount < config["min_order_amount"]:
+        missing += (config["min_order_amount"] - amount) / config["min_order_amount"]
+    if lines < config["min_lines"]:
+        missing += (config["min_lines"] - lines) / config["min_lines"]
+    if units < config["min_units"]:
+        missing += (config["min_units"] - units) / config["min_units"]
+    return missing
+
+
+class SupplierSplit:
+    """Split restock lines across the suppliers that sell each item.
+
+    Minimizes what is paid for the lines plus each used supplier's delivery
+    fee, with every used supplier's order meeting its minimums and urgent
+    lines restricted to suppliers that deliver soon enough. Starts from the
+    cheapest offer per line and improves it by local search: moving single
+    lines and emptying whole suppliers into the others, until no move helps.
+    """
+
+    def __init__(self, lines: List[Dict[str, Any]], offers: Dict[str, Dict[str, float]],
+                 configs: Dict[str, Dict[str, Any]]):
+        self.lines = lines
+        self.configs = configs
+        self.prices: List[Dict[str, float]] = [self.line_prices(line, offers) for line in lines]
+        self.costs = [
+            {supplier: price * line["quantity"] for supplier, price in prices.items()}
+            for line, prices in zip(lines, self.prices)
+        ]
+        self.assignment: List[str] = []
+        self.totals: Dict[str, List[float]] = {supplier: [0.0, 0, 0.0] for supplier in configs}
+
+    def line_prices(self, line: Dict[str, Any], offers: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+        """Unit price per eligible supplier; items without a price list stay
+        with their own supplier at an unknown (zero) price"""
+        prices = offers.get(line["item_id"]) or {line["supplier"]: 0.0}
+        if line.get("urgent"):
+            fast = {
+                supplier: price for supplier, price in prices.items()
+                if delivery_days(self.configs[supplier]) <= URGENT_DELIVERY_DAYS
+            }
+            # Nobody delivers in time: the cheapest supplier will have to do
+            prices = fast or prices
+        return prices
+
+    def supplier_cost(self, supplier: str, amount: float, lines: int, units: float) -> float:
+        if not lines:
+            return 0.0
+        config = self.configs[supplier]
+        return config["delivery_fee"] + SHORTFALL_PENALTY * shortfall(config, amount, lines, units)
+
+    def _change(self, supplier: str, i: int, sign: int):
+        totals = self.totals[supplier]
+        totals[0] += sign * self.costs[i][supplier]
+        totals[1] += sign
+        totals[2] += sign * self.lines[i]["quantity"]
+
+    def move_delta(self, i: int, target: str) -> float:
+        source = self.assignment[i]
+        line_cost, quantity = self.costs[i], self.lines[i]["quantity"]
+        amount, count, units = self.totals[source]
+        delta = (
+            self.supplier_cost(source, amount - line_cost[source], count - 1, units - quantity)
+            - self.supplier_cost(source, amount, count, units)
+        )
+        amount, count, units = self.totals[target]
+        delta += (
+            self.supplier_cost(target, amount + line_cost[target], count + 1, units + quantity)
+            - self.supplier_cost(target, amount, count, units)
+        )
+        return delta + line_cost[target] - line_cost[source]
+
+    def move(self, i: int, target: str):
+        self._change(self.assignment[i], i, -1)
+        self.assignment[i] = target
+        self._change(target, i, 1)
+
+    def objective(self) -> float:
+        return sum(costs[supplier] for costs, supplier in zip(self.costs, self.assignment)) + sum(
+            self.supplier_cost(supplier, *totals) for supplier, totals in self.totals.items()
+        )
+
+    def greedy(self):
+        """Each line at its cheapest offer, its own supplier winning ties"""
+        self.assignment = [
+            min(costs, key=lambda s, line=line: (costs[s], s != line["supplier"], s))
+            for line, costs in zip(self.lines, self.costs)
+        ]
+        for i, supplier in enumerate(self.assignment):
+            self._change(supplier, i, 1)
+
+    def relocate_pass(self) -> bool:
+        improved = False
+        for i, costs in enumerate(self.costs):
+            if len(costs) < 2:
+                continue
+            best, best_delta = None, -EPSILON
+            for supplier in costs:
+                if supplier != self.assignment[i]:
+                    delta = self.move_delta(i, supplier)
+                    if delta < best_delta:
+                        best, best_delta = supplier, delta
+            if best is not None:
+                self.move(i, best)
+                improved = True
+        return improved
+
+    def close_pass(self) -> bool:
+        """Try emptying each used supplier into the cheapest alternatives.
+
+        Single moves cannot do this when every step but the last leaves the
+        supplier below its minimum or still paying its delivery fee.
+        """
+        improved = False
+        for supplier in sorted(self.totals, key=lambda s: self.totals[s][1]):
+            members = [i for i, s in enumerate(self.assignment) if s == supplier]
+            if not members or any(len(self.costs[i]) < 2 for i in members):
+                continue
+            before = self.objective()
+            for i in members:
+                self.move(i, min(
+                    (s for s in self.costs[i] if s != supplier),
+                    key=lambda s, i=i: self.move_delta(i, s)
+                ))
+            if self.objective() < before - EPSILON:
+                improved = True
+            else:
+                for i in members:
+                    self.move(i, supplier)
+        return improved
+
+    def solve(self) -> "SupplierSplit":
+        self.greedy()
+        for _ in range(MAX_PASSES):
+            moved = self.relocate_pass()
+            closed = self.close_pass()
+            if not moved and not closed:
+                break
+        return self
+
+    def result(self) -> Dict[str, Any]:
+        short = {
+            supplier for supplier, totals in self.totals.items()
+            if shortfall(self.configs[supplier], *totals) > 0
+        }
+        return {
+            "lines": [
+                {
+                    **line,
+                    "supplier": supplier,
+                    "unit_price": self.prices[i][supplier],
+                    "amount": self.costs[i][supplier]
+                }
+                for i, (line, supplier) in enumerate(zip(self.lines, self.assignment))
+            ],
+            "cost": sum(costs[s] for costs, s in zip(self.costs, self.assignment)) + sum(
+                self.configs[s]["delivery_fee"] for s, totals in self.totals.items() if totals[1]
+            ),
+            "below_minimum": sorted(short)
+        }
+
+
+def split_restock(lines: List[Dict[str, Any]], offers: Dict[str, Dict[str, float]],
+                  configs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Assign each restock line to a supplier.
+
+    ``lines`` carry item_id, quantity, supplier (the item's own) and urgent;
+    ``offers`` maps item ids to unit prices per supplier and ``configs`` holds
+    every supplier's minimums, delivery fee and delivery weekdays.
+    """
+    split = SupplierSplit(lines, offers, configs).solve()
+    logger.debug(f"Split {len(lines)} restock lines at cost {split.objective():.2f}")
+    return split.result()
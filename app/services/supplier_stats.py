@@ -0,0 +1,170 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import logging
+import math
+from .orders import NO_SUPPLIER, ordered_quantity
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest observation in the rolling statistics
+STATS_ALPHA = 0.2
+
+# Observations needed before a supplier's statistics replace the defaults
+MIN_OBSERVATIONS = 3
+
+# min_stock is meant to cover one order cycle (the weekly order) of usage
+ORDER_CYCLE_DAYS = 7
+
+# ~95% one-sided service level against lead time variability
+LEAD_TIME_Z = 1.65
+
+# Never plan for less than half of an order arriving
+MIN_FILL_RATE = 0.5
+
+
+def ewma_update(mean: float, var: float, count: int, value: float):
+    """Exponentially weighted mean and variance after one more observation"""
+    if count == 0:
+        return value, 0.0
+    diff = value - mean
+    increment = STATS_ALPHA * diff
+    return mean + increment, (1 - STATS_ALPHA) * (var + diff * increment)
+
+
+def update_supplier_stats(stats: Optional[Dict[str, Any]], lead_time: Optional[float] = None,
+                          fill_rate: Optional[float] = None) -> Dict[str, Any]:
+    """Fold one delivery's lead time and/or one closed order's fill rate in"""
+    stats = dict(stats or {})
+    if lead_time is not None:
+        count = stats.get("deliveries", 0)
+        stats["lead_time_mean"], stats["lead_time_var"] = ewma_update(
+            stats.get("lead_time_mean", 0.0), stats.get("lead_time_var", 0.0), count, lead_time
+        )
+        stats["deliveries"] = count + 1
+    if fill_rate is not None:
+        count = stats.get("orders_closed", 0)
+        stats["fill_rate"], stats["fill_rate_var"] = ewma_update(
+            stats.get("fill_rate", 0.0), stats.get("fill_rate_var", 0.0), count, fill_rate
+        )
+        stats["orders_closed"] = count + 1
+    return stats
+
+
+def expected_fill_rate(stats: Optional[Dict[str, Any]]) -> float:
+    if not stats or stats.get("orders_closed", 0) < MIN_OBSERVATIONS:
+        return 1.0
+    return min(max(stats["fill_rate"], MIN_FILL_RATE), 1.0)
+
+
+def reorder_point(min_stock: float, stats: Optional[Dict[str, Any]]) -> float:
+    """Stock that covers usage until a new order from this supplier arrives.
+
+    Usage is taken as min_stock per order cycle and the cover as the mean
+    lead time plus a safety margin for its spread, so fast, steady suppliers
+    get a lower point than min_stock and slow or erratic ones a higher one.
+    Without enough deliveries the point stays at min_stock.
+    """
+    if not stats or stats.get("deliveries", 0) < MIN_OBSERVATIONS:
+        return min_stock
+    cover = stats["lead_time_mean"] + LEAD_TIME_Z * math.sqrt(stats["lead_time_var"])
+    return min_stock / ORDER_CYCLE_DAYS * cover
+
+
+def restock_quantity(current_stock: float, min_stock: float, max_stock: float,
+                     stats: Optional[Dict[str, Any]]) -> float:
+    """Units to order so that, after the expected shortfall, stock reaches
+    the reorder point plus the item's usual order band (max_stock without
+    statistics)"""
+    target = max_stock - min_stock + reorder_point(min_stock, stats)
+    gap = max(target - current_stock, 0)
+    fill_rate = expected_fill_rate(stats)
+    return gap if fill_rate == 1.0 else math.ceil(gap / fill_rate)
+
+
+def line_supplier(order: Dict[str, Any], line: Dict[str, Any]) -> str:
+    return line.get("supplier") or order.get("supplier") or NO_SUPPLIER
+
+
+def lead_time_days(order: Dict[str, Any], received_at: datetime) -> Optional[float]:
+    if not order.get("created_at"):
+        return None
+    return (received_at - order["created_at"]).total_seconds() / 86400
+
+
+def arrival_records(order: Dict[str, Any], lines: List[Dict[str, Any]],
+                    increments: Dict[str, float], received_at: datetime,
+                    received_by: str) -> List[Dict[str, Any]]:
+    """CONTROL DE LLEGADA rows for the items that arrived in one delivery,
+    one per item even when it is on several lines"""
+    lead_time = lead_time_days(order, received_at)
+    ordered: Dict[str, float] = {}
+    for line in lines:
+        if increments.get(line.get("item_id")):
+            ordered[line["item_id"]] = ordered.get(line["item_id"], 0.0) + ordered_quantity(line)
+
+    records = []
+    for line in lines:
+        item_id = line.get("item_id")
+        if item_id not in ordered:
+            continue
+        records.append({
+            "product": line.get("name"),
+            "quantity": increments[item_id],
+            "arrival_date": received_at,
+            "received_by": received_by,
+            "item_id": item_id,
+            "supplier": line_supplier(order, line),
+            "order_id": order["_id"],
+            "ordered": ordered.pop(item_id),
+            "lead_time_days": lead_time
+        })
+    return records
+
+
+def supplier_observations(order: Dict[str, Any], lines: List[Dict[str, Any]],
+                          increments: Dict[str, float], received_at: datetime,
+                          closed: bool) -> Dict[str, Dict[str, Optional[float]]]:
+    """Lead time and fill rate observed per supplier in one delivery.
+
+    Lead time counts from the order to the supplier's first arrival on it;
+    fill rate (received over ordered) is only known once the order closes.
+    """
+    previous = {line.get("item_id"): float(line.get("received") or 0) for line in order.get("items") or []}
+    by_supplier: Dict[str, List[Dict[str, Any]]] = {}
+    for line in lines:
+        by_supplier.setdefault(line_supplier(order, line), []).append(line)
+
+    observations = {}
+    for supplier, supplier_lines in by_supplier.items():
+        first_arrival = (
+            any(increments.get(line.get("item_id")) for line in supplier_lines)
+            and not any(previous.get(line.get("item_id")) for line in supplier_lines)
+        )
+        ordered = sum(ordered_quantity(line) for line in supplier_lines)
+        observation = {
+            "lead_time": lead_time_days(order, received_at) if first_arrival else None,
+            "fill_rate": min(sum(line["received"] for line in supplier_lines) / ordered, 1.0)
+            if closed and ordered else None
+        }
+        if observation["lead_time"] is not None or observation["fill_rate"] is not None:
+            observations[supplier] = observation
+    return observations
+
+
+# Per-supplier statistics, loaded once and then replaced by receiving as it
+# writes them. Lives in the application process like the ETag counters.
+_stats: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+async def load_supplier_stats(db) -> Dict[str, Dict[str, Any]]:
+    global _stats
+    if _stats is None:
+        _stats = {doc["_id"]: doc async for doc in db.supplier_stats.find()}
+    return _stats
+
+
+def record_supplier_stats(docs: List[Dict[str, Any]]):
+    """Keep the cached statistics in step with a committed delivery"""
+    if _stats is not None:
+        for doc in docs:
+            _stats[doc["_id"]] = doc
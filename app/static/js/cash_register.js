@@ -1,3 +1,59 @@
+// Sales waiting to reach the server, kept in IndexedDB so a dropped
+// connection or a page reload does not lose them
+class TransactionQueue {
+    constructor(dbName = 'cash_register', storeName = 'pending_transactions') {
+        this.dbName = dbName;
+        this.storeName = storeName;
+        this.db = null;
+    }
+
+    open() {
+        if (this.db) return Promise.resolve(this.db);
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(this.dbName, 1);
+            request.onupgradeneeded = () => {
+                const store = request.result.createObjectStore(this.storeName, { keyPath: 'client_id' });
+                store.createIndex('register_id', 'register_id');
+            };
+            request.onsuccess = () => {
+                this.db = request.result;
+                resolve(this.db);
+            };
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    async run(mode, action) {
+        const db = await this.open();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(this.storeName, mode);
+            const request = action(tx.objectStore(this.storeName));
+            tx.oncomplete = () => resolve(request ? request.result : undefined);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    put(transaction) {
+        return this.run('readwrite', store => store.put(transaction));
+    }
+
+    async all(registerId) {
+        const items = await this.run('readonly', store => store.index('register_id').getAll(registerId));
+        return items.sort((a, b) => a.queued_at - b.queued_at);
+    }
+
+    remove(clientIds) {
+        return this.run('readwrite', store => {
+            clientIds.forEach(id => store.delete(id));
+        });
+    }
+}
+
+function newClientId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
 class CashRegister {
     constructor() {
         this.currentEntryId = null;
@@ -13,6 +69,19 @@ class CashRegister {
         this.vaultTotal = 0;
         this.loadVaultTotal();
 
+        // Loaded page(s) of transactions, oldest first, and the cursor to older ones
+        this.transactions = [];
+        this.olderCursor = null;
+        // Sequence number of the newest transaction shown
+        this.lastSeq = 0;
+
+        // Offline queue, flushed in batches whenever the network allows
+        this.queue = new TransactionQueue();
+        this.pending = [];
+        this.flushing = false;
+        window.addEventListener('online', () => this.flushQueue());
+        setInterval(() => this.flushQueue(), 15000);
+
         // Initialize immediately
         this.loadInitialData();
         this.initializeEventListeners();
@@ -82,7 +151,9 @@ class CashRegister {
                     initial: register.initial_amount_counted,
                     sales: register.total_income || 0,
                     expenses: register.total_expenses || 0,
-                    balance: register.current_balance || register.initial_amount_counted
+                    balance: register.initial_amount_counted +
+                             (register.total_income || 0) -
+                             (register.total_expenses || 0)
                 };
             }
 
@@ -95,7 +166,11 @@ class CashRegister {
             // Update displays if register is open
             if (register.status === 'open') {
                 this.updateDailyStatus();
-                this.updateTransactionsTable(register.transactions || []);
+                this.transactions = window.initialData.transactions || [];
+                this.olderCursor = window.initialData.transactionsCursor || null;
+                this.lastSeq = register.last_seq || 0;
+                this.updateTransactionsTable(this.transactions);
+                this.restoreQueue();
             }
         } else {
             console.log('No current register found');
@@ -228,61 +303,117 @@ class CashRegister {
         }
 
         try {
-            const response = await fetch(`/api/cash-register/${this.currentEntryId}/transactions`, {
+            // Queue locally first, the sale is recorded even without network
+            const transaction = {
+                client_id: newClientId(),
+                register_id: this.currentEntryId,
+                type,
+                amount,
+                description,
+                time: new Date().toISOString(),
+                queued_at: Date.now()
+            };
+            await this.queue.put(transaction);
+            this.pending.push(transaction);
+            this.updateTransactionsTable(this.transactions);
+
+            // Close modal and reset form
+            const modal = bootstrap.Modal.getInstance(document.getElementById('transactionModal'));
+            modal.hide();
+            document.getElementById('transactionForm').reset();
+
+            this.showAlert('Transacción registrada', 'success');
+            this.flushQueue();
+
+        } catch (error) {
+            console.error('Error:', error);
+            this.showAlert(error.message || 'Error al guardar la transacción', 'danger');
+        }
+    }
+
+    async parkTransactions(transactions, reason) {
+        const parked = transactions.map(t => ({ ...t, parked: true, error: reason }));
+        await Promise.all(parked.map(t => this.queue.put(t)));
+        const byId = new Map(parked.map(t => [t.client_id, t]));
+        this.pending = this.pending.map(t => byId.get(t.client_id) || t);
+        this.updateTransactionsTable(this.transactions);
+    }
+
+    async restoreQueue() {
+        try {
+            this.pending = await this.queue.all(this.currentEntryId);
+            if (this.pending.length) {
+                this.updateTransactionsTable(this.transactions);
+                this.flushQueue();
+            }
+        } catch (error) {
+            console.error('Error loading queued transactions:', error);
+        }
+    }
+
+    async flushQueue() {
+        if (this.flushing || !this.currentEntryId || !navigator.onLine) return;
+        this.flushing = true;
+
+        try {
+            // Parked entries were refused by the server, resending cannot help
+            const queued = (await this.queue.all(this.currentEntryId)).filter(t => !t.parked);
+            if (!queued.length) return;
+
+            const response = await fetch(`/api/cash-register/${this.currentEntryId}/transactions/batch`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
-                    type,
-                    amount,
-                    description
+                    transactions: queued.map(({ client_id, type, amount, description, time }) =>
+                        ({ client_id, type, amount, description, time }))
                 })
             });
-
-            if (!response.ok) throw new Error('Transaction failed');
-
-            const result = await response.json();
-            console.log('Transaction result:', result);
-
-            // Update transactions array and daily totals
-            window.initialData.transactions = result.transactions;
-            
-            // Calculate daily totals
-            this.dailyTotals.sales = 0;
-            this.dailyTotals.expenses = 0;
-            result.transactions.forEach(t => {
-                if (t.type === 'income') {
-                    this.dailyTotals.sales += t.amount;
-                } else {
-                    this.dailyTotals.expenses += t.amount;
+            if (!response.ok) {
+                // A refused batch (register closed or gone) is parked instead
+                // of being retried forever; server errors are retried
+                if (response.status >= 400 && response.status < 500) {
+                    const error = await response.json().catch(() => ({}));
+                    const detail = error.detail || 'No se pudieron sincronizar las transacciones';
+                    await this.parkTransactions(queued, detail);
+                    this.showAlert(detail, 'danger');
                 }
-            });
-            
-            this.dailyTotals.balance = this.dailyTotals.initial + 
-                                     this.dailyTotals.sales - 
-                                     this.dailyTotals.expenses;
+                return;
+            }
 
-            // Update UI
-            this.updateDailyStatus();
-            this.updateTransactionsTable(result.transactions);
+            const result = await response.json();
+            const acked = result.results.map(r => r.client_id);
+            await this.queue.remove(acked);
+            this.pending = this.pending.filter(t => !acked.includes(t.client_id));
 
-            // Keep current vault total and add new transaction
-            if (type === 'income') {
-                this.vaultTotal += amount;
-            } else {
-                this.vaultTotal -= amount;
+            const rejected = result.results.filter(r => r.status === 'rejected');
+            if (rejected.length) {
+                this.showAlert(`${rejected.length} transacción(es) rechazada(s): ${rejected[0].detail}`, 'danger');
             }
-            this.updateVaultDisplay();
-
-            // Close modal and reset form
-            const modal = bootstrap.Modal.getInstance(document.getElementById('transactionModal'));
-            modal.hide();
-            document.getElementById('transactionForm').reset();
 
-            this.showAlert('Transacción guardada correctamente', 'success');
+            // Append in order while contiguous, otherwise fetch what is missing
+            let gap = false;
+            result.results
+                .filter(r => r.status === 'created')
+                .sort((a, b) => a.seq - b.seq)
+                .forEach(r => {
+                    if (!gap && r.seq === this.lastSeq + 1) {
+                        this.transactions.push(r.transaction);
+                        this.lastSeq = r.seq;
+                    } else {
+                        gap = true;
+                    }
+                });
+            if (gap || result.last_seq > this.lastSeq) {
+                await this.resyncTransactions();
+            }
 
+            this.updateTransactionsTable(this.transactions);
+            this.applyTotals(result);
         } catch (error) {
-            console.error('Error:', error);
-            this.showAlert(error.message || 'Error al guardar la transacción', 'danger');
+            // Still offline or the request dropped, the queue is kept for the next try
+            console.warn('Transaction queue not flushed:', error);
+        } finally {
+            this.flushing = false;
         }
     }
 
@@ -291,7 +422,7 @@ class CashRegister {
             const response = await fetch(`/api/cash-register/${this.currentEntryId}/transactions`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ type, amount, description })
+                body: JSON.stringify({ client_id: newClientId(), type, amount, description })
             });
 
             if (!response.ok) {
@@ -301,20 +432,7 @@ class CashRegister {
             const result = await response.json();
             console.log('Transaction result:', result);
 
-            // Update transactions table
-            this.updateTransactionsTable(result.transactions);
-            
-            // Update daily totals
-            if (type === 'income') {
-                this.dailyTotals.sales += amount;
-            } else {
-                this.dailyTotals.expenses += amount;
-            }
-            this.updateDailyStatus();
-
-            // Get updated vault total without resetting
-            await this.updateVaultTotal();
-
+            await this.applyTransactionResult(result);
             return result;
         } catch (error) {
             console.error('Error:', error);
@@ -323,6 +441,68 @@ class CashRegister {
         }
     }
 
+    async applyTransactionResult(result) {
+        // Another client added transactions in between, fetch what we missed
+        if (result.seq !== this.lastSeq + 1) {
+            await this.resyncTransactions();
+        } else {
+            this.appendTransaction(result.transaction);
+            this.lastSeq = result.seq;
+        }
+        this.applyTotals(result);
+    }
+
+    applyTotals(totals) {
+        // Daily totals come precomputed from the register
+        this.dailyTotals.sales = totals.total_income;
+        this.dailyTotals.expenses = totals.total_expenses;
+        this.dailyTotals.balance = this.dailyTotals.initial +
+                                 this.dailyTotals.sales -
+                                 this.dailyTotals.expenses;
+        this.updateDailyStatus();
+
+        // Vault total including the latest transaction, from the server
+        this.vaultTotal = totals.vault_total;
+        this.updateVaultDisplay();
+    }
+
+    async resyncTransactions() {
+        try {
+            let hasMore = true;
+            while (hasMore) {
+                const params = new URLSearchParams({ after_seq: this.lastSeq });
+                const response = await fetch(`/api/cash-register/${this.currentEntryId}/sync?${params}`);
+                if (!response.ok) throw new Error('Error al sincronizar transacciones');
+
+                const sync = await response.json();
+                sync.transactions.forEach(t => this.appendTransaction(t));
+                if (sync.transactions.length) {
+                    this.lastSeq = sync.transactions[sync.transactions.length - 1].seq;
+                }
+                hasMore = sync.has_more;
+                this.applyTotals(sync);
+            }
+        } catch (error) {
+            console.error('Error resyncing transactions:', error);
+            this.showAlert(error.message, 'danger');
+        }
+    }
+
+    appendTransaction(transaction) {
+        if (this.transactions.some(t => t._id === transaction._id)) return;
+        this.transactions.push(transaction);
+        window.initialData.transactions = this.transactions;
+
+        const tbody = document.getElementById('transactionsTableBody');
+        // The first row replaces the empty state and queued rows stay last,
+        // so render the whole table in those cases
+        if (this.transactions.length === 1 || this.pending.length) {
+            this.updateTransactionsTable(this.transactions);
+            return;
+        }
+        tbody.insertAdjacentHTML('beforeend', this.renderTransactionRow(transaction, transaction.balance_after));
+    }
+
     updateDailyStatus() {
         document.getElementById('initialCountDisplay').textContent = 
             this.formatCurrency(this.dailyTotals.initial);
@@ -334,6 +514,24 @@ class CashRegister {
             this.formatCurrency(this.dailyTotals.balance);
     }
 
+    async loadOlderTransactions() {
+        if (!this.olderCursor) return;
+
+        try {
+            const params = new URLSearchParams({ before: this.olderCursor });
+            const response = await fetch(`/api/cash-register/${this.currentEntryId}/transactions?${params}`);
+            if (!response.ok) throw new Error('Error al cargar transacciones anteriores');
+
+            const page = await response.json();
+            this.transactions = [...page.items, ...this.transactions];
+            this.olderCursor = page.next_cursor;
+            this.updateTransactionsTable(this.transactions);
+        } catch (error) {
+            console.error('Error loading older transactions:', error);
+            this.showAlert(error.message, 'danger');
+        }
+    }
+
     updateTransactionsTable(transactions = []) {
         const tbody = document.getElementById('transactionsTableBody');
         let runningBalance = this.dailyTotals.initial;
@@ -344,22 +542,61 @@ class CashRegister {
         );
 
         tbody.innerHTML = sortedTransactions.map(t => {
-            // Calculate running balance
-            if (t.type === 'income') {
+            // Stored balance when available, older pages may not be loaded
+            if (t.balance_after !== undefined && t.balance_after !== null) {
+                runningBalance = t.balance_after;
+            } else if (t.type === 'income') {
                 runningBalance += t.amount;
             } else {
                 runningBalance -= t.amount;
             }
 
-            // Format time
-            const time = new Date(t.time).toLocaleTimeString('es-AR', {
-                hour: '2-digit',
-                minute: '2-digit',
-                hour12: false
-            });
+            return this.renderTransactionRow(t, runningBalance);
+        }).join('') + this.pending.map(t => this.renderTransactionRow(t, null)).join('');
+
+        // Show empty state if no transactions
+        if (sortedTransactions.length === 0 && this.pending.length === 0) {
+            tbody.innerHTML = `
+                <tr>
+                    <td colspan="6" class="text-center text-muted py-4">
+                        <i class="fas fa-info-circle me-2"></i>
+                        No hay transacciones registradas
+                    </td>
+                </tr>
+            `;
+        }
+
+        if (this.olderCursor) {
+            tbody.insertAdjacentHTML('afterbegin', `
+                <tr>
+                    <td colspan="6" class="text-center py-2">
+                        <button type="button" class="btn btn-link btn-sm" id="loadOlderTransactionsBtn">
+                            Cargar transacciones anteriores
+                        </button>
+                    </td>
+                </tr>
+            `);
+            document.getElementById('loadOlderTransactionsBtn')
+                .addEventListener('click', () => this.loadOlderTransactions());
+        }
+    }
 
-            return `
-                <tr class="${t.type === 'income' ? 'table-success' : 'table-danger'} align-middle">
+    renderTransactionRow(t, runningBalance) {
+        // Queued rows have no balance until the server accepts them
+        const pending = runningBalance === null;
+        const status = t.parked
+            ? `<span class="badge bg-danger" title="${t.error || ''}">Rechazada</span>`
+            : '<span class="badge bg-warning text-dark">Pendiente</span>';
+
+        // Format time
+        const time = new Date(t.time).toLocaleTimeString('es-AR', {
+            hour: '2-digit',
+            minute: '2-digit',
+            hour12: false
+        });
+
+        return `
+                <tr class="${pending ? 'table-warning' : t.type === 'income' ? 'table-success' : 'table-danger'} align-middle">
                     <td class="text-nowrap">${time}</td>
                     <td>
                         <span class="badge ${t.type === 'income' ? 'bg-success' : 'bg-danger'}">
@@ -370,23 +607,10 @@ class CashRegister {
                     <td class="text-end fw-bold">
                         ${t.type === 'income' ? '+' : '-'}${this.formatCurrency(t.amount)}
                     </td>
-                    <td class="text-end fw-bold">${this.formatCurrency(runningBalance)}</td>
+                    <td class="text-end fw-bold">${pending ? status : this.formatCurrency(runningBalance)}</td>
                     <td class="text-nowrap">${t.recorded_by || ''}</td>
                 </tr>
             `;
-        }).join('');
-
-        // Show empty state if no transactions
-        if (sortedTransactions.length === 0) {
-            tbody.innerHTML = `
-                <tr>
-                    <td colspan="6" class="text-center text-muted py-4">
-                        <i class="fas fa-info-circle me-2"></i>
-                        No hay transacciones registradas
-                    </td>
-                </tr>
-            `;
-        }
     }
 
     formatCurrency(amount) {
@@ -464,6 +688,13 @@ class CashRegister {
             return;
         }
 
+        // Queued sales must reach the register before it is closed
+        await this.flushQueue();
+        if (this.pending.some(t => !t.parked)) {
+            this.showAlert('Hay transacciones pendientes de sincronizar. Verifique la conexión.', 'warning');
+            return;
+        }
+
         try {
             const response = await fetch(`/api/cash-register/${this.currentEntryId}/close`, {
                 method: 'POST',
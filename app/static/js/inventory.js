@@ -727,6 +727,16 @@ class InventoryManager {
 
     async startWeeklyCount() {
         try {
+            // Start or resume the server-side count session
+            const sessionResponse = await fetch('/api/inventory/start-count', {
+                method: 'POST'
+            });
+            if (!sessionResponse.ok) throw new Error('Failed to start count session');
+
+            const { session, resumed } = await sessionResponse.json();
+            this.countSessionId = session._id;
+            this.dirtyCountLines = new Map();
+
             const tbody = document.getElementById('weeklyCountTable');
             tbody.innerHTML = '';
 
@@ -739,15 +749,18 @@ class InventoryManager {
                 const currentStock = parseFloat(row.querySelector('.current-stock').textContent);
                 const unit = row.cells[2].textContent;
                 const minStock = parseFloat(row.dataset.minStock);
+                const saved = session.lines[itemId];
+                const countedStock = saved ? saved.counted_stock : currentStock;
 
                 const tr = document.createElement('tr');
                 tr.dataset.itemId = itemId;
+                tr.dataset.currentStock = currentStock;
                 tr.innerHTML = `
                     <td>${name}</td>
                     <td>${currentStock}</td>
                     <td>
                         <input type="number" class="form-control form-control-sm counted-stock" 
-                               value="${currentStock}" step="0.1" min="0">
+                               value="${countedStock}" step="0.1" min="0">
                     </td>
                     <td>${unit}</td>
                     <td>${minStock}</td>
@@ -758,7 +771,7 @@ class InventoryManager {
 
                 // Add input handler for real-time status update
                 const input = tr.querySelector('.counted-stock');
-                input.addEventListener('input', () => {
+                const updateStatus = () => {
                     const counted = parseFloat(input.value) || 0;
                     const status = tr.querySelector('.status');
                     if (counted <= 0) {
@@ -768,40 +781,86 @@ class InventoryManager {
                     } else {
                         status.innerHTML = '<span class="badge bg-success">OK</span>';
                     }
+                };
+                input.addEventListener('input', () => {
+                    updateStatus();
+                    this.queueCountLine(itemId, currentStock, parseFloat(input.value) || 0);
                 });
 
                 // Trigger initial status
-                input.dispatchEvent(new Event('input'));
+                updateStatus();
             });
 
             // Show modal
             const modal = new bootstrap.Modal(document.getElementById('weeklyCountModal'));
             modal.show();
 
+            if (resumed) {
+                this.showToast('Conteo en progreso recuperado', 'info');
+            }
+
         } catch (error) {
             console.error('Error starting weekly count:', error);
             this.showToast('Error al iniciar el conteo semanal', 'danger');
         }
     }
 
+    queueCountLine(itemId, currentStock, countedStock) {
+        // Later edits of the same item replace earlier ones
+        this.dirtyCountLines.set(itemId, {
+            item_id: itemId,
+            current_stock: currentStock,
+            counted_stock: countedStock
+        });
+
+        clearTimeout(this.countSaveTimeout);
+        this.countSaveTimeout = setTimeout(() => this.flushCountLines(), 2000);
+    }
+
+    async flushCountLines() {
+        clearTimeout(this.countSaveTimeout);
+        if (!this.countSessionId || this.dirtyCountLines.size === 0) return;
+
+        const lines = Array.from(this.dirtyCountLines.values());
+        this.dirtyCountLines.clear();
+
+        try {
+            const response = await fetch(`/api/inventory/count-sessions/${this.countSessionId}/lines`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ lines: lines })
+            });
+            if (!response.ok) throw new Error('Failed to autosave count');
+        } catch (error) {
+            console.error('Error autosaving count:', error);
+            // Keep the lines for the next attempt unless they were edited again
+            lines.forEach(line => {
+                if (!this.dirtyCountLines.has(line.item_id)) {
+                    this.dirtyCountLines.set(line.item_id, line);
+                }
+            });
+        }
+    }
+
     async saveWeeklyCount() {
+        // Edited lines are already autosaved; only the ones still waiting go
+        // with the finalize call, and items never edited stay as they are
+        clearTimeout(this.countSaveTimeout);
+        const lines = Array.from(this.dirtyCountLines.values());
+        this.dirtyCountLines.clear();
+
         try {
-            const rows = Array.from(document.querySelectorAll('#weeklyCountTable tr'));
             const notes = document.getElementById('weeklyCountNotes').value;
-            
-            const items = rows.map(row => ({
-                item_id: row.dataset.itemId,
-                current_stock: parseFloat(row.cells[1].textContent),
-                counted_stock: parseFloat(row.querySelector('.counted-stock').value) || 0
-            }));
 
-            const response = await fetch('/api/inventory/weekly-count', {
+            const response = await fetch(`/api/inventory/count-sessions/${this.countSessionId}/finalize`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    items: items,
+                    lines: lines,
                     notes: notes
                 })
             });
@@ -809,6 +868,7 @@ class InventoryManager {
             if (!response.ok) throw new Error('Failed to save count');
             
             const result = await response.json();
+            this.countSessionId = null;
 
             // Close modal
             const modal = bootstrap.Modal.getInstance(document.getElementById('weeklyCountModal'));
@@ -816,8 +876,10 @@ class InventoryManager {
             this.cleanupModal();
 
             // Update UI with new stock values
-            items.forEach(item => {
-                this.updateStockDisplay(item.item_id, item.counted_stock);
+            const rows = Array.from(document.querySelectorAll('#weeklyCountTable tr'));
+            rows.forEach(row => {
+                const counted = parseFloat(row.querySelector('.counted-stock').value) || 0;
+                this.updateStockDisplay(row.dataset.itemId, counted);
             });
 
             this.showToast('Conteo semanal guardado correctamente', 'success');
@@ -832,6 +894,12 @@ class InventoryManager {
 
         } catch (error) {
             console.error('Error saving weekly count:', error);
+            // Keep the unsaved lines for the next attempt
+            lines.forEach(line => {
+                if (!this.dirtyCountLines.has(line.item_id)) {
+                    this.dirtyCountLines.set(line.item_id, line);
+                }
+            });
             this.showToast('Error al guardar el conteo semanal', 'danger');
         }
     }
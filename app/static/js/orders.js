@@ -5,54 +5,223 @@ function initializeTooltips() {
     });
 }
 
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value ?? '';
+    return div.innerHTML;
+}
+
+function groupBySupplier(items) {
+    const suppliers = new Map();
+    items.forEach(item => {
+        const supplier = item.supplier || 'SIN PROVEEDOR';
+        if (!suppliers.has(supplier)) suppliers.set(supplier, []);
+        suppliers.get(supplier).push(item);
+    });
+    return suppliers;
+}
+
+function renderSuggestionRow(item) {
+    const minStock = item.min_stock ?? 5;
+    const badge = item.current_stock === 0 ? 'bg-danger'
+        : item.current_stock <= minStock ? 'bg-warning' : 'bg-success';
+    const unit = escapeHtml(item.unit);
+    return `
+        <tr>
+            <td>
+                <input type="checkbox" class="form-check-input me-2 select-suggestion" value="${item.item_id}">
+                ${escapeHtml(item.name)}
+            </td>
+            <td class="text-center">
+                <span class="badge ${badge}">${item.current_stock} ${unit}</span>
+            </td>
+            <td class="text-center">${minStock} ${unit}</td>
+            <td class="text-center">
+                <strong class="text-primary">+ ${item.quantity} ${unit}</strong>
+            </td>
+            <td class="text-center">
+                <button class="btn btn-sm btn-primary create-order"
+                        data-item-id="${item.item_id}"
+                        data-item-name="${escapeHtml(item.name)}"
+                        data-current-stock="${item.current_stock}"
+                        data-suggested-order="${item.quantity}"
+                        data-unit="${unit}">
+                    <i class="fas fa-cart-plus"></i> Order
+                </button>
+            </td>
+        </tr>`;
+}
+
+function renderSuggestions(items) {
+    const section = document.getElementById('suggestionsSection');
+    if (!items.length) {
+        section.innerHTML = `
+            <div class="alert alert-info">
+                <i class="fas fa-info-circle me-2"></i>
+                No hay items que necesiten reposición en este momento.
+            </div>`;
+        return;
+    }
+
+    section.innerHTML = `
+        <div class="d-flex justify-content-end mb-3">
+            <button class="btn btn-primary" id="orderSelected" disabled>
+                <i class="fas fa-cart-plus"></i> Order selected
+            </button>
+        </div>` + Array.from(groupBySupplier(items), ([supplier, rows]) => `
+        <div class="supplier-group mb-4">
+            <div class="card">
+                <div class="card-header">
+                    <div class="d-flex justify-content-between align-items-center">
+                        <h5 class="mb-0">${escapeHtml(supplier)}</h5>
+                        <div>
+                            <span class="badge bg-primary me-2">${rows.length} items</span>
+                            <button class="btn btn-sm btn-outline-primary order-all-btn"
+                                    data-supplier="${escapeHtml(supplier)}">
+                                <i class="fas fa-cart-arrow-down"></i> Order all
+                            </button>
+                        </div>
+                    </div>
+                </div>
+                <div class="card-body p-0">
+                    <div class="table-responsive">
+                        <table class="table table-hover mb-0">
+                            <thead>
+                                <tr>
+                                    <th>Item</th>
+                                    <th class="text-center">Current Stock</th>
+                                    <th class="text-center">Min Stock</th>
+                                    <th class="text-center">To Order</th>
+                                    <th class="text-center">Actions</th>
+                                </tr>
+                            </thead>
+                            <tbody>${rows.map(renderSuggestionRow).join('')}</tbody>
+                        </table>
+                    </div>
+                </div>
+            </div>
+        </div>`).join('');
+}
+
+async function loadSuggestions() {
+    try {
+        const response = await fetch('/api/orders/suggestions');
+        if (!response.ok) throw new Error('Failed to load suggestions');
+        const data = await response.json();
+        renderSuggestions(data.items);
+    } catch (error) {
+        console.error('Error:', error);
+        document.getElementById('suggestionsSection').innerHTML =
+            '<div class="alert alert-danger">Error al cargar las sugerencias.</div>';
+    }
+}
+
+function renderOrderRow(order) {
+    const items = order.items || [];
+    const supplier = order.supplier || (items[0] && items[0].supplier) || '';
+    return `
+        <tr>
+            <td>${order.created_at.slice(0, 16).replace('T', ' ')}</td>
+            <td>${escapeHtml(order.description)}</td>
+            <td>${escapeHtml(supplier)}</td>
+            <td class="text-center">${items.length}</td>
+            <td><span class="badge bg-secondary">${escapeHtml(order.status)}</span></td>
+            <td>${escapeHtml(order.created_by)}</td>
+        </tr>`;
+}
+
+async function loadMoreOrders() {
+    const button = document.getElementById('loadMoreOrders');
+    // Same filters as the page, continuing after the last order shown
+    const params = new URLSearchParams(window.location.search);
+    params.set('before', button.dataset.cursor);
+    button.disabled = true;
+    try {
+        const response = await fetch(`/api/orders?${params}`);
+        if (!response.ok) throw new Error('Failed to load orders');
+        const page = await response.json();
+
+        document.getElementById('ordersBody')
+            .insertAdjacentHTML('beforeend', page.items.map(renderOrderRow).join(''));
+        button.dataset.cursor = page.next_cursor || '';
+        button.style.display = page.next_cursor ? '' : 'none';
+    } catch (error) {
+        console.error('Error:', error);
+        showToast('Error loading orders', 'danger');
+    } finally {
+        button.disabled = false;
+    }
+}
+
 function initializeOrderButtons() {
     const orderConfirmModal = new bootstrap.Modal(document.getElementById('orderConfirmModal'));
     let currentItemId = null;
 
-    // Individual order buttons
-    document.querySelectorAll('.create-order').forEach(button => {
-        button.addEventListener('click', function() {
-            const data = this.dataset;
-            currentItemId = data.itemId;
-            
-            document.getElementById('orderItemName').textContent = data.itemName;
-            document.querySelector('.order-details').innerHTML = `
-                <div class="alert alert-info">
-                    <strong>Current Stock:</strong> ${data.currentStock} ${data.unit}<br>
-                    <strong>Suggested Order:</strong> +${data.suggestedOrder} ${data.unit}
-                </div>
-            `;
-            
-            orderConfirmModal.show();
-        });
+    // Individual order buttons; suggestions are rendered later, so delegate
+    document.getElementById('suggestionsSection').addEventListener('click', function(event) {
+        const button = event.target.closest('.create-order');
+        if (!button) return;
+
+        const data = button.dataset;
+        currentItemId = data.itemId;
+        
+        document.getElementById('orderItemName').textContent = data.itemName;
+        document.querySelector('.order-details').innerHTML = `
+            <div class="alert alert-info">
+                <strong>Current Stock:</strong> ${data.currentStock} ${data.unit}<br>
+                <strong>Suggested Order:</strong> +${data.suggestedOrder} ${data.unit}
+            </div>
+        `;
+        
+        orderConfirmModal.show();
     });
 
-    // Order all buttons
-    document.querySelectorAll('.order-all-btn').forEach(button => {
-        button.addEventListener('click', async function() {
-            const supplier = this.dataset.supplier;
+    // Bulk orders: one order per supplier for a whole group or the selection
+    async function createBulkOrders(payload) {
+        try {
+            const response = await fetch('/api/orders/create-bulk', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(payload)
+            });
+            
+            if (response.ok) {
+                const result = await response.json();
+                showToast(`${result.orders.length} orders created successfully`, 'success');
+                setTimeout(() => window.location.reload(), 1500);
+            } else {
+                throw new Error('Failed to create orders');
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            showToast('Error creating orders', 'danger');
+        }
+    }
+
+    const suggestions = document.getElementById('suggestionsSection');
+    suggestions.addEventListener('click', function(event) {
+        const orderAll = event.target.closest('.order-all-btn');
+        if (orderAll) {
+            const supplier = orderAll.dataset.supplier;
             if (confirm(`Create orders for all items from ${supplier}?`)) {
-                try {
-                    const response = await fetch('/api/orders/create-bulk', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({ supplier: supplier })
-                    });
-                    
-                    if (response.ok) {
-                        showToast('Orders created successfully', 'success');
-                        setTimeout(() => window.location.reload(), 1500);
-                    } else {
-                        throw new Error('Failed to create orders');
-                    }
-                } catch (error) {
-                    console.error('Error:', error);
-                    showToast('Error creating orders', 'danger');
-                }
+                createBulkOrders({ supplier: supplier });
+            }
+            return;
+        }
+
+        if (event.target.closest('#orderSelected')) {
+            const itemIds = Array.from(suggestions.querySelectorAll('.select-suggestion:checked'), box => box.value);
+            if (itemIds.length && confirm(`Create orders for ${itemIds.length} selected items?`)) {
+                createBulkOrders({ item_ids: itemIds });
             }
-        });
+        }
+    });
+    suggestions.addEventListener('change', function(event) {
+        if (!event.target.classList.contains('select-suggestion')) return;
+        const selected = suggestions.querySelectorAll('.select-suggestion:checked').length;
+        document.getElementById('orderSelected').disabled = selected === 0;
     });
 
     // Confirm order button
@@ -82,6 +251,39 @@ function initializeOrderButtons() {
     });
 }
 
+async function generateWeeklyOrders() {
+    const button = document.getElementById('weeklyOrders');
+    button.disabled = true;
+    try {
+        const response = await fetch('/api/purchase-orders/weekly', { method: 'POST' });
+        if (response.status === 404) {
+            showToast('Ningún proveedor necesita pedido esta semana', 'info');
+            return;
+        }
+        if (!response.ok) throw new Error('Failed to generate purchase orders');
+
+        // Download the zip with one sheet per supplier
+        const blob = await response.blob();
+        const match = /filename="?([^"]+)"?/.exec(response.headers.get('Content-Disposition') || '');
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = match ? match[1] : 'pedidos.zip';
+        link.click();
+        URL.revokeObjectURL(link.href);
+
+        showToast(`${response.headers.get('X-Orders-Created')} pedidos generados`, 'success');
+        const deferred = response.headers.get('X-Suppliers-Deferred');
+        if (deferred) {
+            showToast(`Bajo el mínimo, quedan para otra semana: ${deferred}`, 'warning');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        showToast('Error generating purchase orders', 'danger');
+    } finally {
+        button.disabled = false;
+    }
+}
+
 function showToast(message, type = 'success') {
     const toastContainer = document.querySelector('.toast-container');
     if (!toastContainer) return;
@@ -116,6 +318,9 @@ document.addEventListener('DOMContentLoaded', function() {
         console.log('Initializing orders page...');
         initializeTooltips();
         initializeOrderButtons();
+        document.getElementById('loadMoreOrders').addEventListener('click', loadMoreOrders);
+        document.getElementById('weeklyOrders').addEventListener('click', generateWeeklyOrders);
+        loadSuggestions();
         console.log('Orders page initialized successfully');
     } catch (error) {
         console.error('Error initializing orders page:', error);
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from typing import Optional
+from uuid import uuid4
+from fastapi import Request, Response
+
+# Changes on every restart so ETags handed out by a previous process never match
+_EPOCH = uuid4().hex[:12]
+
+# Change counter per collection, bumped by every write path that touches it.
+# Counters live in the application process, which is the single writer to
+# these collections (uvicorn runs one worker). Services that write outside a
+# request (startup backfills, ledger repair) bump as well; the maintenance
+# scripts under scripts/ run in their own process, so restart the app after
+# running them.
+_versions = defaultdict(int)
+
+
+def bump_version(*collections: str) -> None:
+    """Mark collections as changed so cached responses built from them expire"""
+    for name in collections:
+        _versions[name] += 1
+
+
+def collection_etag(*collections: str) -> str:
+    """Strong ETag derived from the change counters of the given collections"""
+    parts = "-".join(f"{name}.{_versions[name]}" for name in collections)
+    return f'"{_EPOCH}-{parts}"'
+
+
+def conditional_get(
+    request: Request,
+    response: Response,
+    *collections: str,
+    cache_control: str = "private, no-cache"
+) -> Optional[Response]:
+    """Answer a conditional GET without doing any work if nothing changed.
+
+    Sets ``ETag`` and ``Cache-Control`` on ``response`` and returns a ready
+    304 response when ``If-None-Match`` already holds the current version,
+    otherwise ``None`` so the handler builds the body as usual.
+    """
+    etag = collection_etag(*collections)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+    return None
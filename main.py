@@ -9,6 +9,10 @@ from app.middleware.auth_middleware import verify_permissions
 from app.database import get_db, init_db
 from app.scripts.init_cash_register import init_cash_register
 from app.utils.constants import ROLES
+from app.services.stock_history import build_checkpoints
+from app.services.ledger_check import nightly_ledger_check
+from app.services.order_suggestions import suggestion_engine
+import asyncio
 import logging
 
 # Configure logging
@@ -65,6 +69,10 @@ async def startup_event():
     await init_db()
     await init_cash_register()
     logger.info("Database initialized successfully")
+    # Catch up stock checkpoints without delaying startup
+    asyncio.create_task(build_checkpoints(await get_db()))
+    asyncio.create_task(nightly_ledger_check(await get_db()))
+    asyncio.create_task(suggestion_engine(await get_db()))
 
 @app.get("/")
 async def root(request: Request):
@@ -0,0 +1,58 @@
+from collections import deque
+from datetime import datetime, timedelta
+import numpy as np
+from app.services.cash_analytics import (
+    DiscrepancyAnalytics,
+    rolling_zscores,
+    window_zscore
+)
+
+def test_first_closes_of_a_group_are_not_scored():
+    values = np.array([1.0, -1.0, 2.0, 0.0, 1.0, -50.0])
+    groups = np.zeros(6, dtype=np.int64)
+    mean, std, z = rolling_zscores(values, groups, window=10, min_history=5)
+
+    assert np.isnan(z[:5]).all()
+    assert mean[5] == np.mean(values[:5])
+    assert z[5] < -3
+
+def test_groups_are_scored_independently():
+    values = np.array([0.0, 100.0, 0.0, 100.0, 0.0, 100.0])
+    groups = np.array([0, 1, 0, 1, 0, 1])
+    mean, _, z = rolling_zscores(values, groups, window=10, min_history=2)
+
+    assert mean[4] == 0.0
+    assert mean[5] == 100.0
+    assert z[4] == 0.0 and z[5] == 0.0
+
+def test_window_only_looks_back_window_values():
+    values = np.array([100.0, 0.0, 0.0, 0.0])
+    mean, _, _ = rolling_zscores(values, np.zeros(4, dtype=np.int64), window=2, min_history=2)
+    assert mean[3] == 0.0
+
+def test_incremental_score_matches_vectorized():
+    values = np.array([2.0, -3.0, 0.5, 1.0, -1.5, 4.0, -20.0])
+    _, _, z = rolling_zscores(values, np.zeros(7, dtype=np.int64), window=4, min_history=3)
+    assert np.isclose(window_zscore(deque(values[2:6], maxlen=4), values[6], min_history=3), z[6])
+
+def test_added_register_can_raise_an_alert():
+    start = datetime(2024, 1, 1)
+    history = {
+        "register_ids": list(range(10)),
+        "dates": [start + timedelta(days=i) for i in range(10)],
+        "responsibles": ["ANA"],
+        "responsible": np.zeros(10, dtype=np.int64),
+        "weekday": np.array([(start + timedelta(days=i)).weekday() for i in range(10)]),
+        "difference": np.array([0.5, -0.5] * 5),
+        "expected_amount": np.full(10, 1000.0)
+    }
+    analytics = DiscrepancyAnalytics().fit(history)
+    assert analytics.alerts == []
+
+    analytics.add({"_id": 10, "date": start + timedelta(days=10), "responsible": "ANA", "difference": -80.0})
+    report = analytics.report()
+
+    assert report["registers"] == 11
+    assert report["alerts"][0]["difference"] == -80.0
+    assert report["by_responsible"][0]["flagged"] == 1
+    assert report["by_responsible"][0]["shortage"] == -82.5
@@ -0,0 +1,41 @@
+import zipfile
+from datetime import datetime
+from bson import ObjectId
+from app.services.cash_export import RangeWorkbook, render_register_xlsx
+
+def make_register(day, number):
+    return {
+        "_id": ObjectId(),
+        "date": datetime(2025, 3, day, 9),
+        "register_number": number,
+        "responsible": "ANA",
+        "status": "closed",
+        "initial_amount_counted": 200.0,
+        "total_income": 150.0,
+        "total_expenses": 20.0,
+        "difference": -5.0
+    }
+
+def make_transactions(day):
+    return [
+        {"type": "income", "amount": 150.0, "description": "Venta", "time": datetime(2025, 3, day, 10), "recorded_by": "ANA"},
+        {"type": "expense", "amount": 20.0, "description": "Hielo", "time": datetime(2025, 3, day, 11), "recorded_by": "ANA"}
+    ]
+
+def test_range_workbook_writes_summary_and_one_sheet_per_day(tmp_path):
+    path = tmp_path / "range.xlsx"
+    workbook = RangeWorkbook(str(path))
+    workbook.add_register(make_register(1, 1), make_transactions(1))
+    workbook.add_register(make_register(1, 2), make_transactions(1))
+    workbook.add_register(make_register(2, 1), make_transactions(2))
+    workbook.close()
+
+    assert workbook.totals == {"registers": 3, "income": 450.0, "expenses": 60.0, "difference": -15.0}
+    with zipfile.ZipFile(path) as archive:
+        sheets = [name for name in archive.namelist() if name.startswith("xl/worksheets/sheet")]
+    assert len(sheets) == 3
+
+def test_single_register_report_is_a_workbook():
+    register = {**make_register(1, 1), "initial_count_time": datetime(2025, 3, 1, 9), "logs": []}
+    content = render_register_xlsx(register, make_transactions(1), 150.0, 20.0, 330.0)
+    assert content[:2] == b"PK"
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+import numpy as np
+from app.services.cash_forecast import IncomeForecaster
+
+ORIGIN = datetime(2024, 1, 1)  # a Monday
+
+def weekly_incomes(weeks, weekend=0.0, growth=0.0):
+    incomes = {}
+    for i in range(weeks * 7):
+        day = ORIGIN + timedelta(days=i)
+        incomes[day] = (weekend if day.weekday() >= 5 else 100.0) + growth * i
+    return incomes
+
+def test_recovers_weekday_profile():
+    model = IncomeForecaster(ORIGIN).fit(weekly_incomes(8, weekend=20.0), ORIGIN + timedelta(days=56))
+    forecast = model.predict(ORIGIN + timedelta(days=56), 7)
+
+    assert np.allclose([f["income"] for f in forecast], [100.0] * 5 + [20.0] * 2)
+    assert model.sigma < 1e-3
+
+def test_missing_days_count_as_closed():
+    incomes = weekly_incomes(4)
+    incomes = {day: value for day, value in incomes.items() if day.weekday() != 6}
+    model = IncomeForecaster(ORIGIN).fit(incomes, ORIGIN + timedelta(days=28))
+    sunday = model.predict(ORIGIN + timedelta(days=34), 1)[0]
+    assert abs(sunday["income"]) < 1e-6
+
+def test_incremental_update_matches_refit():
+    incomes = weekly_incomes(6, growth=2.0)
+    last = ORIGIN + timedelta(days=41)
+    partial = {day: value for day, value in incomes.items() if day < last}
+
+    incremental = IncomeForecaster(ORIGIN).fit(partial, last)
+    incremental.add_income(last, incomes[last] / 2).add_income(last, incomes[last] / 2)
+    refit = IncomeForecaster(ORIGIN).fit(incomes, last + timedelta(days=1))
+
+    assert np.allclose(incremental.coef, refit.coef)
+    assert len(incremental.incomes) == len(refit.incomes)
+
+def test_short_history_is_not_ready():
+    model = IncomeForecaster(ORIGIN).fit(weekly_incomes(1), ORIGIN + timedelta(days=7))
+    assert not model.ready
+
+def test_days_with_open_registers_are_left_out():
+    incomes = weekly_incomes(4)
+    open_day = ORIGIN + timedelta(days=9)
+    del incomes[open_day]
+    model = IncomeForecaster(ORIGIN).fit(incomes, ORIGIN + timedelta(days=28), {open_day})
+
+    assert open_day not in model.incomes
+    assert len(model.incomes) == 27
+    # Not fitted as a zero-sales Wednesday
+    assert np.allclose(model.predict(ORIGIN + timedelta(days=30), 1)[0]["income"], 100.0)
@@ -0,0 +1,189 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+import pytest
+from app.services.cash_register import (
+    batch_increment,
+    dedupe_by_client_id,
+    list_transactions,
+    next_register_number,
+    record_transactions,
+    register_net,
+    register_totals,
+    totals_increment
+)
+from app.services.inventory_query import InvalidCursor, encode_cursor
+
+def test_increment_targets_the_transaction_type():
+    assert totals_increment("income", 12.5) == {"total_income": 12.5, "transaction_count": 1}
+    assert totals_increment("expense", 3.0) == {"total_expenses": 3.0, "transaction_count": 1}
+
+def test_stored_totals_are_used_as_is():
+    register = {
+        "total_income": 100.0,
+        "total_expenses": 40.0,
+        "transaction_count": 7,
+        "transactions": [{"type": "income", "amount": 1.0}]
+    }
+    assert register_totals(register) == {
+        "total_income": 100.0,
+        "total_expenses": 40.0,
+        "transaction_count": 7
+    }
+
+def test_legacy_register_sums_its_transactions():
+    register = {"transactions": [
+        {"type": "income", "amount": 10.0},
+        {"type": "income", "amount": 5.0},
+        {"type": "expense", "amount": 2.5}
+    ]}
+    assert register_totals(register) == {
+        "total_income": 15.0,
+        "total_expenses": 2.5,
+        "transaction_count": 3
+    }
+
+def test_register_net_is_income_minus_expenses():
+    register = {"total_income": 250.0, "total_expenses": 75.5, "transaction_count": 4}
+    assert register_net(register) == {
+        "total_income": 250.0,
+        "total_expenses": 75.5,
+        "net": 174.5
+    }
+
+def test_batch_increment_sums_each_type():
+    transactions = [
+        {"type": "income", "amount": 10.0},
+        {"type": "expense", "amount": 4.0},
+        {"type": "income", "amount": 2.5}
+    ]
+    assert batch_increment(transactions) == {
+        "total_income": 12.5,
+        "total_expenses": 4.0,
+        "transaction_count": 3
+    }
+
+def test_dedupe_skips_stored_and_repeated_client_ids():
+    transactions = [
+        {"client_id": "a", "amount": 1.0},
+        {"client_id": "b", "amount": 2.0},
+        {"client_id": "b", "amount": 2.0},
+        {"amount": 3.0}
+    ]
+    unique = dedupe_by_client_id(transactions, {"a"})
+    assert [t["amount"] for t in unique] == [2.0, 3.0]
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+def test_duplicates_are_acknowledged_after_the_register_closed():
+    register_id = ObjectId()
+    stored = {"client_id": "a", "cash_register_id": register_id, "seq": 1}
+
+    async def find_one(query, projection=None):
+        return {"_id": register_id, "status": "closed", "last_seq": 1}
+
+    async def find_one_and_update(*args, **kwargs):
+        raise AssertionError("nothing new to account")
+
+    db = SimpleNamespace(
+        cash_transactions=SimpleNamespace(find=lambda query: Cursor([stored])),
+        cash_register=SimpleNamespace(find_one=find_one, find_one_and_update=find_one_and_update)
+    )
+    result = asyncio.run(record_transactions(db, register_id, [{"client_id": "a", "type": "income", "amount": 1.0}]))
+    assert result["created"] == []
+    assert result["duplicates"] == [stored]
+
+class Counters:
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        doc = self.docs.get(query["_id"])
+        if doc is None:
+            return None
+        doc["seq"] += update["$inc"]["seq"]
+        return dict(doc)
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], "seq": 0})
+        doc["seq"] = max(doc["seq"], update["$max"]["seq"])
+
+def test_register_numbers_continue_from_the_days_registers():
+    day = datetime(2026, 3, 2, 9, 30)
+    registers = [{"date": datetime(2026, 3, 2), "register_number": 2}, {"date": datetime(2026, 3, 2)}]
+
+    async def count_documents(query):
+        return len(registers)
+
+    async def find_one(query, projection=None, sort=None):
+        return max((r for r in registers if "register_number" in r), key=lambda r: r["register_number"])
+
+    db = SimpleNamespace(
+        counters=Counters(),
+        cash_register=SimpleNamespace(count_documents=count_documents, find_one=find_one)
+    )
+    assert asyncio.run(next_register_number(db, day)) == 3
+    assert asyncio.run(next_register_number(db, day)) == 4
+
+class Session:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        await callback(self)
+
+async def start_session():
+    return Session()
+
+def test_batch_losing_a_client_id_race_is_retried_as_duplicate():
+    register_id = ObjectId()
+    stored = []
+    incs = []
+
+    def find(query):
+        return Cursor([d for d in stored if d["client_id"] in query["client_id"]["$in"]])
+
+    async def insert_many(docs, ordered=True, session=None):
+        # A concurrent retry stores "a" between the lookup and the insert
+        stored.append({"client_id": "a", "cash_register_id": register_id, "seq": 1})
+        raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]})
+
+    async def find_one_and_update(query, update, **kwargs):
+        incs.append(update["$inc"])
+        return {"_id": register_id, "status": "open", "last_seq": 1}
+
+    async def find_one(query, projection=None):
+        return {"_id": register_id, "status": "open", "last_seq": 1}
+
+    db = SimpleNamespace(
+        client=SimpleNamespace(start_session=start_session),
+        cash_transactions=SimpleNamespace(find=find, insert_many=insert_many),
+        cash_register=SimpleNamespace(find_one=find_one, find_one_and_update=find_one_and_update)
+    )
+    result = asyncio.run(record_transactions(db, register_id, [{"client_id": "a", "type": "income", "amount": 1.0}]))
+    assert result["created"] == []
+    assert [d["client_id"] for d in result["duplicates"]] == ["a"]
+    # The aborted attempt accounted once; the transaction discards it
+    assert len(incs) == 1
+
+def test_bad_transactions_cursor_is_rejected():
+    for before in ["garbage", encode_cursor(12, ObjectId())]:
+        with pytest.raises(InvalidCursor):
+            asyncio.run(list_transactions(None, ObjectId(), before=before))
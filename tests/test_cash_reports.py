@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+import pytest
+from app.services.cash_reports import (
+    list_closed_registers,
+    period_start,
+    rollup_totals,
+    rollups_to_store,
+    summarize
+)
+from app.services.inventory_query import InvalidCursor
+
+def day(d, income=0.0, expenses=0.0, registers=1):
+    return {
+        "date": d,
+        "registers": registers,
+        "total_income": income,
+        "total_expenses": expenses,
+        "net": income - expenses
+    }
+
+def test_week_starts_on_monday_and_month_on_the_first():
+    sunday = datetime(2024, 3, 17)
+    assert period_start(sunday, "week") == datetime(2024, 3, 11)
+    assert period_start(sunday, "month") == datetime(2024, 3, 1)
+    assert period_start(sunday, "day") == sunday
+
+def test_summarize_folds_days_into_weeks():
+    rows = [
+        day(datetime(2024, 3, 11), 100.0, 10.0),
+        day(datetime(2024, 3, 12), 50.0, 0.0, registers=2),
+        day(datetime(2024, 3, 18), 20.0, 5.0)
+    ]
+    weeks = summarize(rows, "week")
+
+    assert [w["period_start"] for w in weeks] == [datetime(2024, 3, 11), datetime(2024, 3, 18)]
+    assert weeks[0]["days"] == 2
+    assert weeks[0]["registers"] == 3
+    assert weeks[0]["net"] == 140.0
+    assert weeks[1]["total_expenses"] == 5.0
+
+def test_totals_treat_missing_fields_as_zero():
+    totals = rollup_totals([day(datetime(2024, 1, 1), 10.0), {"date": datetime(2024, 1, 2)}])
+    assert totals["total_income"] == 10.0
+    assert totals["difference"] == 0
+    assert totals["registers"] == 1
+
+def test_register_closed_on_its_own_day_is_stored_the_next_day():
+    closed = {"_id": "2024-03-11", "date": datetime(2024, 3, 11), "registers": 1, "open_registers": 0}
+
+    # Still today: reported live, not stored
+    assert rollups_to_store([closed], set(), datetime(2024, 3, 11)) == []
+    # First read after midnight stores it once
+    assert rollups_to_store([closed], set(), datetime(2024, 3, 12)) == [closed]
+    assert rollups_to_store([closed], {"2024-03-11"}, datetime(2024, 3, 12)) == []
+
+def test_days_with_open_registers_are_not_stored():
+    row = {"_id": "2024-03-11", "date": datetime(2024, 3, 11), "registers": 2, "open_registers": 1}
+    assert rollups_to_store([row], set(), datetime(2024, 3, 12)) == []
+
+def test_bad_register_cursor_is_rejected():
+    with pytest.raises(InvalidCursor):
+        asyncio.run(list_closed_registers(None, datetime(2024, 3, 1), datetime(2024, 4, 1), before="garbage"))
@@ -0,0 +1,151 @@
+import asyncio
+import copy
+from types import SimpleNamespace
+from bson import ObjectId
+import pytest
+from app.services import count_sessions
+from app.services.count_sessions import (
+    COUNT_COMPLETED,
+    COUNT_IN_PROGRESS,
+    finalize_session,
+    get_or_start_session,
+    save_count_lines
+)
+
+USER = {"_id": str(ObjectId()), "username": "ana"}
+
+
+class Sessions:
+    """In-memory count_sessions with just the update operators the service uses"""
+
+    def __init__(self):
+        self.docs = []
+
+    def _find(self, query):
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+    def _apply(self, doc, update):
+        for path, value in update.get("$set", {}).items():
+            target = doc
+            *parents, key = path.split(".")
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[key] = value
+        for key, value in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + value
+
+    async def find_one_and_update(self, query, update, upsert=False, **kwargs):
+        doc = self._find(query)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = {"_id": ObjectId(), **update.get("$setOnInsert", {})}
+            self.docs.append(doc)
+        self._apply(doc, update)
+        return copy.deepcopy(doc)
+
+    async def update_one(self, query, update, **kwargs):
+        doc = self._find(query)
+        if doc is not None:
+            self._apply(doc, update)
+
+
+class Transaction:
+    """Session whose transaction puts the count sessions back on failure"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        snapshot = copy.deepcopy(self.sessions.docs)
+        try:
+            await callback(self)
+        except Exception:
+            self.sessions.docs[:] = snapshot
+            raise
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    async def sync_item_suggestions(db, item_ids, source="engine"):
+        return 0
+
+    monkeypatch.setattr(count_sessions, "sync_item_suggestions", sync_item_suggestions)
+    sessions = Sessions()
+
+    async def start_session():
+        return Transaction(sessions)
+
+    return SimpleNamespace(count_sessions=sessions, client=SimpleNamespace(start_session=start_session))
+
+
+def test_session_is_resumed_instead_of_duplicated(db):
+    first = run(get_or_start_session(db, USER))
+    again = run(get_or_start_session(db, USER))
+
+    assert again["_id"] == first["_id"]
+    assert first["status"] == COUNT_IN_PROGRESS
+    assert len(db.count_sessions.docs) == 1
+
+
+def test_lines_are_merged_by_item(db):
+    session = run(get_or_start_session(db, USER))
+    item_id = str(ObjectId())
+    run(save_count_lines(db, str(session["_id"]), USER, [
+        {"item_id": item_id, "current_stock": 4, "counted_stock": 3}
+    ]))
+    saved = run(save_count_lines(db, str(session["_id"]), USER, [
+        {"item_id": item_id, "current_stock": 4, "counted_stock": 5}
+    ]))
+
+    stored = db.count_sessions.docs[0]
+    assert saved["revision"] == 2
+    assert stored["lines"][item_id]["counted_stock"] == 5.0
+
+
+def test_finalize_applies_lines_once_and_completes(db, monkeypatch):
+    applied = []
+
+    async def write_count(db, user, items, notes="", session=None):
+        applied.append(items)
+        return {"count_id": str(ObjectId()), "items_counted": len(items),
+                "items_below_min": 0, "item_ids": [ObjectId(i["item_id"]) for i in items]}
+
+    monkeypatch.setattr(count_sessions, "write_count", write_count)
+    session = run(get_or_start_session(db, USER))
+    item_id = str(ObjectId())
+    run(save_count_lines(db, str(session["_id"]), USER, [
+        {"item_id": item_id, "current_stock": 4, "counted_stock": 4}
+    ]))
+
+    summary = run(finalize_session(db, str(session["_id"]), USER))
+    assert summary["items_counted"] == 1
+    assert db.count_sessions.docs[0]["status"] == COUNT_COMPLETED
+    # A second submit finds nothing in progress
+    assert run(finalize_session(db, str(session["_id"]), USER)) is None
+    assert len(applied) == 1
+
+
+def test_failed_finalize_leaves_session_resumable(db, monkeypatch):
+    async def write_count(db, user, items, notes="", session=None):
+        raise RuntimeError("bulk write failed")
+
+    monkeypatch.setattr(count_sessions, "write_count", write_count)
+    session = run(get_or_start_session(db, USER))
+    run(save_count_lines(db, str(session["_id"]), USER, [
+        {"item_id": str(ObjectId()), "current_stock": 1, "counted_stock": 2}
+    ]))
+
+    with pytest.raises(RuntimeError):
+        run(finalize_session(db, str(session["_id"]), USER))
+    assert db.count_sessions.docs[0]["status"] == COUNT_IN_PROGRESS
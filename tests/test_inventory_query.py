@@ -0,0 +1,155 @@
+import asyncio
+from types import SimpleNamespace
+from bson import ObjectId
+import pytest
+from app.services.inventory_query import (
+    InvalidCursor,
+    build_filters,
+    decode_cursor,
+    encode_cursor,
+    keyset_filter,
+    page_filter,
+    query_inventory
+)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda d: (d.get(field) is not None, d.get(field)), reverse=direction == -1)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+def matches(doc, query):
+    """Just the operators the keyset filter uses"""
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = doc.get(key)
+            for op, operand in cond.items():
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$gt" and not (value is not None and value > operand):
+                    return False
+                if op == "$lt" and not (value is not None and value < operand):
+                    return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class Inventory:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return Cursor([dict(d) for d in self.docs if matches(d, query)])
+
+    def aggregate(self, pipeline):
+        match = pipeline[0]["$match"]
+        return Cursor([{
+            "total": [{"count": sum(matches(d, match) for d in self.docs)}],
+            "supplier": [], "category": [], "stock_status": []
+        }])
+
+
+def test_filters_map_to_the_match_document():
+    assert build_filters() == {}
+    query = build_filters(q="a.b", supplier="Acme", category="Bebidas", stock_status="low")
+    assert query["supplier"] == "Acme"
+    assert query["category"] == "Bebidas"
+    assert query["stock_status"] == "low"
+    assert query["$or"][0] == {"name": {"$regex": r"a\.b", "$options": "i"}}
+
+
+def test_cursor_round_trip():
+    item_id = ObjectId()
+    assert decode_cursor(encode_cursor("Tomate", item_id)) == ("Tomate", item_id)
+    assert decode_cursor(encode_cursor(None, item_id)) == (None, item_id)
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor("x", ObjectId())[:-4], "WzEsMl0="])
+def test_bad_cursor_is_reported_as_such(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_keyset_continues_after_the_last_row():
+    item_id = ObjectId()
+    assert keyset_filter("name", 1, encode_cursor("B", item_id)) == {"$or": [
+        {"name": {"$gt": "B"}},
+        {"name": "B", "_id": {"$gt": item_id}}
+    ]}
+    # Descending from a missing value stays among the missing values
+    assert keyset_filter("supplier", -1, encode_cursor(None, item_id)) == {
+        "supplier": None, "_id": {"$lt": item_id}
+    }
+
+
+def test_page_filter_combines_filters_and_keyset():
+    cursor = encode_cursor("B", ObjectId())
+    assert page_filter({"supplier": "Acme"}, "name", 1) == {"supplier": "Acme"}
+    assert page_filter({}, "name", 1, cursor) == keyset_filter("name", 1, cursor)
+    assert page_filter({"supplier": "Acme"}, "name", 1, cursor) == {
+        "$and": [{"supplier": "Acme"}, keyset_filter("name", 1, cursor)]
+    }
+
+
+def test_pages_follow_the_next_cursor():
+    docs = [
+        {"_id": ObjectId(), "name": name, "supplier": supplier}
+        for name, supplier in [("a", "X"), ("b", "Y"), ("c", "X"), ("d", "X"), ("e", "X"), ("f", "X")]
+    ]
+    db = SimpleNamespace(inventory=Inventory(docs))
+    filters = build_filters(supplier="X")
+
+    seen, cursor = [], None
+    while True:
+        page = asyncio.run(query_inventory(db, filters, sort="name", limit=2, cursor=cursor))
+        assert page["total"] == 5
+        seen += [row.get("name") for row in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == ["a", "c", "d", "e", "f"]
+
+    # Descending walks the same rows backwards
+    page = asyncio.run(query_inventory(db, filters, sort="name", direction=-1, limit=3))
+    page = asyncio.run(query_inventory(db, filters, sort="name", direction=-1, limit=3,
+                                       cursor=page["next_cursor"]))
+    assert [row.get("name") for row in page["items"]] == ["c", "a"]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_paging_returns_rows_with_and_without_the_sort_value_once(direction):
+    suppliers = ["B", None, "A", "B", None, "C", "A", None]
+    docs = [{"_id": ObjectId(), "name": f"item{i}", "supplier": s} for i, s in enumerate(suppliers)]
+    del docs[4]["supplier"]
+    db = SimpleNamespace(inventory=Inventory(docs))
+
+    seen, cursor = [], None
+    while True:
+        page = asyncio.run(query_inventory(db, {}, sort="supplier", direction=direction,
+                                           limit=3, cursor=cursor))
+        seen += [row.id for row in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(d["_id"] for d in docs)
+    assert len(seen) == len(set(seen))
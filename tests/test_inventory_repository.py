@@ -0,0 +1,32 @@
+from datetime import datetime
+from bson import ObjectId
+from app.repositories.inventory import PAGE_VIEW, API_VIEW, SEARCH_VIEW
+
+def test_row_applies_view_defaults_and_converts_numbers():
+    doc = {"_id": ObjectId(), "name": "OREO", "current_stock": 3, "supplier": "AMAZON"}
+    row = PAGE_VIEW.row(doc)
+
+    assert row.get("current_stock") == 3.0
+    assert isinstance(row.get("current_stock"), float)
+    assert row.get("min_stock") == 5.0
+    assert row.get("category") == "Sin Categoría"
+    assert row.get("notes") is None
+
+def test_views_only_project_their_own_fields():
+    assert "notes" not in PAGE_VIEW.projection
+    assert "notes" in API_VIEW.projection
+    assert set(SEARCH_VIEW.projection) == {"name", "supplier", "category", "current_stock", "unit"}
+
+def test_edge_conversions():
+    item_id = ObjectId()
+    updated = datetime(2025, 3, 1, 12, 30)
+    row = API_VIEW.row({"_id": item_id, "name": "NUTELLA", "last_updated": updated})
+
+    template_item = row.to_template()
+    assert template_item["_id"] == str(item_id)
+    assert template_item["last_updated"] is updated
+
+    json_item = row.to_json()
+    assert json_item["_id"] == str(item_id)
+    assert json_item["last_updated"] == "2025-03-01T12:30:00"
+    assert json_item["to_order"] == 0.0
@@ -0,0 +1,40 @@
+from bson import ObjectId
+from app.services.ledger_check import fold_movements
+
+def test_fold_starts_from_checkpoint_level():
+    item_id = ObjectId()
+    movements = [
+        {"item_id": item_id, "quantity": 4, "movement_type": "add"},
+        {"item_id": item_id, "quantity": -1, "movement_type": "subtract"}
+    ]
+    assert fold_movements(movements, {str(item_id): 10.0}) == {item_id: 13.0}
+
+def test_fold_resets_on_count_and_set():
+    first, second = ObjectId(), ObjectId()
+    movements = [
+        {"item_id": first, "quantity": 5},
+        {"item_id": first, "quantity": 2, "new_stock": 8, "movement_type": "count"},
+        {"item_id": first, "quantity": 1},
+        {"item_id": second, "quantity": -3, "new_stock": 0, "movement_type": "set"}
+    ]
+    assert fold_movements(movements, {}) == {first: 9.0, second: 0.0}
+
+def test_item_created_with_stock_starts_from_its_first_movement():
+    item_id = ObjectId()
+    movements = [{"item_id": item_id, "quantity": 3, "previous_stock": 12, "new_stock": 15, "movement_type": "add"}]
+    unseeded = set()
+    assert fold_movements(movements, {}, unseeded) == {item_id: 15.0}
+    assert unseeded == set()
+
+def test_unknown_opening_stock_is_unseeded_until_counted():
+    item_id = ObjectId()
+    unseeded = set()
+    fold_movements([{"item_id": item_id, "quantity": 3, "movement_type": "add"}], {}, unseeded)
+    assert unseeded == {item_id}
+
+    unseeded = set()
+    fold_movements([
+        {"item_id": item_id, "quantity": 3, "movement_type": "add"},
+        {"item_id": item_id, "quantity": 0, "new_stock": 9, "movement_type": "count"}
+    ], {}, unseeded)
+    assert unseeded == set()
@@ -0,0 +1,134 @@
+import asyncio
+from types import SimpleNamespace
+from bson import ObjectId
+from app.services import order_suggestions
+from app.services.order_suggestions import (
+    PRIORITY_LOW,
+    PRIORITY_OUT,
+    adjust_pending_count,
+    items_on_order,
+    order_suggested_lines,
+    set_pending_count,
+    subscribe_pending_count,
+    suggestion_line,
+    unsubscribe_pending_count
+)
+
+def test_quantity_fills_up_to_max_stock():
+    line = suggestion_line({"name": "Harina", "current_stock": 4, "max_stock": 20, "stock_status": "low"})
+    assert line["quantity"] == 16
+    assert line["priority"] == PRIORITY_LOW
+
+def test_out_of_stock_items_come_first_with_default_max():
+    line = suggestion_line({"name": "Sal", "current_stock": 0, "stock_status": "out"})
+    assert line["quantity"] == 30
+    assert line["priority"] == PRIORITY_OUT
+
+def test_quantity_is_never_negative():
+    line = suggestion_line({"current_stock": 50, "max_stock": 20, "stock_status": "low"})
+    assert line["quantity"] == 0
+
+def test_pending_count_pushes_latest_value(monkeypatch):
+    # Module state; monkeypatch puts the original back after the test
+    monkeypatch.setattr(order_suggestions, "_pending_count", None)
+    set_pending_count(5)
+    queue = subscribe_pending_count()
+    adjust_pending_count(2)
+    adjust_pending_count(-10)
+    unsubscribe_pending_count(queue)
+
+    # Only the latest count is queued and it never goes below zero
+    assert queue.qsize() == 1
+    assert queue.get_nowait() == 0
+
+def test_items_on_open_orders_are_looked_up_by_string_id():
+    queries = []
+    drafted = ObjectId()
+
+    async def distinct(field, query):
+        queries.append((field, query))
+        return ["a1"]
+
+    async def drafted_items(field, query):
+        queries.append((field, query))
+        return [drafted]
+
+    db = SimpleNamespace(
+        orders=SimpleNamespace(distinct=distinct),
+        purchase_orders=SimpleNamespace(distinct=drafted_items)
+    )
+    item_id = ObjectId()
+    assert asyncio.run(items_on_order(db, [item_id])) == {"a1", str(drafted)}
+
+    field, query = queries[0]
+    assert field == "items.item_id"
+    assert query["status"] == {"$in": ["PENDING", "ORDERED", "PARTIAL"]}
+    assert query["items.item_id"] == {"$in": [str(item_id)]}
+    # Draft purchase orders keep the suggestion's ObjectId
+    field, query = queries[1]
+    assert field == "lines.item_id"
+    assert query == {"status": "draft", "lines.item_id": {"$in": [item_id]}}
+
+
+class Session:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        await callback(self)
+
+
+class Lines:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        return self
+
+    async def to_list(self, n):
+        return self.docs
+
+
+def test_ordered_lines_are_taken_once(monkeypatch):
+    monkeypatch.setattr(order_suggestions, "_pending_count", 2)
+    lines = [
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Harina", "supplier": "A", "quantity": 3,
+         "status": "pending"},
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Sal", "supplier": None, "quantity": 1,
+         "status": "pending"}
+    ]
+    inserted = []
+
+    def find(query, session=None):
+        return Lines([l for l in lines if l["status"] == query["status"]])
+
+    async def insert_many(orders, session=None):
+        ids = [ObjectId() for _ in orders]
+        inserted.extend(orders)
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def bulk_write(operations, ordered=True, session=None):
+        for operation in operations:
+            line = next(l for l in lines if l["_id"] == operation._filter["_id"])
+            line.update(operation._doc["$set"])
+        return SimpleNamespace(modified_count=len(operations))
+
+    async def start_session():
+        return Session()
+
+    db = SimpleNamespace(
+        client=SimpleNamespace(start_session=start_session),
+        order_suggestions=SimpleNamespace(find=find, bulk_write=bulk_write),
+        orders=SimpleNamespace(insert_many=insert_many)
+    )
+    outcome = asyncio.run(order_suggested_lines(db, {}, "ana"))
+    assert sorted(o["supplier"] for o in outcome["orders"]) == ["A", "SIN PROVEEDOR"]
+    assert all(l["status"] == "processed" for l in lines)
+    assert order_suggestions._pending_count == 0
+
+    # A repeated submission finds nothing left to order
+    assert asyncio.run(order_suggested_lines(db, {}, "ana")) is None
+    assert len(inserted) == 2
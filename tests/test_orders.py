@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+import pytest
+from app.services.inventory_query import InvalidCursor, encode_cursor
+from app.services.orders import build_order_filters, list_orders, supplier_orders
+
+def test_no_filters_match_everything():
+    assert build_order_filters() == {}
+
+def test_filters_combine():
+    start, end = datetime(2024, 5, 1), datetime(2024, 6, 1)
+    assert build_order_filters("PENDING", "ACME", start, end) == {
+        "status": "PENDING",
+        "items.supplier": "ACME",
+        "created_at": {"$gte": start, "$lt": end}
+    }
+
+def test_open_ended_date_range():
+    end = datetime(2024, 6, 1)
+    assert build_order_filters(end=end) == {"created_at": {"$lt": end}}
+
+def test_suggestions_become_one_order_per_supplier():
+    lines = [
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Harina", "supplier": "MOLINO", "quantity": 10},
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Leche", "supplier": "LACTEOS", "quantity": 5},
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Azucar", "supplier": "MOLINO", "quantity": 3},
+        {"_id": ObjectId(), "item_id": ObjectId(), "name": "Sal", "supplier": None, "quantity": 1}
+    ]
+    orders = supplier_orders(lines, "ana", datetime(2024, 5, 1))
+
+    assert [o["supplier"] for o in orders] == ["LACTEOS", "MOLINO", "SIN PROVEEDOR"]
+    assert [line["name"] for line in orders[1]["items"]] == ["Harina", "Azucar"]
+    assert orders[1]["items"][0]["item_id"] == str(lines[0]["item_id"])
+    assert orders[1]["items"][0]["suggested_order"] == 10
+    assert all(o["status"] == "PENDING" and o["created_by"] == "ana" for o in orders)
+
+@pytest.mark.parametrize("before", ["garbage", encode_cursor("not a date", ObjectId())])
+def test_bad_cursor_is_rejected_before_querying(before):
+    # No collection is needed: the cursor fails first
+    with pytest.raises(InvalidCursor):
+        asyncio.run(list_orders(None, {}, before=before))
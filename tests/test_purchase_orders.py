@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from bson import ObjectId
+from app.services.purchase_orders import (
+    consume_suggestions,
+    plan_purchase_orders,
+    render_purchase_order_xlsx,
+    restock_order,
+    week_start
+)
+
+WEEK = datetime(2024, 5, 6)  # a Monday
+
+def line(name, supplier, quantity):
+    return {"_id": ObjectId(), "item_id": ObjectId(), "name": name, "supplier": supplier, "quantity": quantity,
+            "current_stock": 1, "unit": "cajas", "presentation": "CAJA"}
+
+def test_week_starts_on_monday():
+    assert week_start(datetime(2024, 5, 9, 15, 30)) == WEEK
+    assert week_start(WEEK) == WEEK
+
+def test_orders_use_supplier_weekday_and_defer_below_minimum():
+    suggestions = [
+        line("OREO", "AMAZON", 4),
+        line("NUTELLA", "COSTCO", 2),
+        line("BROWNIE", "COSTCO", 3),
+        line("SPRITE", "COSTCO", 0)
+    ]
+    suppliers = {
+        "COSTCO": {"order_weekday": 3},
+        "AMAZON": {"min_lines": 2}
+    }
+    orders, deferred = plan_purchase_orders(suggestions, suppliers, WEEK)
+
+    assert [o["supplier"] for o in orders] == ["COSTCO"]
+    assert orders[0]["order_date"] == datetime(2024, 5, 9)
+    assert [l["name"] for l in orders[0]["lines"]] == ["BROWNIE", "NUTELLA"]
+    assert orders[0]["total_units"] == 5
+    assert deferred[0]["supplier"] == "AMAZON" and deferred[0]["lines"] == 1
+
+def test_sheet_renders_as_xlsx():
+    orders, _ = plan_purchase_orders([line("OREO", "AMAZON / USA", 4)], {}, WEEK)
+    content = render_purchase_order_xlsx(orders[0])
+    assert content[:2] == b"PK"
+
+def test_sent_order_opens_a_receivable_restock_order():
+    orders, _ = plan_purchase_orders([line("OREO", "COSTCO", 4), line("NUTELLA", "COSTCO", 2)], {}, WEEK)
+    order = {**orders[0], "_id": ObjectId()}
+    restock = restock_order(order, "ana", WEEK)
+
+    assert restock["status"] == "ORDERED"
+    assert restock["purchase_order_id"] == order["_id"]
+    assert [l["item_id"] for l in restock["items"]] == [str(l["item_id"]) for l in order["lines"]]
+    assert [l["quantity"] for l in restock["items"]] == [2, 4]
+
+def test_generated_orders_take_their_suggestion_lines():
+    taken = line("OREO", "COSTCO", 4)
+    orders, _ = plan_purchase_orders([taken], {}, WEEK)
+    orders[0]["_id"] = ObjectId()
+    draft = ObjectId()
+    writes = []
+
+    async def count_documents(query, session=None):
+        return 1
+
+    async def bulk_write(operations, ordered=True, session=None):
+        writes.extend(operations)
+
+    async def update_many(query, update, session=None):
+        assert query["purchase_order_id"] == {"$in": [draft]}
+        return SimpleNamespace(modified_count=1)
+
+    db = SimpleNamespace(order_suggestions=SimpleNamespace(
+        count_documents=count_documents, bulk_write=bulk_write, update_many=update_many
+    ))
+    delta = asyncio.run(consume_suggestions(db, orders, [draft], WEEK))
+
+    [operation] = writes
+    assert operation._filter["_id"] == taken["_id"]
+    assert operation._doc["$set"]["purchase_order_id"] == orders[0]["_id"]
+    # One pending line taken, one line of the replaced draft back to pending
+    assert delta == 0
+
+def test_sheet_renders_lines_without_stock():
+    order = {**plan_purchase_orders([line("OREO", "COSTCO", 4)], {}, WEEK)[0][0]}
+    order["lines"][0]["current_stock"] = None
+    assert render_purchase_order_xlsx(order)[:2] == b"PK"
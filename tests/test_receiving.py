@@ -0,0 +1,47 @@
+from app.services.receiving import (
+    ORDER_PARTIAL,
+    ORDER_RECEIVED,
+    ORDER_RECEIVED_SHORT,
+    plan_receipt
+)
+
+ORDER = {"items": [
+    {"item_id": "a", "name": "Harina", "suggested_order": 10},
+    {"item_id": "b", "name": "Leche", "suggested_order": 4}
+]}
+
+def test_full_delivery_closes_order():
+    plan = plan_receipt(ORDER, {"a": 10, "b": 4})
+    assert plan["status"] == ORDER_RECEIVED
+    assert plan["increments"] == {"a": 10, "b": 4}
+    assert [line["short"] for line in plan["lines"]] == [0, 0]
+
+def test_short_delivery_is_written_off_when_closing():
+    plan = plan_receipt(ORDER, {"a": 7})
+    assert plan["status"] == ORDER_RECEIVED_SHORT
+    assert plan["increments"] == {"a": 7}
+    assert [line["short"] for line in plan["lines"]] == [3, 4]
+
+def test_partial_delivery_keeps_order_open():
+    first = plan_receipt(ORDER, {"a": 7}, close=False)
+    assert first["status"] == ORDER_PARTIAL
+
+    second = plan_receipt({"items": first["lines"]}, {"a": 3, "b": 4})
+    assert second["status"] == ORDER_RECEIVED
+    assert second["increments"] == {"a": 3, "b": 4}
+    assert [line["received"] for line in second["lines"]] == [10, 4]
+
+def test_item_on_two_lines_is_counted_once():
+    order = {"items": [
+        {"item_id": "a", "name": "Harina", "quantity": 4},
+        {"item_id": "b", "name": "Leche", "quantity": 2},
+        {"item_id": "a", "name": "Harina", "quantity": 6}
+    ]}
+    plan = plan_receipt(order, {"a": 7, "b": 2})
+    assert plan["increments"] == {"a": 7, "b": 2}
+    assert [line["received"] for line in plan["lines"]] == [4, 2, 3]
+
+    # Excess goes to the item's last line
+    plan = plan_receipt(order, {"a": 12, "b": 2})
+    assert [line["received"] for line in plan["lines"]] == [4, 2, 8]
+    assert plan["status"] == ORDER_RECEIVED
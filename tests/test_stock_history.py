@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import numpy as np
+from bson import ObjectId
+from app.services.stock_history import (
+    build_checkpoints,
+    created_after,
+    opening_levels,
+    replay,
+    stock_as_of
+)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+def test_replay_sums_deltas_per_item():
+    base = np.array([10.0, 5.0])
+    codes = np.array([0, 1, 0])
+    deltas = np.array([2.0, -1.0, 3.0])
+    absolute = np.array([False, False, False])
+    new_stock = np.array([12.0, 4.0, 15.0])
+
+    assert replay(base, codes, deltas, absolute, new_stock).tolist() == [15.0, 4.0]
+
+def test_replay_restarts_from_last_count():
+    base = np.array([10.0, 0.0])
+    codes = np.array([0, 0, 0, 1])
+    deltas = np.array([2.0, 99.0, -3.0, 7.0])
+    absolute = np.array([False, True, False, False])
+    new_stock = np.array([12.0, 20.0, 17.0, 7.0])
+
+    # The count sets item 0 to 20, only the later -3 applies on top
+    assert replay(base, codes, deltas, absolute, new_stock).tolist() == [17.0, 7.0]
+
+def test_replay_without_movements_keeps_base():
+    base = np.array([4.0, 8.0])
+    empty = np.array([], dtype=np.int64)
+    result = replay(base, empty, empty.astype(float), empty.astype(bool), empty.astype(float))
+    assert result.tolist() == [4.0, 8.0]
+
+def test_item_created_with_stock_replays_from_its_opening_level():
+    in_checkpoint, created = ObjectId(), ObjectId()
+    base = opening_levels([in_checkpoint, created], {str(in_checkpoint): 6.0}, np.array([1.0, 12.0]))
+    assert base.tolist() == [6.0, 12.0]
+
+    # Created with 12, then one +3 movement
+    levels = replay(base, np.array([1]), np.array([3.0]), np.array([False]), np.array([15.0]))
+    assert levels.tolist() == [6.0, 15.0]
+
+def test_unrecorded_opening_level_stays_unknown_until_a_count():
+    base = opening_levels([ObjectId(), ObjectId()], {}, np.array([np.nan, np.nan]))
+    assert np.isnan(base).all()
+
+    # A delta on an unknown level is still unknown, a count grounds it
+    levels = replay(base, np.array([0, 1, 1]), np.array([3.0, 0.0, -2.0]),
+                    np.array([False, True, False]), np.array([3.0, 10.0, 8.0]))
+    assert np.isnan(levels[0])
+    assert levels[1] == 8.0
+
+def test_items_created_after_the_moment_are_told_apart():
+    at = datetime(2024, 3, 1)
+    assert created_after({"_id": ObjectId(), "created_at": datetime(2024, 3, 2)}, at)
+    assert not created_after({"_id": ObjectId(), "created_at": datetime(2024, 2, 1)}, at)
+    # Without created_at the id's timestamp tells when it was inserted
+    assert created_after({"_id": ObjectId.from_datetime(datetime(2024, 3, 2))}, at)
+    assert not created_after({"_id": ObjectId.from_datetime(datetime(2024, 2, 1))},
+                             datetime(2024, 3, 1, tzinfo=timezone.utc))
+
+def test_unknown_levels_are_none_and_left_out_of_checkpoints():
+    item_id = ObjectId()
+    movement = {"item_id": item_id, "quantity": 2.0, "new_stock": 2.0, "movement_type": "in",
+                "timestamp": datetime(2024, 3, 1, 10)}
+    stored = {}
+
+    class Movements:
+        def find(self, query, projection=None):
+            return Cursor([movement])
+
+        async def find_one(self, *args, **kwargs):
+            return movement
+
+    class Checkpoints:
+        async def find_one(self, *args, **kwargs):
+            return None
+
+        async def update_one(self, query, update, upsert=False):
+            stored[query["as_of"]] = update["$set"]["stocks"]
+
+    db = SimpleNamespace(stock_movements=Movements(), stock_checkpoints=Checkpoints())
+    state = asyncio.run(stock_as_of(db, datetime(2024, 3, 2)))
+    assert state["stocks"] == {str(item_id): None}
+
+    assert asyncio.run(build_checkpoints(db, until=datetime(2024, 3, 8))) == 1
+    assert list(stored.values()) == [{}]
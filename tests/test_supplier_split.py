@@ -0,0 +1,75 @@
+import random
+import time
+from app.services.supplier_split import delivery_days, split_restock
+
+def config(**overrides):
+    return {
+        "order_weekday": 0,
+        "delivery_weekdays": None,
+        "min_lines": 1,
+        "min_units": 0,
+        "min_order_amount": 0,
+        "delivery_fee": 0,
+        **overrides
+    }
+
+def line(item_id, quantity, supplier="COSTCO", urgent=False):
+    return {"item_id": item_id, "quantity": quantity, "supplier": supplier, "urgent": urgent}
+
+def test_delivery_days_from_order_weekday():
+    assert delivery_days(config()) == 1
+    assert delivery_days(config(order_weekday=0, delivery_weekdays=[3])) == 3
+    assert delivery_days(config(order_weekday=4, delivery_weekdays=[0])) == 3
+
+def test_each_line_goes_to_cheapest_supplier():
+    offers = {"a": {"COSTCO": 2.0, "SYSCO": 1.5}, "b": {"COSTCO": 1.0, "SYSCO": 1.2}}
+    result = split_restock(
+        [line("a", 10), line("b", 10)], offers, {"COSTCO": config(), "SYSCO": config()}
+    )
+    assert [l["supplier"] for l in result["lines"]] == ["SYSCO", "COSTCO"]
+    assert result["cost"] == 25
+
+def test_delivery_fee_consolidates_small_orders():
+    offers = {"a": {"COSTCO": 2.0, "SYSCO": 1.5}, "b": {"COSTCO": 1.0, "SYSCO": 1.2}}
+    configs = {"COSTCO": config(delivery_fee=20), "SYSCO": config(delivery_fee=20)}
+    result = split_restock([line("a", 10), line("b", 10)], offers, configs)
+    assert {l["supplier"] for l in result["lines"]} == {"SYSCO"}
+    assert result["cost"] == 47
+
+def test_minimum_order_is_met_or_supplier_dropped():
+    offers = {"a": {"COSTCO": 1.0, "AMAZON": 0.9}, "b": {"COSTCO": 1.0, "AMAZON": 1.1}}
+    configs = {"COSTCO": config(), "AMAZON": config(min_order_amount=50)}
+    result = split_restock([line("a", 10), line("b", 10)], offers, configs)
+    assert {l["supplier"] for l in result["lines"]} == {"COSTCO"}
+    assert result["below_minimum"] == []
+
+def test_urgent_lines_need_fast_delivery():
+    offers = {"a": {"COSTCO": 1.0, "AMAZON": 0.5}}
+    configs = {"COSTCO": config(), "AMAZON": config(delivery_weekdays=[4])}
+    assert split_restock([line("a", 1, urgent=True)], offers, configs)["lines"][0]["supplier"] == "COSTCO"
+    assert split_restock([line("a", 1)], offers, configs)["lines"][0]["supplier"] == "AMAZON"
+
+def test_items_without_price_list_keep_their_supplier():
+    result = split_restock([line("a", 3, supplier="LIZ")], {}, {"LIZ": config()})
+    assert result["lines"][0]["supplier"] == "LIZ"
+    assert result["lines"][0]["unit_price"] == 0
+
+def test_whole_catalogue_splits_quickly():
+    rng = random.Random(7)
+    suppliers = ["COSTCO", "SYSCO", "WALLMART", "AMAZON"]
+    configs = {
+        name: config(min_order_amount=rng.choice([0, 100, 300]), delivery_fee=rng.choice([0, 15]),
+                     delivery_weekdays=[rng.randrange(7)])
+        for name in suppliers
+    }
+    lines, offers = [], {}
+    for i in range(2000):
+        item_id = str(i)
+        sellers = rng.sample(suppliers, rng.randint(1, 4))
+        offers[item_id] = {name: round(rng.uniform(1, 20), 2) for name in sellers}
+        lines.append(line(item_id, rng.randint(1, 12), supplier=sellers[0], urgent=rng.random() < 0.2))
+
+    started = time.perf_counter()
+    result = split_restock(lines, offers, configs)
+    assert time.perf_counter() - started < 1.0
+    assert all(l["supplier"] in offers[l["item_id"]] for l in result["lines"])
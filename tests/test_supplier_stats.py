@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.services.supplier_stats import (
+    MIN_OBSERVATIONS,
+    reorder_point,
+    restock_quantity,
+    supplier_observations,
+    update_supplier_stats
+)
+
+def stats_for(lead_times, fill_rates=()):
+    stats = None
+    for lead_time in lead_times:
+        stats = update_supplier_stats(stats, lead_time=lead_time)
+    for fill_rate in fill_rates:
+        stats = update_supplier_stats(stats, fill_rate=fill_rate)
+    return stats
+
+def test_rolling_stats_follow_recent_deliveries():
+    stats = stats_for([2, 2, 2, 9])
+    assert stats["deliveries"] == 4
+    assert 2 < stats["lead_time_mean"] < 9
+    assert stats["lead_time_var"] > 0
+
+def test_defaults_until_enough_deliveries():
+    stats = stats_for([1] * (MIN_OBSERVATIONS - 1))
+    assert reorder_point(10, stats) == 10
+    assert restock_quantity(4, 10, 30, stats) == 26
+
+def test_fast_steady_supplier_lowers_the_reorder_point():
+    stats = stats_for([2, 2, 2], [1, 1, 1])
+    assert reorder_point(14, stats) == 4
+    assert restock_quantity(4, 14, 30, stats) == 16
+
+def test_slow_short_supplier_raises_order():
+    stats = stats_for([7, 10, 14], [0.8, 0.8, 0.8])
+    assert reorder_point(14, stats) > 14
+    assert restock_quantity(4, 14, 30, stats) > 26
+
+def test_observations_per_supplier():
+    created = datetime(2024, 5, 1)
+    order = {"_id": ObjectId(), "created_at": created, "items": [
+        {"item_id": "a", "supplier": "MOLINO", "suggested_order": 10},
+        {"item_id": "b", "supplier": "LACTEOS", "suggested_order": 4, "received": 4}
+    ]}
+    lines = [
+        {**order["items"][0], "received": 8},
+        order["items"][1]
+    ]
+    observations = supplier_observations(order, lines, {"a": 8}, created + timedelta(days=3), True)
+
+    # LACTEOS arrived in an earlier delivery, only its fill rate is new
+    assert observations["MOLINO"] == {"lead_time": 3, "fill_rate": 0.8}
+    assert observations["LACTEOS"] == {"lead_time": None, "fill_rate": 1.0}
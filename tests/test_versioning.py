@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from app.services.inventory import refresh_stock_status
+from app.utils.versioning import bump_version, collection_etag, conditional_get
+
+app = FastAPI()
+calls = {"count": 0}
+
+@app.get("/items")
+async def get_items(request: Request, response: Response):
+    not_modified = conditional_get(request, response, "test_items")
+    if not_modified:
+        return not_modified
+    calls["count"] += 1
+    return {"items": []}
+
+client = TestClient(app)
+
+def test_etag_changes_when_collection_is_bumped():
+    before = collection_etag("test_items")
+    bump_version("test_items")
+    assert collection_etag("test_items") != before
+
+def test_if_none_match_returns_304_without_running_handler():
+    first = client.get("/items")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    handled = calls["count"]
+
+    response = client.get("/items", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert calls["count"] == handled
+
+def test_stale_etag_gets_full_response():
+    etag = client.get("/items").headers["etag"]
+    bump_version("test_items")
+
+    response = client.get("/items", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+def test_stock_status_refresh_expires_inventory_etag():
+    class Inventory:
+        def __init__(self, modified):
+            self.modified = modified
+
+        async def update_many(self, query, update):
+            return SimpleNamespace(modified_count=self.modified)
+
+    before = collection_etag("inventory")
+    asyncio.run(refresh_stock_status(SimpleNamespace(inventory=Inventory(0))))
+    assert collection_etag("inventory") == before
+    asyncio.run(refresh_stock_status(SimpleNamespace(inventory=Inventory(2))))
+    assert collection_etag("inventory") != before